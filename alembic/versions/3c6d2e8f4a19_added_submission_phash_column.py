@@ -0,0 +1,27 @@
+"""Added phash column for duplicate detection
+
+Revision ID: 3c6d2e8f4a19
+Revises: e81f5b6c0a27
+Create Date: 2021-03-15 19:04:12.518230-05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c6d2e8f4a19'
+down_revision = 'e81f5b6c0a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing submissions are left unhashed, as their images would have to be downloaded again.
+    with op.batch_alter_table('submission', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phash', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('submission', schema=None) as batch_op:
+        batch_op.drop_column('phash')
@@ -0,0 +1,69 @@
+"""Normalize Submission.votes into a vote table
+
+Revision ID: 5f3a9d21c6e4
+Revises: c8eed03794f7
+Create Date: 2021-03-02 19:12:45.218367-06:00
+
+"""
+import datetime
+import json
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5f3a9d21c6e4'
+down_revision = 'c8eed03794f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    vote_table = op.create_table('vote',
+                                 sa.Column('id', sa.Integer(), nullable=False),
+                                 sa.Column('submission_id', sa.Integer(), nullable=False),
+                                 sa.Column('user_id', sa.Integer(), nullable=False),
+                                 sa.Column('period_id', sa.Integer(), nullable=True),
+                                 sa.Column('timestamp', sa.DateTime(), nullable=True),
+                                 sa.ForeignKeyConstraint(['period_id'], ['period.id'], ),
+                                 sa.ForeignKeyConstraint(['submission_id'], ['submission.id'], ),
+                                 sa.PrimaryKeyConstraint('id'),
+                                 sa.UniqueConstraint('submission_id', 'user_id', name='uq_vote_submission_user')
+                                 )
+    op.create_index('ix_vote_period_user', 'vote', ['period_id', 'user_id'], unique=False)
+
+    # Move every vote out of the JSON column and into it's own row.
+    connection = op.get_bind()
+    now = datetime.datetime.utcnow()
+    rows = []
+    for submission_id, votes, period_id in connection.execute(sa.text('SELECT id, votes, period_id FROM submission')):
+        if isinstance(votes, str): votes = json.loads(votes)
+        for user_id in dict.fromkeys(votes or []):
+            rows.append({'submission_id': submission_id, 'user_id': user_id, 'period_id': period_id, 'timestamp': now})
+    if rows: op.bulk_insert(vote_table, rows)
+
+    # Recount from the migrated rows in case the JSON column and count column drifted apart.
+    connection.execute(sa.text('UPDATE submission SET count = (SELECT COUNT(*) FROM vote WHERE vote.submission_id = submission.id)'))
+
+    with op.batch_alter_table('submission', schema=None) as batch_op:
+        batch_op.drop_column('votes')
+        batch_op.create_index('ix_submission_period_count', ['period_id', 'count'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('submission', schema=None) as batch_op:
+        batch_op.drop_index('ix_submission_period_count')
+        batch_op.add_column(sa.Column('votes', sa.JSON(), nullable=True))
+
+    # Fold the vote rows back into the JSON column, oldest vote first.
+    connection = op.get_bind()
+    votes = {}
+    for submission_id, user_id in connection.execute(sa.text('SELECT submission_id, user_id FROM vote ORDER BY id')):
+        votes.setdefault(submission_id, []).append(user_id)
+    for submission_id, user_ids in votes.items():
+        connection.execute(sa.text('UPDATE submission SET votes = :votes WHERE id = :id'),
+                           {'votes': json.dumps(user_ids), 'id': submission_id})
+    connection.execute(sa.text("UPDATE submission SET votes = '[]' WHERE votes IS NULL"))
+
+    op.drop_index('ix_vote_period_user', table_name='vote')
+    op.drop_table('vote')
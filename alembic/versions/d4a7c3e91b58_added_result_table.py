@@ -0,0 +1,52 @@
+"""Added result table holding the final standings of finished periods
+
+Revision ID: d4a7c3e91b58
+Revises: 9b1e4f7a2d03
+Create Date: 2021-03-11 18:02:37.915402-06:00
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c3e91b58'
+down_revision = '9b1e4f7a2d03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    result_table = op.create_table('result',
+                                   sa.Column('id', sa.Integer(), nullable=False),
+                                   sa.Column('period_id', sa.Integer(), nullable=False),
+                                   sa.Column('submission_id', sa.Integer(), nullable=False),
+                                   sa.Column('user_id', sa.Integer(), nullable=False),
+                                   sa.Column('position', sa.Integer(), nullable=False),
+                                   sa.Column('count', sa.Integer(), nullable=False),
+                                   sa.ForeignKeyConstraint(['period_id'], ['period.id'], ),
+                                   sa.PrimaryKeyConstraint('id'),
+                                   sa.UniqueConstraint('period_id', 'submission_id', name='uq_result_period_submission')
+                                   )
+    op.create_index('ix_result_period_position', 'result', ['period_id', 'position'], unique=False)
+
+    # Record standings for periods which finished (or were closed while voting) before results were kept.
+    connection = op.get_bind()
+    query = sa.text("SELECT submission.period_id, submission.id, submission.user, submission.count FROM submission "
+                    "JOIN period ON period.id = submission.period_id "
+                    "WHERE period.state = 'FINISHED' OR (period.state = 'VOTING' AND period.active = 0) "
+                    "ORDER BY submission.period_id, submission.count DESC, submission.id")
+    rows, period, position, previous = [], None, 0, None
+    for period_id, submission_id, user_id, count in connection.execute(query):
+        count = count or 0
+        if period_id != period:
+            period, position, previous = period_id, 0, None
+        if count != previous:
+            position += 1
+            previous = count
+        rows.append({'period_id': period_id, 'submission_id': submission_id, 'user_id': user_id, 'position': position, 'count': count})
+    if rows: op.bulk_insert(result_table, rows)
+
+
+def downgrade():
+    op.drop_index('ix_result_period_position', table_name='result')
+    op.drop_table('result')
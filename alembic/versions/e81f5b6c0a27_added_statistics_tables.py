@@ -0,0 +1,92 @@
+"""Added period_stats and user_stats aggregate tables
+
+Revision ID: e81f5b6c0a27
+Revises: d4a7c3e91b58
+Create Date: 2021-03-13 14:26:51.330871-06:00
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e81f5b6c0a27'
+down_revision = 'd4a7c3e91b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    period_stats_table = op.create_table('period_stats',
+                                         sa.Column('period_id', sa.Integer(), nullable=False),
+                                         sa.Column('guild_id', sa.Integer(), nullable=False),
+                                         sa.Column('finished_time', sa.DateTime(), nullable=True),
+                                         sa.Column('submissions', sa.Integer(), nullable=False),
+                                         sa.Column('voters', sa.Integer(), nullable=False),
+                                         sa.Column('votes', sa.Integer(), nullable=False),
+                                         sa.Column('top_count', sa.Integer(), nullable=False),
+                                         sa.ForeignKeyConstraint(['guild_id'], ['guild.id'], ),
+                                         sa.ForeignKeyConstraint(['period_id'], ['period.id'], ),
+                                         sa.PrimaryKeyConstraint('period_id')
+                                         )
+    op.create_index('ix_period_stats_guild_finished', 'period_stats', ['guild_id', 'finished_time'], unique=False)
+    user_stats_table = op.create_table('user_stats',
+                                       sa.Column('id', sa.Integer(), nullable=False),
+                                       sa.Column('guild_id', sa.Integer(), nullable=False),
+                                       sa.Column('user_id', sa.Integer(), nullable=False),
+                                       sa.Column('contests', sa.Integer(), nullable=False),
+                                       sa.Column('wins', sa.Integer(), nullable=False),
+                                       sa.Column('votes', sa.Integer(), nullable=False),
+                                       sa.Column('best_position', sa.Integer(), nullable=True),
+                                       sa.Column('streak', sa.Integer(), nullable=False),
+                                       sa.Column('best_streak', sa.Integer(), nullable=False),
+                                       sa.Column('last_period_id', sa.Integer(), nullable=True),
+                                       sa.ForeignKeyConstraint(['guild_id'], ['guild.id'], ),
+                                       sa.ForeignKeyConstraint(['last_period_id'], ['period.id'], ),
+                                       sa.PrimaryKeyConstraint('id'),
+                                       sa.UniqueConstraint('guild_id', 'user_id', name='uq_user_stats_guild_user')
+                                       )
+    op.create_index('ix_user_stats_guild_wins', 'user_stats', ['guild_id', 'wins'], unique=False)
+
+    # Replay every period with recorded results, oldest first, the same way they are recorded as each one finishes.
+    connection = op.get_bind()
+    voters = dict(connection.execute(sa.text('SELECT period_id, COUNT(DISTINCT user_id) FROM vote GROUP BY period_id')).fetchall())
+    results = {}
+    for period_id, user_id, position, count in connection.execute(sa.text('SELECT period_id, user_id, position, count FROM result')):
+        results.setdefault(period_id, []).append((user_id, position, count))
+
+    query = sa.text('SELECT id, guild_id, finished_time FROM period WHERE id IN (SELECT DISTINCT period_id FROM result) '
+                    'ORDER BY guild_id, finished_time IS NULL, finished_time, id').columns(finished_time=sa.DateTime)
+    period_rows, users, latest = [], {}, {}
+    for period_id, guild_id, finished_time in connection.execute(query):
+        rows = results[period_id]
+        period_rows.append({'period_id': period_id, 'guild_id': guild_id, 'finished_time': finished_time, 'submissions': len(rows),
+                            'voters': voters.get(period_id, 0), 'votes': sum(count for _, _, count in rows),
+                            'top_count': max(count for _, _, count in rows)})
+
+        totals = {}
+        for user_id, position, count in rows:
+            best, votes = totals.get(user_id, (position, 0))
+            totals[user_id] = (min(best, position), votes + count)
+        for user_id, (position, votes) in totals.items():
+            user = users.setdefault((guild_id, user_id), {'guild_id': guild_id, 'user_id': user_id, 'contests': 0, 'wins': 0,
+                                                          'votes': 0, 'best_position': None, 'streak': 0, 'best_streak': 0,
+                                                          'last_period_id': None})
+            user['contests'] += 1
+            user['wins'] += 1 if position == 1 else 0
+            user['votes'] += votes
+            user['best_position'] = position if user['best_position'] is None else min(user['best_position'], position)
+            previous = latest.get(guild_id)
+            user['streak'] = user['streak'] + 1 if previous is not None and user['last_period_id'] == previous else 1
+            user['best_streak'] = max(user['best_streak'], user['streak'])
+            user['last_period_id'] = period_id
+        latest[guild_id] = period_id
+
+    if period_rows: op.bulk_insert(period_stats_table, period_rows)
+    if users: op.bulk_insert(user_stats_table, list(users.values()))
+
+
+def downgrade():
+    op.drop_index('ix_user_stats_guild_wins', table_name='user_stats')
+    op.drop_table('user_stats')
+    op.drop_index('ix_period_stats_guild_finished', table_name='period_stats')
+    op.drop_table('period_stats')
@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy.orm import Session
+
+from tests import fakes
+from main import load_db
+
+
+def scale() -> int:
+    """The number of votes generated, taken from the BENCHMARK_SCALE environment variable (such as 1e6). Defaults to 1000."""
+    return int(float(os.environ.get('BENCHMARK_SCALE', '1e3')))
+
+
+@pytest.fixture(scope='module')
+def engine():
+    engine = load_db('sqlite:///')
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def synthetic(engine):
+    session = Session(bind=engine)
+    try:
+        yield fakes.populate(session, votes=scale(), guilds=max(1, scale() // 100000))
+    finally:
+        session.close()
+
+
+@pytest.fixture(scope='function')
+def session(engine, synthetic):
+    session = Session(bind=engine)
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@pytest.fixture(scope='function')
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture(autouse=True)
+def record_scale(request) -> None:
+    """Stores the scale alongside each result, so saved baselines are only compared at the same scale."""
+    if 'benchmark' in request.fixturenames:
+        request.getfixturevalue('benchmark').extra_info['scale'] = scale()
@@ -0,0 +1,286 @@
+"""
+Replays a recording of gateway events, made by the `bot.replay` extension, against the bot with Discord stubbed out. Reports
+handler latency percentiles, database time, the number of API calls made and whether the final votes match the reactions.
+
+    python -m benchmarks.replay events.jsonl --speed 10
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import defaultdict, namedtuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from tests import fakes
+from bot import constants
+from bot.bot import ContestBot
+from bot.cogs.contest_events import ContestEventsCog
+from bot.models import Guild, Period, PeriodStates, Submission, Vote
+from bot.replay import RecordedEvent, load
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+ReplayReport = namedtuple('ReplayReport', ['events', 'duration', 'latency', 'db_time', 'db_statements', 'http_calls',
+                                           'submissions_checked', 'mismatched'])
+
+
+def percentiles(values: Iterable[float], points: Tuple[int, ...] = (50, 90, 99, 100)) -> Dict[str, float]:
+    """Returns the nearest-rank percentiles of the values given, in milliseconds."""
+    values = sorted(values)
+    if len(values) == 0: return {}
+    return {f'p{point}': values[max(0, -(-point * len(values) // 100) - 1)] * 1000 for point in points}
+
+
+class DatabaseTimer(object):
+    """Counts the statements executed by a engine, and the time spent executing them."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.statements = 0
+        self.elapsed = 0.0
+
+    # Kept on the statement's execution context, so a statement which raises leaves nothing behind on it's connection.
+    def _before(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None: context._replay_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        started = getattr(context, '_replay_started', None)
+        if started is not None: self.elapsed += time.perf_counter() - started
+        self.statements += 1
+
+    def __enter__(self) -> 'DatabaseTimer':
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        event.listen(self.engine, 'after_cursor_execute', self._after)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+        event.remove(self.engine, 'after_cursor_execute', self._after)
+
+
+class Replayer(object):
+    """
+    Replays recorded events into a `ContestEventsCog`, with a `fakes.FakeDiscord` in place of Discord's API.
+
+    Events are dispatched on their own tasks at their recorded times divided by the speed-up, as the gateway would. Before each
+    event the guild's period is brought to the state it was recorded in, so submissions and votes are accepted or rejected as
+    they originally were. Latency is measured from dispatch until the event has been fully handled, including the time reaction
+    events spend waiting to be coalesced.
+    """
+
+    def __init__(self, bot: ContestBot, speed: float = 1.0) -> None:
+        self.bot = bot
+        self.speed = speed
+        self.fake = fakes.FakeDiscord()
+        self.fake.attach(bot)
+        self.cog = ContestEventsCog(bot)
+        self.periods: Dict[Tuple[int, Optional[int]], int] = {}  # Guild ID & recorded Period ID -> replayed Period ID
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self._dispatched: Dict[int, Tuple[str, float]] = {}  # id() of pending reaction payloads -> event type & dispatch time
+        self._syncing = asyncio.Lock()
+        self._messages: Set[asyncio.Future] = set()  # Message handlers still running
+
+        handle_votes = self.cog.handle_votes
+
+        async def timed_handle_votes(message_id: int, payloads: list) -> None:
+            try:
+                await handle_votes(message_id, payloads)
+            finally:
+                now = time.perf_counter()
+                for payload in payloads:
+                    event_type, dispatched = self._dispatched.pop(id(payload))
+                    self.latency[event_type].append(now - dispatched)
+
+        self.cog.votes.handler = timed_handle_votes
+
+    async def sync(self, recorded: RecordedEvent) -> None:
+        """Creates the guild and period of a event if needed, then advances the period to the state it was recorded in."""
+        guild_id, channel_id = recorded.data['guild_id'], recorded.data['channel_id']
+
+        async with self._syncing:
+            config = await self.bot.guild_config(guild_id)
+            if config is None or (recorded.state is not None and (self.periods.get((guild_id, recorded.period)) != config.period_id or
+                                                                  config.period_state != PeriodStates[recorded.state])):
+                # Messages still being handled were sent before the period changed, so they are finished first.
+                if self._messages: await asyncio.wait(self._messages)
+
+            with self.bot.get_session() as session:
+                guild: Guild = session.query(Guild).get(guild_id)
+                if guild is None:
+                    guild = Guild(id=guild_id, submission_channel=channel_id)
+                    session.add(guild)
+                    session.commit()
+                    self.bot.guild_cache.update(guild)
+                if recorded.state is None: return
+                state = PeriodStates[recorded.state]
+
+                period_id = self.periods.get((guild_id, recorded.period))
+                # Committed before each await on the database writer, so this session never holds a transaction open while
+                # the writer waits on it.
+                if period_id is None:
+                    if guild.current_period is not None and guild.current_period.active:
+                        if guild.current_period.voting:
+                            session.commit()
+                            await self.bot.vote_buffer.close_period(guild.current_period_id)
+                        guild.current_period.deactivate()
+                    period = Period(guild_id=guild_id)
+                    session.add(period)
+                    session.commit()
+                    guild.current_period = period
+                    self.periods[(guild_id, recorded.period)] = period.id
+                else:
+                    period = session.query(Period).get(period_id)
+
+                while period.active and period.state.value < state.value:
+                    entering_voting = period.state == PeriodStates.PAUSED
+                    if period.voting:
+                        session.commit()
+                        await self.bot.vote_buffer.close_period(period.id)
+                    period.advance_state()
+                    if entering_voting:
+                        submission_ids = [submission.id for submission in period.submissions]
+                        session.commit()
+                        await self.bot.add_voting_reactions(self.fake.get_channel(guild.submission_channel), submission_ids)
+                self.bot.guild_cache.update(guild)
+
+    def apply(self, recorded: RecordedEvent):
+        """Mirrors a event on the fake's state, returning the handler and raw payload to dispatch it with."""
+        data, cog = recorded.data, self.cog
+        channel = self.fake.channel(data['channel_id'], data['guild_id'])
+
+        if recorded.type == 'MESSAGE_CREATE':
+            attachments = [fakes.FakeAttachment(width=attachment['width'], spoiler=attachment['spoiler'])
+                           for attachment in data['attachments']]
+            message = channel.add(data['id'], author_id=data['author']['id'], attachments=attachments)
+            message.author.bot = data['author']['bot']
+            return cog.on_message, message
+        elif recorded.type == 'MESSAGE_DELETE':
+            channel.remove(data['id'])
+            return cog.on_raw_message_delete, discord.RawMessageDeleteEvent(data)
+        elif recorded.type == 'MESSAGE_DELETE_BULK':
+            for message_id in data['ids']: channel.remove(message_id)
+            return cog.on_raw_bulk_message_delete, fakes.bulk_delete_event(data['guild_id'], data['channel_id'], data['ids'])
+
+        emoji = discord.PartialEmoji(id=data['emoji']['id'], name=data['emoji']['name']) if 'emoji' in data else None
+        message = channel.messages.get(data['message_id'])
+        if recorded.type in ('MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE'):
+            added = recorded.type == 'MESSAGE_REACTION_ADD'
+            if message is not None:
+                users = message.reaction(emoji).user_ids
+                if added and data['user_id'] not in users: users.append(data['user_id'])
+                elif not added and data['user_id'] in users: users.remove(data['user_id'])
+            payload = fakes.reaction_event(data['guild_id'], data['channel_id'], data['message_id'], data['user_id'], added, emoji)
+            return (cog.on_raw_reaction_add if added else cog.on_raw_reaction_remove), payload
+        elif recorded.type == 'MESSAGE_REACTION_REMOVE_ALL':
+            if message is not None: message.reactions.clear()
+            return cog.on_raw_reaction_clear, discord.RawReactionClearEvent(data)
+        else:
+            if message is not None: message.reactions = [reaction for reaction in message.reactions if reaction.emoji != emoji]
+            return cog.on_raw_reaction_clear_emoji, discord.RawReactionClearEmojiEvent(data, emoji)
+
+    async def dispatch(self, recorded: RecordedEvent) -> None:
+        await self.sync(recorded)
+        handler, payload = self.apply(recorded)
+        started = time.perf_counter()
+
+        if isinstance(payload, discord.RawReactionActionEvent):
+            pending = self.cog.votes.depth
+            self._dispatched[id(payload)] = (recorded.type, started)
+            await handler(payload)
+            # Reactions which were not queued (such as the bot's own) were handled immediately.
+            if self.cog.votes.depth == pending:
+                self._dispatched.pop(id(payload), None)
+                self.latency[recorded.type].append(time.perf_counter() - started)
+        else:
+            task = asyncio.ensure_future(handler(payload))
+            self._messages.add(task)
+            try:
+                await task
+            finally:
+                self._messages.discard(task)
+            self.latency[recorded.type].append(time.perf_counter() - started)
+
+    async def run(self, events: List[RecordedEvent]) -> ReplayReport:
+        """Replays the events given, waiting for every handler to finish, and reports on how the bot coped."""
+        with DatabaseTimer(self.bot.engine) as timer:
+            started = time.perf_counter()
+            tasks = []
+            for recorded in events:
+                delay = started + recorded.at / self.speed - time.perf_counter()
+                if delay > 0: await asyncio.sleep(delay)
+                tasks.append(asyncio.ensure_future(self.dispatch(recorded)))
+
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            await self.cog.votes.drain()
+            await self.bot.vote_buffer.flush()
+            duration = time.perf_counter() - started
+
+        for error in results:
+            if isinstance(error, Exception): logger.error('Replayed event raised an exception.', exc_info=error)
+
+        checked, mismatched = self.verify()
+        return ReplayReport(events=len(events), duration=duration,
+                            latency={event_type: percentiles(values) for event_type, values in sorted(self.latency.items())},
+                            db_time=timer.elapsed, db_statements=timer.statements, http_calls=dict(self.fake.calls),
+                            submissions_checked=checked, mismatched=mismatched)
+
+    def verify(self) -> Tuple[int, List[int]]:
+        """
+        Compares the stored votes of every submission in a voting (or finished) period against the upvotes left on it's message.
+
+        :return: The number of submissions checked, and the IDs of those whose votes do not match.
+        """
+        checked, mismatched = 0, []
+        with self.bot.read_session() as session:
+            submissions = session.query(Submission).join(Period) \
+                .filter(Period.id.in_(self.periods.values()), Period.state.in_([PeriodStates.VOTING, PeriodStates.FINISHED])).all()
+            votes = defaultdict(set)
+            if len(submissions) > 0:
+                for submission_id, user_id in session.query(Vote.submission_id, Vote.user_id) \
+                        .filter(Vote.submission_id.in_([submission.id for submission in submissions])):
+                    votes[submission_id].add(user_id)
+
+            for submission in submissions:
+                channel = self.fake.get_channel(submission.period.guild.submission_channel)
+                message = channel.messages.get(submission.id) if channel is not None else None
+                if message is None: continue
+                reacted = set(message.reaction(fakes.upvote()).user_ids) - {fakes.BOT_USER_ID}
+                checked += 1
+                if reacted != votes[submission.id] or submission.count != len(votes[submission.id]):
+                    mismatched.append(submission.id)
+        return checked, mismatched
+
+
+def format_report(report: ReplayReport) -> str:
+    """Renders a replay report as plain text."""
+    lines = [f'Replayed {report.events} events in {report.duration:.2f}s.',
+             f'Database: {report.db_statements} statements, {report.db_time * 1000:.1f}ms.',
+             f'HTTP calls: {", ".join(f"{name}={count}" for name, count in sorted(report.http_calls.items())) or "none"}.',
+             'Latency (ms):']
+    for event_type, points in report.latency.items():
+        lines.append(f'    {event_type}: ' + ', '.join(f'{point}={value:.2f}' for point, value in points.items()))
+    lines.append(f'Votes: {report.submissions_checked - len(report.mismatched)}/{report.submissions_checked} submissions match their reactions.')
+    if report.mismatched: lines.append(f'Mismatched: {", ".join(map(str, report.mismatched))}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a recording of gateway events against the bot, with Discord stubbed out.')
+    parser.add_argument('recording', help='The recording to replay.')
+    parser.add_argument('--speed', type=float, default=1.0, help='How many times faster than recorded to replay events.')
+    parser.add_argument('--database', default='sqlite:///', help='The database to replay into. Defaults to a in-memory database.')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] [%(funcName)s] %(message)s')
+    logging.disable(logging.INFO)  # Handlers log every event they see, which would drown out the report.
+
+    from main import load_db
+
+    loop = asyncio.get_event_loop()
+    replayer = Replayer(ContestBot(load_db(arguments.database), loop=loop), speed=arguments.speed)
+    print(format_report(loop.run_until_complete(replayer.run(load(arguments.recording)))))
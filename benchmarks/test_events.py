@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from tests import fakes
+from bot.bot import ContestBot
+from bot.cogs.contest_events import ContestEventsCog
+from bot.models import Submission, Vote
+
+pytest.importorskip('pytest_benchmark')
+
+ROUNDS = 100
+
+
+@pytest.fixture(scope='function')
+def cog(engine, synthetic, loop) -> ContestEventsCog:
+    bot = ContestBot(engine, loop=loop)
+    fake = fakes.FakeDiscord()
+    for guild in synthetic:
+        fake.add_guild(guild)
+    fake.attach(bot)
+    with bot.get_session() as session:
+        bot.guild_cache.load(session)
+
+    cog = ContestEventsCog(bot)
+    cog.votes.window = 0
+    yield cog
+    cog.cog_unload()
+    bot.database_executor.shutdown()
+
+
+def dispatch(cog: ContestEventsCog, payload) -> None:
+    """Delivers a raw reaction event, then waits for it's coalesced batch to be handled."""
+    handler = cog.on_raw_reaction_add if payload.event_type == 'REACTION_ADD' else cog.on_raw_reaction_remove
+    cog.bot.loop.run_until_complete(handler(payload))
+    cog.bot.loop.run_until_complete(cog.votes.drain())
+
+
+def flush(cog: ContestEventsCog) -> None:
+    """Writes the votes buffered by the events dispatched, so they can be checked in the database."""
+    cog.bot.loop.run_until_complete(cog.bot.vote_buffer.flush())
+
+
+def test_reaction_vote_switch(benchmark, session, synthetic, cog) -> None:
+    guild = synthetic[0]
+    target = next(iter(guild.submissions))
+    voters = [user_id for user_id, in session.query(Vote.user_id).filter(Vote.period_id == guild.period, Vote.submission_id != target)
+                                                                 .order_by(Vote.id).limit(ROUNDS)]
+    payloads = iter(fakes.reaction_event(guild.id, guild.channel, target, voter) for voter in voters)
+
+    benchmark.pedantic(lambda: dispatch(cog, next(payloads)), rounds=len(voters))
+    flush(cog)
+    # Each switch removes the voter's previous vote and it's reaction
+    assert session.query(Vote).filter_by(submission_id=target).count() == len(guild.submissions[target][1]) + len(voters)
+    assert cog.bot.expected_react_deletions.stats()['size'] == len(voters)
+
+
+def test_reaction_remove(benchmark, session, synthetic, cog) -> None:
+    guild = synthetic[0]
+    votes = session.query(Vote.submission_id, Vote.user_id).filter_by(period_id=guild.period).order_by(Vote.id).limit(ROUNDS).all()
+    payloads = iter(fakes.reaction_event(guild.id, guild.channel, submission_id, voter, added=False) for submission_id, voter in votes)
+    total = session.query(Vote).count()
+
+    benchmark.pedantic(lambda: dispatch(cog, next(payloads)), rounds=len(votes))
+    flush(cog)
+    assert session.query(Vote).count() == total - len(votes)
+
+
+def test_bulk_message_delete(benchmark, engine, synthetic, cog) -> None:
+    guild = synthetic[0]
+    session = Session(bind=engine)
+    message_ids = iter(range(10 ** 9, 2 * 10 ** 9, 1000))
+
+    def setup():
+        start = next(message_ids)
+        submissions = [Submission(id=start + index, user=index + 1, period_id=guild.period) for index in range(100)]
+        for submission in submissions: submission.votes = range(submission.user + 1, submission.user + 6)
+        session.add_all(submissions)
+        session.commit()
+        # Purges take any message in the channel, so half the IDs given are not submissions.
+        return (fakes.bulk_delete_event(guild.id, guild.channel, range(start, start + 200)),), {}
+
+    benchmark.pedantic(lambda payload: cog.bot.loop.run_until_complete(cog.on_raw_bulk_message_delete(payload)), setup=setup, rounds=20)
+    assert session.query(Submission).filter(Submission.id >= 10 ** 9).count() == 0
+    session.close()
@@ -0,0 +1,30 @@
+import random
+
+import pytest
+
+from bot.duplicates import HashIndex, hamming
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture(scope='module')
+def hashes():
+    rng = random.Random(0)
+    return [rng.getrandbits(64) for _ in range(10000)]
+
+
+def test_hash_index_search(benchmark, hashes) -> None:
+    index = HashIndex(radius=6)
+    for position, value in enumerate(hashes):
+        index.add(value, position)
+    query = hashes[-1] ^ 0b101
+
+    found = benchmark(index.search, query)
+    assert found == [(2, len(hashes) - 1)]
+
+
+def test_linear_search(benchmark, hashes) -> None:
+    """The same search comparing against every hash, for reference."""
+    query = hashes[-1] ^ 0b101
+    found = benchmark(lambda: [position for position, value in enumerate(hashes) if hamming(query, value) <= 6])
+    assert found == [len(hashes) - 1]
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from bot.leaderboard import LeaderboardCache
+from bot.models import Submission
+
+pytest.importorskip('pytest_benchmark')
+
+
+def most_voted(session: Session, guild) -> Submission:
+    """Loads the guild's submission with the most votes, along with it's votes."""
+    submission_id = max(guild.submissions, key=lambda submission_id: len(guild.submissions[submission_id][1]))
+    submission = session.query(Submission).get(submission_id)
+    assert len(submission.votes) == submission.count
+    return submission
+
+
+def test_increment_decrement(benchmark, session, synthetic) -> None:
+    submission = most_voted(session, synthetic[0])
+    count, voter = submission.count, synthetic[-1].voters[-1] + 1
+
+    def cycle() -> None:
+        submission.increment(voter)
+        submission.decrement(voter)
+
+    benchmark(cycle)
+    assert submission.count == count
+
+
+def test_clear_other_votes(benchmark, session, synthetic) -> None:
+    guild = synthetic[0]
+    submission = most_voted(session, guild)
+    users = list(guild.voters[:100])
+
+    def clear():
+        found = submission.clear_other_votes(ignore=[], users=users, session=session)
+        session.rollback()
+        return found
+
+    found = benchmark(clear)
+    assert len(found) == len(set(users) - set(submission.votes))
+
+
+def test_votes_setter_dedupe(benchmark, session, synthetic) -> None:
+    submission = most_voted(session, synthetic[0])
+    votes = submission.votes
+    duplicated = votes + votes[::-1]
+
+    def assign() -> None:
+        submission.votes = duplicated
+
+    benchmark(assign)
+    assert submission.votes == votes and submission.count == len(votes)
+
+
+def test_leaderboard_load(benchmark, session, synthetic) -> None:
+    guild = synthetic[0]
+
+    def load() -> str:
+        return LeaderboardCache().get(session, guild.period).render(guild.id, guild.channel)
+
+    assert benchmark(load).startswith('`01` :trophy:')
+
+
+def test_leaderboard_update(benchmark, session, synthetic) -> None:
+    guild = synthetic[0]
+    board = LeaderboardCache().get(session, guild.period)
+    submission_id, (user_id, voters) = next(iter(guild.submissions.items()))
+    counts = iter(range(10 ** 9))
+
+    def update() -> str:
+        board.update(submission_id, user_id, len(voters) + next(counts) % 2)
+        return board.render(guild.id, guild.channel)
+
+    benchmark(update)
+    assert len(board) == len(guild.submissions)
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.replay import Replayer, format_report
+from bot import constants, replay
+from bot.bot import ContestBot
+from bot.models import Guild, Period
+from main import load_db
+
+UPVOTE = {'id': str(constants.Emoji.UPVOTE), 'name': 'upvote'}
+
+
+def reaction(event_type: str, message_id: int, user_id: int, channel_id: int = 10) -> dict:
+    return {'t': event_type, 'd': {'guild_id': '1', 'channel_id': str(channel_id), 'message_id': str(message_id),
+                                   'user_id': str(user_id), 'emoji': UPVOTE, 'member': {'nick': 'private'}}}
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path) -> None:
+    path = str(tmp_path / 'events.jsonl')
+    bot = ContestBot(load_db('sqlite:///'))
+    bot._connection.user = SimpleNamespace(id=555)
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=10)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period])
+        session.commit()
+        guild.current_period = period
+        period.advance_state()
+        bot.guild_cache.update(guild)
+
+    recorder = replay.EventRecorder(bot, path)
+    for message_id, author in ((100, 1001), (101, 1002)):
+        await recorder.on_socket_response({'t': 'MESSAGE_CREATE', 'd': {
+            'guild_id': '1', 'channel_id': '10', 'id': str(message_id), 'content': 'private',
+            'author': {'id': str(author), 'username': 'private'}, 'attachments': [{'filename': 'photo.png', 'width': 100}]}})
+
+    with bot.get_session() as session:
+        guild = session.query(Guild).get(1)
+        guild.current_period.advance_state()
+        guild.current_period.advance_state()
+        bot.guild_cache.update(guild)
+
+    for event in [reaction('MESSAGE_REACTION_ADD', 100, 555), reaction('MESSAGE_REACTION_ADD', 101, 555),
+                  reaction('MESSAGE_REACTION_ADD', 100, 1003), reaction('MESSAGE_REACTION_ADD', 101, 1003),
+                  reaction('MESSAGE_REACTION_REMOVE', 100, 1003), reaction('MESSAGE_REACTION_ADD', 101, 1004),
+                  reaction('MESSAGE_REACTION_REMOVE', 101, 1004), reaction('MESSAGE_REACTION_ADD', 101, 1005, channel_id=11)]:
+        await recorder.on_socket_response(event)
+    recorder.cog_unload()
+    bot.database_executor.shutdown()
+
+    # Content, names and User IDs are not kept, and other channels are not recorded
+    events = replay.load(path)
+    assert len(events) == 9
+    assert 'private' not in open(path).read()
+    assert [event.state for event in events] == ['SUBMISSIONS'] * 2 + ['VOTING'] * 7
+    assert events[0].data['author']['id'] == 2 and events[2].data['user_id'] == replay.BOT_USER_ID
+
+    replayer = Replayer(ContestBot(load_db('sqlite:///')), speed=100)
+    replayer.cog.votes.window = 0.01
+    report = await replayer.run(events)
+    assert report.events == 9
+    assert (report.submissions_checked, report.mismatched) == (2, [])
+    assert report.http_calls['add_reaction'] == 2
+    assert report.db_statements > 0 and report.db_time > 0
+    assert set(report.latency) == {'MESSAGE_CREATE', 'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE'}
+    assert report.latency['MESSAGE_REACTION_ADD']['p50'] <= report.latency['MESSAGE_REACTION_ADD']['p100']
+    assert 'Votes: 2/2 submissions match' in format_report(report)
+    replayer.bot.database_executor.shutdown()
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bot.models import Base
+from main import load_db
+
+pytest.importorskip('pytest_benchmark')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Everything main.py does before logging in, with the extensions loaded as they would be once the gateway connects.
+COLD_START = '''
+import asyncio, sys
+import main
+from bot.bot import ContestBot
+from bot.db import create_engine
+main.load_db(sys.argv[1]).dispose()
+bot = ContestBot(create_engine(sys.argv[1]), extensions=main.initial_extensions)
+asyncio.get_event_loop().run_until_complete(bot.on_connect())
+bot.database_executor.shutdown()
+'''
+
+
+def python(code: str, *args: str) -> None:
+    """Runs code in a fresh interpreter, so every import is cold."""
+    subprocess.run([sys.executable, '-c', code, *args], cwd=ROOT, check=True)
+
+
+def test_import_main(benchmark) -> None:
+    benchmark.pedantic(python, args=('import main',), rounds=5)
+
+
+def test_cold_start(benchmark, tmp_path) -> None:
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    load_db(url).dispose()
+    benchmark.pedantic(python, args=(COLD_START, url), rounds=5)
+
+
+def test_schema_at_head(benchmark, tmp_path) -> None:
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    load_db(url).dispose()
+    benchmark(lambda: load_db(url).dispose())
+
+
+def test_schema_create_all(benchmark, tmp_path) -> None:
+    """The same check against a database without a recorded revision, which must fall back to creating missing tables."""
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    engine = load_db(url)
+    engine.execute('DROP TABLE alembic_version')
+    engine.dispose()
+    benchmark(lambda: load_db(url).dispose())
+
+    engine = load_db(url)
+    assert Base.metadata.tables.keys() <= set(engine.table_names())
+    engine.dispose()
@@ -1,7 +1,8 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime
-from typing import ContextManager, List, Optional, Tuple
+from typing import Any, Awaitable, Callable, ContextManager, Dict, Iterable, List, Optional, TypeVar
 
 import discord
 from discord.ext import commands
@@ -9,26 +10,89 @@ from discord.ext import commands
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session, sessionmaker
 
-from bot import constants, helpers
-from bot.models import Guild, Period, Submission
+from bot import collage, constants, duplicates, helpers, metrics, stats
+from bot.cache import ExpiringSet, GuildCache, GuildConfig, shard_id
+from bot.constants import ReactionMarker
+from bot.executor import BulkExecutor, BulkResult
+from bot.leaderboard import LeaderboardCache
+from bot.reconcile import Reconciler
+from bot.scheduler import Scheduler
+from bot.startup import StartupTimer
+from bot.models import Guild, Period, PeriodStates, Submission
+from bot.votes import VoteBuffer
+from bot.writer import DatabaseWriter
 
 logger = logging.getLogger(__file__)
 logger.setLevel(constants.LOGGING_LEVEL)
 
+T = TypeVar('T')
 
-class ContestBot(commands.Bot):
-    def __init__(self, engine: Engine, **options):
+
+class ContestBot(commands.AutoShardedBot):
+    """
+    The contest bot. Every shard is run from this process unless `shard_ids` and `shard_count` are given, in which case only
+    the guilds belonging to those shards are handled here, leaving the rest to other processes sharing the same database.
+    """
+
+    def __init__(self, engine: Engine, metrics_port: Optional[int] = constants.METRICS_PORT, extensions: Iterable[str] = (),
+                 startup: Optional[StartupTimer] = None, read_engine: Optional[Engine] = None, **options):
+        """
+        :param engine: The engine written to, only ever through the database writer.
+        :param metrics_port: The port metrics are served on, or None to not serve them.
+        :param extensions: Extensions loaded once the gateway connects, rather than before logging in.
+        :param startup: A timer to mark the connection and ready phases of startup on.
+        :param read_engine: The engine read from. Defaults to the engine written to, as in-memory databases require.
+        """
         super().__init__(self.fetch_prefix, **options)
 
         self.engine = engine
+        self.read_engine = read_engine or engine
         self.Session = sessionmaker(bind=engine)
+        self.ReadSession = sessionmaker(bind=self.read_engine)
+        self.database_executor = ThreadPoolExecutor(max_workers=constants.DATABASE_THREADS, thread_name_prefix='database')
+        self.writer = DatabaseWriter(self)
+        self.guild_cache = GuildCache(self.shard_count or 1)
+        self.image_executor = ThreadPoolExecutor(max_workers=constants.IMAGE_THREADS, thread_name_prefix='image')
+        self.duplicates = duplicates.DuplicateIndex()
+        self.collages = collage.CollageRenderer(self)
+        self.leaderboards = LeaderboardCache(self.loop)
+        self.leaderboards.track(self.Session)
+        stats.track(self.Session)
+        self.reconciler = Reconciler(self)
+        self.scheduler = Scheduler(self)
+        self.reconciled = False  # Whether or not the startup reconciliation has been started.
+        self.pending_extensions: List[str] = list(extensions)
+        self.startup = startup
 
-        self.expected_msg_deletions: List[int] = []
-        self.expected_react_deletions: List[Tuple[int, int]] = []
+        self.expected_msg_deletions = ExpiringSet(constants.EXPECTED_DELETION_TTL, constants.EXPECTED_DELETION_MAXSIZE)  # Message IDs
+        self.expected_react_deletions = ExpiringSet(constants.EXPECTED_DELETION_TTL,
+                                                    constants.EXPECTED_DELETION_MAXSIZE)  # Message ID & User ID pairs
+
+        self.metrics = metrics.REGISTRY
+        self.metrics.instrument_engine(engine)
+        if self.read_engine is not engine: self.metrics.instrument_engine(self.read_engine)
+        self.metrics.instrument_http(self.http)
+        self.vote_buffer = VoteBuffer(self)
+        self.metrics.gauge('contest_guild_cache_size', 'Guilds cached', lambda: len(self.guild_cache))
+        self.metrics.gauge('contest_submission_hashes', 'Submission hashes indexed', lambda: len(self.duplicates))
+        self.metrics.gauge('contest_votes_pending', 'Vote changes waiting to be written', lambda: self.vote_buffer.pending)
+        self.metrics.gauge('contest_collages_cached', 'Result collages cached', lambda: len(self.collages))
+        self.metrics.gauge('contest_scheduled_advancements', 'Advancements scheduled', lambda: len(self.scheduler))
+        self.metrics.gauge('contest_expected_message_deletions', 'Expected message deletions', lambda: len(self.expected_msg_deletions))
+        self.metrics.gauge('contest_expected_reaction_deletions', 'Expected reaction deletions',
+                           lambda: len(self.expected_react_deletions))
+        # noinspection PyProtectedMember
+        self.metrics.gauge('contest_database_queue_depth', 'Database jobs queued', lambda: self.database_executor._work_queue.qsize())
+        self.metrics.gauge('contest_database_writes_queued', 'Database writes queued', lambda: len(self.writer))
+        self.metrics_server = metrics.MetricsServer(self.metrics, port=metrics_port) if metrics_port is not None else None
 
     @contextmanager
     def get_session(self, autocommit=True, autoclose=True, rollback=True) -> ContextManager[Session]:
-        """Provides automatic commit and closing of Session with exception rollback."""
+        """
+        Provides automatic commit and closing of Session with exception rollback.
+
+        The bot itself writes through `run_session` and reads through `run_read`, so this is left to tools and tests.
+        """
         session = self.Session()
         try:
             yield session
@@ -39,78 +103,259 @@ class ContestBot(commands.Bot):
         finally:
             if autoclose: session.close()
 
+    @contextmanager
+    def read_session(self) -> ContextManager[Session]:
+        """Provides a Session from the read-only pool, which is never committed. The bot uses it through `run_read`, off the event loop."""
+        session = self.ReadSession()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    async def run_session(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Queues `func(session, *args, **kwargs)` on the database writer, the only connection allowed to write (see bot.writer).
+
+        The session is committed and closed before this returns, so `func` should return plain values rather than ORM objects.
+        """
+        return await self.writer.submit(func, *args, **kwargs)
+
+    async def run_read(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Runs `func(session, *args, **kwargs)` inside `read_session` on a database thread, keeping blocking I/O off the event loop.
+
+        Reads never wait behind queued writes. `func` should return plain values rather than ORM objects.
+        """
+        def run() -> T:
+            with self.read_session() as session:
+                return func(session, *args, **kwargs)
+
+        return await self.loop.run_in_executor(self.database_executor, run)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether or not the guild given belongs to one of the shards run by this process."""
+        if self.shard_ids is None: return True
+        return shard_id(guild_id, self.shard_count) in self.shard_ids
+
+    @metrics.timed('hash_attachment')
+    async def hash_attachment(self, attachment: discord.Attachment) -> Optional[int]:
+        """
+        Downloads a attachment and computes it's perceptual hash on a image thread, keeping decoding off the event loop.
+
+        :return: The hash, or None if it could not be downloaded or hashed, or Pillow is not installed.
+        """
+        if not duplicates.available(): return None
+        try:
+            data = await attachment.read()
+        except (discord.HTTPException, discord.NotFound) as error:
+            logger.warning(f'Could not download attachment {attachment.id} to hash: {error}')
+            return None
+        if len(data) == 0: return None
+        return await self.loop.run_in_executor(self.image_executor, duplicates.dhash, data)
+
+    async def end_voting(self, guild_id: int) -> None:
+        """Stops buffering votes for a guild's current period if it is voting, writing out any still pending first."""
+        config = await self.guild_config(guild_id)
+        if config is not None and config.period_state == PeriodStates.VOTING:
+            await self.vote_buffer.close_period(config.period_id)
+
+    async def guild_config(self, guild_id: Optional[int]) -> Optional[GuildConfig]:
+        """Returns the cached configuration for a guild, reading it from the database on a cache miss."""
+        if guild_id is None: return None
+
+        config = self.guild_cache.get(guild_id)
+        if config is None:
+            config = await self.run_read(self._read_guild_config, guild_id)
+            # A configuration cached while this one was read, such as by a write, is at least as new.
+            if config is not None: config = self.guild_cache.get(guild_id) or self.guild_cache.store(config)
+        return config
+
+    @staticmethod
+    def _read_guild_config(session: Session, guild_id: int) -> Optional[GuildConfig]:
+        guild: Guild = session.query(Guild).get(guild_id)
+        return GuildCache.build(guild) if guild is not None else None
+
+    async def is_submission_channel(self, guild_id: Optional[int], channel_id: int) -> bool:
+        """Whether or not the channel given is the submission channel of it's guild, answered from the guild cache."""
+        config = await self.guild_config(guild_id)
+        return config is not None and config.submission_channel == channel_id
+
     async def fetch_prefix(self, bot: 'ContestBot', message: discord.Message):
         """Fetches the prefix used by the relevant guild."""
         user_id = bot.user.id
         base = [f'<@!{user_id}> ', f'<@{user_id}> ']
 
         if message.guild:
-            with self.get_session() as session:
-                guild: Guild = session.query(Guild).get(message.guild.id)
-                base.append(guild.prefix)
+            config = await self.guild_config(message.guild.id)
+            if config is not None:
+                base.append(config.prefix)
         return base
 
+    async def close(self) -> None:
+        """Closes the connection to Discord, then writes any buffered votes and waits for any outstanding database work."""
+        self.scheduler.stop()
+        if self.metrics_server is not None: await self.metrics_server.stop()
+        await super().close()
+        await self.vote_buffer.close()
+        await self.writer.close()
+        self.collages.shutdown()
+        self.image_executor.shutdown(wait=True)
+        self.database_executor.shutdown(wait=True)
+
+    async def on_connect(self) -> None:
+        """Loads the pending extensions on the first connection to the gateway, before any events are dispatched to them."""
+        if len(self.pending_extensions) == 0: return
+        if self.startup is not None: self.startup.mark('connect')
+
+        for extension in self.pending_extensions:
+            self.load_extension(extension)
+        logger.debug(f'Loaded {len(self.pending_extensions)} extension{"s" if len(self.pending_extensions) != 1 else ""}.')
+        self.pending_extensions = []
+        if self.startup is not None: self.startup.mark('extensions')
+
     async def on_ready(self):
         """Communicate that the bot is online now."""
         logger.info('Bot is now ready and connected to Discord.')
         guild_count = len(self.guilds)
         logger.info(f'Connected as {self.user.name}#{self.user.discriminator} to {guild_count} guild{"s" if guild_count > 1 else ""}.')
 
-        with self.get_session() as session:
-            for guild in self.guilds:
-                _guild: Guild = session.query(Guild).get(guild.id)
-                if _guild is None:
-                    logger.warning(
-                            f'Guild {guild.name} ({guild.id}) was not inside database on ready. Bot was disconnected or did not add it properly...')
-                    session.add(Guild(id=guild.id))
+        guilds = {guild.id: guild for guild in self.guilds}
+        for guild_id in await self.run_session(self._add_guilds, list(guilds)):
+            logger.warning(f'Guild {guilds[guild_id].name} ({guild_id}) was not inside database on ready. '
+                           f'Bot was disconnected or did not add it properly...')
 
-        # TODO: Scan all messages on start for current period and check for new periods/updated vote counts.
+        self.guild_cache.resize(self.shard_count or 1)
+        self.guild_cache.fill(await self.run_read(self.guild_cache.read, shard_ids=self.shard_ids))
+
+        await self.scheduler.start()
+        if self.metrics_server is not None:
+            try:
+                await self.metrics_server.start()
+            except OSError as error:
+                logger.error(f'Could not start the metrics endpoint: {error}')
+
+        # Catch up on any reactions or deletions missed while offline. on_ready can fire again after reconnecting, so only once.
+        if not self.reconciled:
+            self.reconciled = True
+            if self.startup is not None: self.finish_startup()
+            self.loop.create_task(self.reconciler.reconcile_all())
+
+    @staticmethod
+    def _add_guilds(session: Session, guild_ids: List[int]) -> List[int]:
+        """Adds the guilds given which are not already in the database, returning their IDs."""
+        known = {guild_id for guild_id, in session.query(Guild.id)}
+        missing = [guild_id for guild_id in guild_ids if guild_id not in known]
+        session.add_all([Guild(id=guild_id) for guild_id in missing])
+        return missing
+
+    def finish_startup(self) -> None:
+        """Marks the bot as ready on the startup timer, logging how long each phase took."""
+        self.startup.mark('ready')
+        self.startup.stop()
+        elapsed = sum(phase.seconds for phase in self.startup.phases)
+        self.metrics.gauge('contest_startup_seconds', 'Seconds taken to become ready', lambda: elapsed)
+
+        logger.info(f'Ready {elapsed:.2f}s after starting.')
+        for line in self.startup.report():
+            logger.debug(line)
+        self.startup = None
+
+    async def on_shard_ready(self, shard: int) -> None:
+        """Reloads the cached guild configurations of a shard once it reconnects, as updates may have been missed meanwhile."""
+        if not self.is_ready(): return  # The whole cache is loaded in on_ready.
+        logger.info(f'Shard {shard} is ready, reloading it\'s guild configurations.')
+
+        self.guild_cache.invalidate_shard(shard)
+        self.guild_cache.fill(await self.run_read(self.guild_cache.read, shard_ids=[shard]))
 
     async def on_guild_join(self, guild: discord.Guild) -> None:
         """Handles adding or reactivating a Guild in the database."""
         logger.info(f'Added to new guild: {guild.name} ({guild.id})')
+        self.guild_cache.store(await self.run_session(self._join_guild, guild.id))
 
-        with self.get_session() as session:
-            _guild: Guild = session.query(Guild).get(guild.id)
-            if _guild is None:
-                session.add(Guild(id=guild.id))
-            else:
-                # Guild has been seen before. Update last_joined and set as active again.
-                _guild.active = True
-                _guild.last_joined = datetime.utcnow()
+    @staticmethod
+    def _join_guild(session: Session, guild_id: int) -> GuildConfig:
+        _guild: Guild = session.query(Guild).get(guild_id)
+        if _guild is None:
+            _guild = Guild(id=guild_id)
+            session.add(_guild)
+            session.flush()
+        else:
+            # Guild has been seen before. Update last_joined and set as active again.
+            _guild.active = True
+            _guild.last_joined = datetime.utcnow()
+        return GuildCache.build(_guild)
 
     async def on_guild_remove(self, guild: discord.Guild) -> None:
         """Handles disabling the guild in the database, as well."""
         logger.info(f'Removed from guild: {guild.name} ({guild.id})')
+        await self.end_voting(guild.id)
+        self.guild_cache.invalidate(guild.id)
+        await self.run_session(self._remove_guild, guild.id)
+
+    @staticmethod
+    def _remove_guild(session: Session, guild_id: int) -> None:
+        # Get the associated Guild and mark it as disabled.
+        _guild: Guild = session.query(Guild).filter_by(active=True, id=guild_id).first()
+        if _guild is None: return
+        _guild.active = False
+
+        # Shut down any current running Period objects if possible.
+        period: Period = _guild.current_period
+        if period is not None and period.active:
+            period.deactivate()
+
+    async def add_voting_reactions(self, channel: discord.TextChannel, submission_ids: Optional[List[int]] = None,
+                                   progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> Optional[BulkResult]:
+        """
+        Adds reactions to all valid submissions in the given channel.
 
-        with self.get_session() as session:
-            # Get the associated Guild and mark it as disabled.
-            _guild: Guild = session.query(Guild).filter_by(active=True, id=guild.id).first()
-            _guild.active = False
-
-            # Shut down any current running Period objects if possible.
-            period: Period = _guild.current_period
-            if period is not None and period.active:
-                period.deactivate()
-
-    async def add_voting_reactions(self, channel: discord.TextChannel, submissions: Optional[List[Submission]] = None) -> None:
-        """Adds reactions to all valid submissions in the given channel."""
-        if submissions is None:
-            with self.get_session() as session:
-                period: Period = session.query(Guild).get(channel.guild.id).current_period
-                if period is None:
-                    logger.error('No valid submissions - current period is not set for the Guild this channel belongs to.')
-                    return
-                else:
-                    submissions = period.submissions
-
-        if len(submissions) == 0:
+        :param channel: The submission channel.
+        :param submission_ids: The submissions to add reactions to. Defaults to all submissions in the guild's current period.
+        :param progress: A coroutine function called with the number of submissions handled and the total.
+        """
+        if submission_ids is None:
+            submission_ids = await self.run_read(self._read_submission_ids, channel.guild.id)
+            if submission_ids is None:
+                logger.error('No valid submissions - current period is not set for the Guild this channel belongs to.')
+                return
+
+        if len(submission_ids) == 0:
             logger.warning('Attempted to add voting reactions to submissions, but none were given or could be found.')
             return
-        else:
-            for submission in submissions:
-                message: discord.Message = await channel.fetch_message(submission.id)
-                await message.add_reaction(self.get_emoji(constants.Emoji.UPVOTE))
+
+        emoji = self.get_emoji(constants.Emoji.UPVOTE)
+        messages = await self.fetch_messages(channel.id, submission_ids)
+
+        async def add_reaction(submission_id: int) -> bool:
+            message: Optional[discord.Message] = messages.get(submission_id)
+            if message is None:
+                logger.warning(f'Submission {submission_id} could not be found in {channel.id} to add voting reactions to.')
+                return False
+            elif any(reaction.me and helpers.is_upvote(reaction.emoji) for reaction in message.reactions):
+                return False
+            await message.add_reaction(emoji)
+            return True
+
+        result = await BulkExecutor().run(submission_ids, add_reaction,
+                                          bucket=lambda _: channel.id, progress=progress)
+        logger.info(f'Voting reactions added to {result.completed} submissions in {channel.id} '
+                    f'({result.skipped} already present, {result.failed} failed).')
+        return result
+
+    @staticmethod
+    def _read_submission_ids(session: Session, guild_id: int) -> Optional[List[int]]:
+        """The IDs of the submissions in a guild's current period, or None if it has no current period."""
+        period: Period = session.query(Guild).get(guild_id).current_period
+        if period is None: return None
+        return [submission_id for submission_id, in session.query(Submission.id).filter_by(period_id=period.id)]
+
+    async def remove_vote_reactions(self, channel_id: int, markers: Iterable[ReactionMarker]) -> None:
+        """Removes the reactions described by each marker, marking them as expected so the removal is not counted as a lost vote."""
+        for marker in markers:
+            self.expected_react_deletions.add((marker.message, marker.user))
+            message = self.get_message(channel_id, marker.message)
+            await message.remove_reaction(self.get_emoji(marker.emoji), discord.Object(id=marker.user))
 
     def get_message(self, channel_id: int, message_id: int) -> discord.PartialMessage:
         """Get a PartialMessage object given raw integer IDs."""
@@ -122,6 +367,27 @@ class ContestBot(commands.Bot):
         channel: discord.TextChannel = self.get_channel(channel_id)
         return await channel.fetch_message(message_id)
 
+    async def fetch_messages(self, channel_id: int, message_ids: Iterable[int]) -> Dict[int, discord.Message]:
+        """
+        Fetch many full Message objects at once by paging through the channel's history, rather than fetching each one.
+
+        History is read oldest first, starting just before the oldest ID given and stopping once every message is found or the
+        newest ID given has been passed. Messages which could not be found are left out of the returned dictionary.
+        """
+        pending = set(message_ids)
+        found: Dict[int, discord.Message] = {}
+        if len(pending) == 0: return found
+
+        channel: discord.TextChannel = self.get_channel(channel_id)
+        newest = max(pending)
+        async for message in channel.history(limit=None, after=discord.Object(id=min(pending) - 1), oldest_first=True):
+            if message.id in pending:
+                found[message.id] = message
+                if len(found) == len(pending): break
+            if message.id >= newest: break
+
+        return found
+
     @staticmethod
     async def reject(message: discord.Message, warning: str, delete_delay: int = 2, warning_duration: int = 5) -> None:
         """Send a warning message and delete the message, then the warning"""
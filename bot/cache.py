@@ -0,0 +1,204 @@
+import logging
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, TYPE_CHECKING
+
+from bot import constants
+from bot.models import Guild
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+GuildConfig = namedtuple('GuildConfig', ['id', 'prefix', 'submission_channel', 'period_id', 'period_state', 'period_active'])
+
+
+def shard_id(guild_id: int, shard_count: int) -> int:
+    """The shard a guild's events are received on, as Discord assigns them."""
+    return (guild_id >> 22) % shard_count
+
+
+class GuildCache(object):
+    """
+    A process-wide cache of the guild configuration read on every message and reaction.
+
+    Entries are built from `Guild` rows and must be refreshed with `update` whenever the prefix, submission channel or current
+    period of a guild changes. They are held separately for each shard, so a single shard can be reloaded after it reconnects.
+    """
+
+    def __init__(self, shard_count: int = 1) -> None:
+        self.shard_count = shard_count
+        self._shards: Dict[int, Dict[int, GuildConfig]] = defaultdict(dict)  # Shard ID -> Guild ID -> configuration
+
+    @staticmethod
+    def build(guild: Guild) -> GuildConfig:
+        """Creates a immutable configuration snapshot from a Guild row."""
+        period = guild.current_period
+        return GuildConfig(id=guild.id, prefix=guild.prefix, submission_channel=guild.submission_channel,
+                           period_id=period.id if period is not None else None,
+                           period_state=period.state if period is not None else None,
+                           period_active=period.active if period is not None else False)
+
+    def read(self, session: 'Session', guild_ids: Optional[Iterable[int]] = None,
+             shard_ids: Optional[Iterable[int]] = None) -> List[GuildConfig]:
+        """
+        Reads the configurations of all active guilds, or only the guilds specified, without caching them. As nothing in the
+        cache is touched, this can be run on a database thread.
+
+        :param session: A SQLAlchemy session to use for querying.
+        :param guild_ids: The IDs of the guilds to read. All active guilds are read if not given.
+        :param shard_ids: If given, only guilds belonging to these shards are read.
+        """
+        query = session.query(Guild).filter_by(active=True)
+        if guild_ids is not None: query = query.filter(Guild.id.in_(set(guild_ids)))
+        if shard_ids is not None: shard_ids = set(shard_ids)
+        return [self.build(guild) for guild in query.all()
+                if shard_ids is None or shard_id(guild.id, self.shard_count) in shard_ids]
+
+    def load(self, session: 'Session', guild_ids: Optional[Iterable[int]] = None, shard_ids: Optional[Iterable[int]] = None) -> int:
+        """
+        Warms the cache with all active guilds, or only the guilds specified.
+
+        :param session: A SQLAlchemy session to use for querying.
+        :param guild_ids: The IDs of the guilds to load. All active guilds are loaded if not given.
+        :param shard_ids: If given, only guilds belonging to these shards are loaded.
+        :return: The number of guilds loaded.
+        """
+        configs = self.read(session, guild_ids, shard_ids)
+        for config in configs:
+            self.store(config)
+        logger.debug(f'Loaded {len(configs)} guild configuration{"s" if len(configs) != 1 else ""} into cache.')
+        return len(configs)
+
+    def fill(self, configs: Iterable[GuildConfig]) -> int:
+        """
+        Caches configurations returned by `read` on another thread. Guilds cached while they were being read, such as by a write
+        or a cache miss, keep their entry, as it is at least as new.
+
+        :return: The number of configurations cached.
+        """
+        filled = 0
+        for config in configs:
+            if self.get(config.id) is None:
+                self.store(config)
+                filled += 1
+        logger.debug(f'Loaded {filled} guild configuration{"s" if filled != 1 else ""} into cache.')
+        return filled
+
+    def update(self, guild: Guild) -> GuildConfig:
+        """Refreshes the cached configuration for a single guild from it's row."""
+        config = self._shards[shard_id(guild.id, self.shard_count)][guild.id] = self.build(guild)
+        return config
+
+    def store(self, config: GuildConfig) -> GuildConfig:
+        """Caches a configuration built elsewhere, such as by a write applied on the database writer's thread."""
+        self._shards[shard_id(config.id, self.shard_count)][config.id] = config
+        return config
+
+    def get(self, guild_id: int) -> Optional[GuildConfig]:
+        """Returns the cached configuration for a guild, or None if it has not been loaded."""
+        shard = self._shards.get(shard_id(guild_id, self.shard_count))
+        return shard.get(guild_id) if shard is not None else None
+
+    def invalidate(self, guild_id: Optional[int] = None) -> None:
+        """Drops the cached configuration for a single guild, or every guild if no ID is given."""
+        if guild_id is None:
+            self._shards.clear()
+        else:
+            self._shards[shard_id(guild_id, self.shard_count)].pop(guild_id, None)
+
+    def invalidate_shard(self, shard: int) -> None:
+        """Drops the cached configuration of every guild belonging to a shard."""
+        self._shards.pop(shard, None)
+
+    def resize(self, shard_count: int) -> None:
+        """Changes the number of shards guilds are split between, dropping every cached configuration."""
+        self.shard_count = shard_count
+        self._shards.clear()
+
+    def shard_sizes(self) -> Dict[int, int]:
+        """The number of guilds cached for each shard."""
+        return {shard: len(guilds) for shard, guilds in self._shards.items()}
+
+    def __contains__(self, guild_id: int) -> bool:
+        return self.get(guild_id) is not None
+
+    def __len__(self) -> int:
+        return sum(map(len, self._shards.values()))
+
+
+class ExpiringSet(object):
+    """
+    A set whose entries expire after a time-to-live, capped to a maximum size by evicting the oldest entries first.
+
+    Used to remember actions the bot has taken itself (such as deleting a message) until the matching gateway event arrives.
+    If the event never arrives the entry simply expires instead of lingering forever. Hits, misses and expirations are counted.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, float]' = OrderedDict()  # Item -> time of expiry, oldest first
+
+        self.hits = 0  # Items consumed while present.
+        self.misses = 0  # Items looked for but not present.
+        self.expirations = 0  # Items dropped after their time-to-live passed.
+        self.evictions = 0  # Items dropped early to stay within the maximum size.
+
+    def add(self, item: Hashable, ttl: Optional[float] = None) -> None:
+        """Adds a item, or refreshes it's expiry if it is already present."""
+        self.expire()
+        self._entries[item] = self._clock() + (ttl if ttl is not None else self.ttl)
+        self._entries.move_to_end(item)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def consume(self, item: Hashable) -> bool:
+        """Removes a item, returning whether or not it was present and unexpired."""
+        expiry = self._entries.pop(item, None)
+        if expiry is None:
+            self.misses += 1
+            return False
+        elif expiry <= self._clock():
+            self.expirations += 1
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def discard(self, item: Hashable) -> None:
+        """Removes a item if it is present."""
+        self._entries.pop(item, None)
+
+    def expire(self) -> int:
+        """
+        Drops expired items from the oldest end, returning the number dropped.
+
+        Items added with a longer time-to-live than those after them can hold back this sweep, but expired items are never
+        reported as present and are still removed when consumed or evicted.
+        """
+        now, expired = self._clock(), 0
+        while self._entries:
+            item, expiry = next(iter(self._entries.items()))
+            if expiry > now: break
+            del self._entries[item]
+            expired += 1
+        self.expirations += expired
+        return expired
+
+    def stats(self) -> Dict[str, int]:
+        """The current size and counters of this set."""
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'expirations': self.expirations,
+                'evictions': self.evictions}
+
+    def __contains__(self, item: Hashable) -> bool:
+        expiry = self._entries.get(item)
+        return expiry is not None and expiry > self._clock()
+
+    def __len__(self) -> int:
+        self.expire()
+        return len(self._entries)
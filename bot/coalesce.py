@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+from bot import constants
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+
+class EventCoalescer(object):
+    """
+    Merges bursts of events sharing a key (such as reactions on the same message) into batches.
+
+    The first event for a key starts a short window; every event for that key arriving within it is handed to the handler as
+    one batch, in arrival order. Batches for the same key never run concurrently, so events from a single user are always
+    handled in the order they happened, while the total number of batches running at once is capped by the worker limit.
+    """
+
+    def __init__(self, handler: Callable[[Hashable, List[Any]], Awaitable[None]], window: float = constants.COALESCE_WINDOW,
+                 workers: int = constants.COALESCE_WORKERS) -> None:
+        """
+        :param handler: A coroutine function called with a key and the list of events gathered for it.
+        :param window: Seconds to wait for further events after the first event of a batch.
+        :param workers: Maximum number of batches handled at once.
+        """
+        self.handler = handler
+        self.window = window
+        self._workers = asyncio.Semaphore(workers)
+        self._pending: Dict[Hashable, List[Any]] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def submit(self, key: Hashable, event: Any) -> None:
+        """Queues a event, starting a new batch for it's key if one is not already waiting."""
+        self._pending.setdefault(key, []).append(event)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(self._run(key))
+
+    async def _run(self, key: Hashable) -> None:
+        """Handles batches for a single key until no more events are waiting for it."""
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.window)
+                events = self._pending.pop(key)
+                async with self._workers:
+                    try:
+                        await self.handler(key, events)
+                    except Exception as error:
+                        logger.error(f'Failed to handle {len(events)} coalesced events for {key}.', exc_info=error)
+        finally:
+            self._tasks.pop(key, None)
+
+    @property
+    def depth(self) -> int:
+        """The number of events waiting to be handled."""
+        return sum(map(len, self._pending.values()))
+
+    async def drain(self) -> None:
+        """Waits until every queued event has been handled."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def close(self) -> None:
+        """Cancels every waiting batch, dropping their events."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._pending.clear()
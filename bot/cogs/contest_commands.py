@@ -1,12 +1,22 @@
+import asyncio
+import io
 import logging
+import os
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
 import discord
 from discord.ext import commands
 from discord.ext.commands import BucketType, Context, errors
+from sqlalchemy.orm import Session
 
-from bot import checks, constants, helpers
+from bot import checks, collage, constants, export, helpers, metrics, stats
 from bot.bot import ContestBot
-from bot.models import Guild, Period, PeriodStates, Submission
+from bot.cache import GuildCache, GuildConfig
+from bot.leaderboard import Leaderboard, jump_url
+from bot.models import Guild, Period, PeriodStates, Result, Schedule
 
 logger = logging.getLogger(__file__)
 logger.setLevel(constants.LOGGING_LEVEL)
@@ -22,6 +32,7 @@ class ContestCommandsCog(commands.Cog, name='Contest'):
 
     def __init__(self, bot: ContestBot) -> None:
         self.bot = bot
+        self.advancing: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)  # Guild ID -> lock held while advancing it's period
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx: Context, error: discord.ext.commands.CommandError):
@@ -88,18 +99,24 @@ class ContestCommandsCog(commands.Cog, name='Contest'):
     async def prefix(self, ctx, new_prefix: str):
         """Changes the bot's saved prefix."""
 
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).filter_by(id=ctx.guild.id).first()
-
-            if 1 <= len(new_prefix) <= 2:
-                if guild.prefix == new_prefix:
-                    return await ctx.send(embed=helpers.error_embed(message=f'The prefix is already `{new_prefix}`.'))
-                else:
-                    guild.prefix = new_prefix
-                    return await ctx.send(embed=helpers.success_embed(message=f'Prefix changed to `{new_prefix}`.'))
+        if 1 <= len(new_prefix) <= 2:
+            config = await self.bot.run_session(self._set_prefix, ctx.guild.id, new_prefix)
+            if config is None:
+                return await ctx.send(embed=helpers.error_embed(message=f'The prefix is already `{new_prefix}`.'))
             else:
-                return await ctx.send(embed=helpers.error_embed(
-                        message='Invalid argument. Prefix must be 1 or 2 characters long.'))
+                self.bot.guild_cache.store(config)
+                return await ctx.send(embed=helpers.success_embed(message=f'Prefix changed to `{new_prefix}`.'))
+        else:
+            return await ctx.send(embed=helpers.error_embed(
+                    message='Invalid argument. Prefix must be 1 or 2 characters long.'))
+
+    @staticmethod
+    def _set_prefix(session: Session, guild_id: int, new_prefix: str) -> Optional[GuildConfig]:
+        """Changes a guild's prefix, returning it's new configuration or None if the prefix was unchanged."""
+        guild: Guild = session.query(Guild).get(guild_id)
+        if guild.prefix == new_prefix: return None
+        guild.prefix = new_prefix
+        return GuildCache.build(guild)
 
     @commands.command()
     @commands.guild_only()
@@ -107,18 +124,24 @@ class ContestCommandsCog(commands.Cog, name='Contest'):
     async def submission(self, ctx: Context, new_submission: discord.TextChannel) -> None:
         """Changes the bot's saved submission channel."""
 
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(ctx.guild.id)
-
-            if guild.submission_channel is not None and guild.submission_channel == new_submission.id:
-                await ctx.send(embed=helpers.error_embed(
-                        message=f'The submission channel is already set to {new_submission.mention}.'))
-            else:
-                # TODO: Add channel permissions resetting/migration
-                guild.submission_channel = new_submission.id
-                await ctx.send(embed=helpers.success_embed(
-                        message=f':white_check_mark:  Submission channel changed to {new_submission.mention}.'
-                ))
+        config = await self.bot.run_session(self._set_submission_channel, ctx.guild.id, new_submission.id)
+        if config is None:
+            await ctx.send(embed=helpers.error_embed(
+                    message=f'The submission channel is already set to {new_submission.mention}.'))
+        else:
+            self.bot.guild_cache.store(config)
+            await ctx.send(embed=helpers.success_embed(
+                    message=f':white_check_mark:  Submission channel changed to {new_submission.mention}.'
+            ))
+
+    @staticmethod
+    def _set_submission_channel(session: Session, guild_id: int, channel_id: int) -> Optional[GuildConfig]:
+        """Changes a guild's submission channel, returning it's new configuration or None if the channel was unchanged."""
+        guild: Guild = session.query(Guild).get(guild_id)
+        if guild.submission_channel is not None and guild.submission_channel == channel_id: return None
+        # TODO: Add channel permissions resetting/migration
+        guild.submission_channel = channel_id
+        return GuildCache.build(guild)
 
     # noinspection PyDunderSlots,PyUnresolvedReferences
     @commands.command()
@@ -135,32 +158,62 @@ class ContestCommandsCog(commands.Cog, name='Contest'):
         :param duration: If given, the advance command will be repeated once more after the duration (in seconds) has passed.
         :param pingback: Whether or not the user should be pinged back when the duration is passed.
         """
-        # TODO: Implement pingback argument
         # TODO: Ensure that permissions for this command are being correctly tested for.
         if duration is not None: assert duration >= 0, "If specified, duration must be more than or equal to zero."
 
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(ctx.guild.id)
-            period: Period = guild.current_period
+        period_id, state, active = await self.advance_period(ctx.guild, ctx)
+
+        if duration is not None:
+            if not active:
+                await ctx.send(embed=helpers.error_embed(message='The period has finished, so it cannot be advanced automatically.'))
+                return
+
+            schedule_id, due = await self.bot.run_session(self._add_schedule, period_id, state, datetime.utcnow() + timedelta(seconds=duration),
+                                                          ctx.channel.id, ctx.author.id if pingback else None)
+            self.bot.scheduler.add(schedule_id, due)
+
+            await ctx.send(embed=helpers.general_embed(message=f'The period will advance again in {helpers.format_duration(duration)}.'))
+
+    @staticmethod
+    def _add_schedule(session: Session, period_id: int, state: PeriodStates, due: datetime, channel_id: int,
+                      user_id: Optional[int]) -> Tuple[int, datetime]:
+        schedule = Schedule(period_id=period_id, state=state, due=due, channel_id=channel_id, user_id=user_id)
+        session.add(schedule)
+        session.flush()
+        return schedule.id, schedule.due
+
+    @metrics.timed('advance')
+    async def advance_period(self, guild: discord.Guild, destination: discord.abc.Messageable,
+                             mention: Optional[str] = None) -> Tuple[int, PeriodStates, bool]:
+        """
+        Advances the current period of a guild, or starts a new one, updating the submission channel's permissions to match.
+
+        :param guild: The guild whose period should be advanced.
+        :param destination: Where progress and the result should be reported.
+        :param mention: Included with the result, such as to ping back the user who scheduled the advancement.
+        :return: The ID, new state and activity of the guild's current period.
+        """
+        async with self.advancing[guild.id]:
+            # Buffered votes must be written before the period's results are tallied.
+            await self.bot.end_voting(guild.id)
+            submission_channel, period_id, state, submission_ids, created = await self.bot.run_read(self._read_period, guild.id)
 
             # Handle non-existent or previously completed period in the current guild
-            if period is None or not period.active:
-                if period is None:
+            if period_id is None:
+                if created:
                     overwrite = discord.PermissionOverwrite()
                     overwrite.send_messages = False
                     overwrite.add_reactions = False
-                    await self.bot.get_channel(guild.submission_channel).set_permissions(ctx.guild.default_role, overwrite=overwrite)
-                    await ctx.send(embed=helpers.success_embed(message='Period created, channel permissions set.'))
+                    await self.bot.get_channel(submission_channel).set_permissions(guild.default_role, overwrite=overwrite)
+                    await destination.send(embed=helpers.success_embed(message='Period created, channel permissions set.'))
 
-                period = Period(guild_id=guild.id)
-                session.add(period)
-                session.commit()
-
-                guild.current_period = period
-                await ctx.send(embed=helpers.success_embed(message='New period started - submissions and voting disabled.'))
+                period_id, state, active, config = await self.bot.run_session(self._start_period, guild.id)
+                self.bot.guild_cache.store(config)
+                await destination.send(content=mention,
+                                       embed=helpers.success_embed(message='New period started - submissions and voting disabled.'))
             else:
-                channel: discord.TextChannel = self.bot.get_channel(guild.submission_channel)
-                target_role: discord.Role = ctx.guild.default_role
+                channel: discord.TextChannel = self.bot.get_channel(submission_channel)
+                target_role: discord.Role = guild.default_role
                 # TODO: Research best way to implement contest roles with vagabondit's input
 
                 overwrite = discord.PermissionOverwrite()
@@ -169,26 +222,104 @@ class ContestCommandsCog(commands.Cog, name='Contest'):
                 response = 'Permissions unchanged - Period state error.'
 
                 # Handle previous period being completed.
-                if period.state == PeriodStates.READY:
+                if state == PeriodStates.READY:
                     overwrite.send_messages = True
                     response = 'Period started, submissions allowed. Advance again to pause.'
                 # Handle submissions state
-                elif period.state == PeriodStates.SUBMISSIONS:
+                elif state == PeriodStates.SUBMISSIONS:
                     response = 'Period paused, submissions disabled. Advance again to start voting.'
                 # Handle voting state
-                elif period.state == PeriodStates.PAUSED:
-                    _guild: discord.Guild = ctx.guild
-                    await self.bot.add_voting_reactions(channel=channel, submissions=period.submissions)
+                elif state == PeriodStates.PAUSED:
+                    await self.bot.add_voting_reactions(channel=channel, submission_ids=submission_ids,
+                                                        progress=helpers.progress_reporter(destination, 'Adding voting reactions'))
                     overwrite.add_reactions = True
                     response = 'Period unpaused, reactions allowed. Advance again to stop voting and finalize the tallying.'
                 # Print period submissions
-                elif period.state == PeriodStates.VOTING:
+                elif state == PeriodStates.VOTING:
                     response = 'Period stopped. Reactions and submissions disabled. Advance again to start a new period.'
-                    # TODO: Fetch all submissions related to this period and show a embed
 
-                period.advance_state()
+                period_id, state, active, config, superseded = await self.bot.run_session(self._advance_state, period_id)
+                self.bot.guild_cache.store(config)
+                for schedule_id in superseded:
+                    self.bot.scheduler.cancel(schedule_id)
                 await channel.set_permissions(target_role, overwrite=overwrite)
-                await ctx.send(embed=helpers.success_embed(message=response))
+                await destination.send(content=mention, embed=helpers.success_embed(message=response))
+                if state == PeriodStates.FINISHED:
+                    await self.send_results(destination, guild.id, period_id)
+
+            return period_id, state, active
+
+    @staticmethod
+    def _read_period(session: Session, guild_id: int) -> Tuple[int, Optional[int], Optional[PeriodStates], Optional[List[int]], bool]:
+        """
+        Reads what advancing a guild's period needs to know: it's submission channel, the ID and state of it's active period
+        (if any), the submissions to add voting reactions to when leaving the paused state, and whether no period was ever made.
+        """
+        guild: Guild = session.query(Guild).get(guild_id)
+        period: Optional[Period] = guild.current_period
+        period_id, state = (period.id, period.state) if period is not None and period.active else (None, None)
+        submission_ids = [submission.id for submission in period.submissions] if state == PeriodStates.PAUSED else None
+        return guild.submission_channel, period_id, state, submission_ids, period is None
+
+    @staticmethod
+    def _start_period(session: Session, guild_id: int) -> Tuple[int, PeriodStates, bool, GuildConfig]:
+        guild: Guild = session.query(Guild).get(guild_id)
+        period = Period(guild_id=guild_id)
+        session.add(period)
+        session.flush()
+
+        guild.current_period = period
+        return period.id, period.state, period.active, GuildCache.build(guild)
+
+    @classmethod
+    def _advance_state(cls, session: Session, period_id: int) -> Tuple[int, PeriodStates, bool, GuildConfig, List[int]]:
+        """Advances a period's state, returning it's new state and the IDs of any schedules superseded by doing so."""
+        period: Period = session.query(Period).get(period_id)
+        period.advance_state()
+        return period.id, period.state, period.active, GuildCache.build(period.guild), cls._supersede_schedules(session, period.id)
+
+    @staticmethod
+    def _supersede_schedules(session: Session, period_id: int) -> List[int]:
+        """
+        Completes every pending schedule of a period, as none of them apply once it has been advanced or closed by other means,
+        returning their IDs so they can be cancelled.
+        """
+        schedules = session.query(Schedule).filter_by(period_id=period_id, completed=False).all()
+        for schedule in schedules:
+            schedule.completed = True
+        return [schedule.id for schedule in schedules]
+
+    @commands.Cog.listener()
+    async def on_schedule_due(self, schedule_id: int) -> None:
+        """Carries out a timed advancement, unless the period has already been advanced past it or closed."""
+        due = await self.bot.run_session(self._complete_schedule, schedule_id)
+        if due is None: return
+        guild_id, channel_id, user_id, submission_channel = due
+
+        guild: discord.Guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            logger.warning(f'Schedule {schedule_id} is due, but guild {guild_id} could not be found.')
+            return
+
+        destination = self.bot.get_channel(channel_id) or self.bot.get_channel(submission_channel)
+        try:
+            await self.advance_period(guild, destination, mention=f'<@{user_id}>' if user_id is not None else None)
+        except Exception as error:
+            logger.error(f'Failed to carry out schedule {schedule_id} for guild {guild_id}.', exc_info=error)
+
+    @staticmethod
+    def _complete_schedule(session: Session, schedule_id: int) -> Optional[Tuple[int, int, Optional[int], int]]:
+        """Marks a schedule as completed, returning where to advance and report it, or None if it should be skipped."""
+        schedule: Schedule = session.query(Schedule).get(schedule_id)
+        if schedule is None or schedule.completed: return None
+
+        # Marked before advancing, so a failure is reported rather than retried on every start.
+        schedule.completed = True
+        period: Period = schedule.period
+        if not period.active or period.state != schedule.state or period.guild.current_period_id != period.id:
+            logger.info(f'Skipping stale {schedule}, period is now {period}.')
+            return None
+        return period.guild_id, schedule.channel_id, schedule.user_id, period.guild.submission_channel
 
     @advance.error
     async def advance_error(self, error: errors.CommandError, ctx: Context) -> None:
@@ -208,81 +339,281 @@ class ContestCommandsCog(commands.Cog, name='Contest'):
     @checks.privileged()
     async def close(self, ctx: Context) -> None:
         """Closes the current period."""
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(ctx.guild.id)
-            period: Period = guild.current_period
+        await self.bot.end_voting(ctx.guild.id)
+        closed = await self.bot.run_session(self._close_period, ctx.guild.id)
 
-            if period is None or not period.active:
-                await ctx.send(embed=helpers.error_embed(message='No period is currently active.'))
-            else:
-                overwrite = discord.PermissionOverwrite()
-                overwrite.send_messages = False
-                overwrite.add_reactions = False
-                period.deactivate()
-                await ctx.send(embed=helpers.success_embed(message='The current period has been closed.'))
+        if closed is None:
+            await ctx.send(embed=helpers.error_embed(message='No period is currently active.'))
+        else:
+            period_id, finalized, config, superseded = closed
+            self.bot.guild_cache.store(config)
+            for schedule_id in superseded:
+                self.bot.scheduler.cancel(schedule_id)
+            await ctx.send(embed=helpers.success_embed(message='The current period has been closed.'))
+            if finalized:
+                await self.send_results(ctx, ctx.guild.id, period_id)
+
+    @classmethod
+    def _close_period(cls, session: Session, guild_id: int) -> Optional[Tuple[int, bool, GuildConfig, List[int]]]:
+        """
+        Deactivates a guild's current period, returning it's ID, whether it has results, the guild's new configuration and the IDs
+        of the schedules superseded by closing it.
+        """
+        guild: Guild = session.query(Guild).get(guild_id)
+        period: Period = guild.current_period
+        if period is None or not period.active: return None
+
+        period.deactivate()
+        return period.id, len(period.results) > 0, GuildCache.build(guild), cls._supersede_schedules(session, period.id)
+
+    @staticmethod
+    def results_embed(guild: Guild, period: Period, count: int = 10) -> discord.Embed:
+        """Builds a embed announcing the recorded results of a finished period."""
+        board = Leaderboard.from_results(period.id, [(result.position, result.submission_id, result.user_id, result.count)
+                                                     for result in period.results])
+        description = board.render(guild.id, guild.submission_channel, count=count) or 'No submissions were made.'
+        return helpers.general_embed(title='Results', message=description, timestamp=True)
+
+    @staticmethod
+    def collage_entries(period: Period) -> List[collage.Entry]:
+        """The top submissions of a finished period, as shown in it's collage."""
+        return [collage.Entry(result.position, result.submission_id, result.user_id, result.count)
+                for result in period.results[:constants.COLLAGE_SIZE]]
+
+    async def send_results(self, destination: discord.abc.Messageable, guild_id: int, period_id: int) -> None:
+        """Posts the results of a finished period, along with a collage of it's top submissions."""
+        embed, channel_id, entries = await self.bot.run_read(self._read_results, guild_id, period_id)
+        await destination.send(**await self.with_collage(embed, period_id, channel_id, entries))
+
+    @classmethod
+    def _read_results(cls, session: Session, guild_id: int, period_id: int) -> Tuple[discord.Embed, int, List[collage.Entry]]:
+        """Builds the results embed of a finished period, returning it with the submission channel and the collage's entries."""
+        guild: Guild = session.query(Guild).get(guild_id)
+        period: Period = session.query(Period).get(period_id)
+        return cls.results_embed(guild, period), guild.submission_channel, cls.collage_entries(period)
+
+    async def with_collage(self, embed: discord.Embed, period_id: int, channel_id: int, entries: List[collage.Entry]) -> Dict[str, Any]:
+        """
+        Renders (or fetches the cached) collage of a finished period's top submissions, showing it in the embed given.
+
+        :return: The arguments to send the embed with. Only the embed is included if a collage could not be rendered.
+        """
+        try:
+            data = await self.bot.collages.get(period_id, channel_id, entries)
+        except Exception as error:
+            logger.error(f'Failed to render the results collage of period {period_id}.', exc_info=error)
+            data = None
+
+        if data is None: return dict(embed=embed)
+        embed.set_image(url=f'attachment://{collage.FILENAME}')
+        return dict(embed=embed, file=discord.File(io.BytesIO(data), filename=collage.FILENAME))
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.max_concurrency(1, per=BucketType.guild)
+    @checks.privileged()
+    async def reconcile(self, ctx: Context, thorough: bool = False) -> None:
+        """
+        Re-reads the submission channel and corrects any votes or submissions that were missed.
+
+        :param ctx: The context used for command invocation.
+        :param thorough: Whether or not every reaction should be re-read, even when the vote counts already match.
+        """
+        async with ctx.typing():
+            report = await self.bot.reconciler.reconcile_guild(ctx.guild.id, thorough=thorough)
+
+        if report is None:
+            await ctx.send(embed=helpers.error_embed(message='No period is currently active.'))
+        else:
+            await ctx.send(embed=helpers.success_embed(
+                    message=f'Checked {report.submissions} submissions in {report.duration:.2f}s.\n'
+                            f'{report.votes_added} votes added, {report.votes_removed} votes removed, '
+                            f'{report.deleted} deleted submissions removed and {report.reactions_removed} reactions removed.'))
 
     @commands.command()
     @commands.guild_only()
     async def status(self, ctx: Context) -> None:
         """Provides the bot's current state in relation to internal configuration and the server's contest, if active."""
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(ctx.guild.id)
-            period: Period = guild.current_period
-            embed = discord.Embed(color=constants.GENERAL_COLOR, title='Status')
-
-            value = f'<#{guild.submission_channel}>' if guild.submission_channel else 'Please set a submission channel.'
-            embed.add_field(name='Submission Channel', value=value)
-
-            if period is not None:
-                value = 'None' if guild.current_period is None else \
-                    (guild.current_period.state.name.capitalize() if guild.current_period.active else 'Finished')
-                embed.add_field(name='Status', inline=False, value=f'{value} - {period.permission_explanation()}')
-                value = len(period.submissions)
-                value = str(value) + '  submission' + ('s' if value > 1 or value == 0 else '')
-                embed.add_field(name='Submissions', inline=False, value=value)
-
-            await ctx.send(embed=embed)
+        await ctx.send(embed=await self.bot.run_read(self._read_status, ctx.guild.id))
+
+    @staticmethod
+    def _read_status(session: Session, guild_id: int) -> discord.Embed:
+        guild: Guild = session.query(Guild).get(guild_id)
+        period: Period = guild.current_period
+        embed = discord.Embed(color=constants.GENERAL_COLOR, title='Status')
+
+        value = f'<#{guild.submission_channel}>' if guild.submission_channel else 'Please set a submission channel.'
+        embed.add_field(name='Submission Channel', value=value)
+
+        if period is not None:
+            value = 'None' if guild.current_period is None else \
+                (guild.current_period.state.name.capitalize() if guild.current_period.active else 'Finished')
+            embed.add_field(name='Status', inline=False, value=f'{value} - {period.permission_explanation()}')
+            value = len(period.submissions)
+            value = str(value) + '  submission' + ('s' if value > 1 or value == 0 else '')
+            embed.add_field(name='Submissions', inline=False, value=value)
+        return embed
 
     @commands.command()
     @commands.guild_only()
     async def leaderboard(self, ctx: Context, count: int = 10, page: int = 0) -> None:
         """Prints a leaderboard"""
-        page = min(page, 0)
-        count = max(min(count, 1), 15)
+        page = max(page, 0)
+        count = max(min(count, 15), 1)
 
         # TODO: Make interactive and reaction-based
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(ctx.guild.id)
-            if guild.current_period is not None:
-                board = session.query(Submission) \
-                    .filter_by(period_id=guild.current_period_id) \
-                    .order_by(Submission.count.desc()) \
-                    .slice(page * count, (page + 1) * count) \
-                    .all()
-
-                description = ''
-                position = 0  # It will be incremented on the first step, so we start at 0.
-                emotes = helpers.ending_iterator([':trophy:', ':second_place:', ':third_place:', ''])
-                emote, previous_count = None, None
-
-                for submission in board:
-                    message = self.bot.get_message(guild.submission_channel, submission.id)
-
-                    if submission.count != previous_count:
-                        emote = next(emotes)
-                        previous_count = submission.count
-                        position += 1
-
-                    description += f'`{str(position).zfill(2)}` {emote + " " if emote else ""}<@{submission.user}> with {submission.count} ' \
-                                   f'vote{"s" if submission.count != 1 else ""} [Jump]({message.jump_url})\n'
-
-                if not description:
-                    description = 'No one has submitted anything yet.'
-
-                embed = helpers.general_embed(title='Leaderboard', message=description, timestamp=True)
-                embed.set_footer(text='Contest is still in progress...' if guild.current_period.active else 'Contest has finished.')
-
-                await ctx.send(embed=embed)
+        current = await self.bot.run_read(self._read_current_period, ctx.guild.id)
+        if current is None: return
+        period_id, channel_id, active, entries = current
+        board = await self.bot.leaderboards.load(period_id, self.bot.run_read)
+        description = board.render(ctx.guild.id, channel_id, page=page, count=count)
+
+        if not description:
+            description = 'No one has submitted anything yet.'
+
+        embed = helpers.general_embed(title='Leaderboard', message=description, timestamp=True)
+        embed.set_footer(text='Contest is still in progress...' if active else 'Contest has finished.')
+
+        # Finished periods show their results collage, which is only rendered once.
+        if board.final and page == 0:
+            await ctx.send(**await self.with_collage(embed, period_id, channel_id, entries))
+        else:
+            await ctx.send(embed=embed)
+
+    @classmethod
+    def _read_current_period(cls, session: Session, guild_id: int) -> Optional[Tuple[int, int, bool, List[collage.Entry]]]:
+        """Reads the ID, submission channel, activity and collage entries (once finished) of a guild's current period, if any."""
+        guild: Guild = session.query(Guild).get(guild_id)
+        period: Optional[Period] = guild.current_period
+        if period is None: return None
+        return period.id, guild.submission_channel, period.active, cls.collage_entries(period)
+
+    @commands.command(name='metrics')
+    @commands.guild_only()
+    @checks.privileged()
+    async def show_metrics(self, ctx: Context) -> None:
+        """Shows handler timings, database and Discord API usage, and queue depths since the bot started."""
+        lines = self.bot.metrics.summary()
+        await ctx.send(embed=helpers.general_embed(title='Metrics', message='\n'.join(lines) or 'Nothing has been recorded yet.',
+                                                   timestamp=True))
+
+    @commands.command(name='export')
+    @commands.guild_only()
+    @commands.max_concurrency(1, per=BucketType.guild)
+    @checks.privileged()
+    async def export_data(self, ctx: Context, file_format: str = 'csv', since: str = None, until: str = None) -> None:
+        """
+        Uploads this server's periods, submissions and votes as a zip archive, with one file per table.
+
+        :param ctx: The context used for command invocation.
+        :param file_format: One of csv, jsonl or parquet.
+        :param since: Only include periods started on or after this date (YYYY-MM-DD).
+        :param until: Only include periods started before this date (YYYY-MM-DD).
+        """
+        file_format = file_format.lower()
+        if file_format not in export.formats():
+            await ctx.send(embed=helpers.error_embed(message=f'The format must be one of {", ".join(export.formats())}.'))
+            return
+        try:
+            since, until = (export.parse_date(date) if date is not None else None for date in (since, until))
+        except ValueError:
+            await ctx.send(embed=helpers.error_embed(message='Dates must be given as YYYY-MM-DD.'))
+            return
+
+        async with ctx.typing():
+            with tempfile.TemporaryDirectory() as directory:
+                counts = await self.bot.run_read(export.export, directory, file_format, guild_id=ctx.guild.id, since=since,
+                                                 until=until)
+                path = await self.bot.loop.run_in_executor(None, export.archive, directory)
+
+                summary = ', '.join(f'{count} {name} row{"s" if count != 1 else ""}' for name, count in counts.items())
+                if os.path.getsize(path) > constants.EXPORT_UPLOAD_LIMIT:
+                    await ctx.send(embed=helpers.error_embed(
+                            message=f'The export ({summary}) is too large to upload. Narrow the date range, or use `python -m bot.export`.'))
+                else:
+                    await ctx.send(embed=helpers.success_embed(message=f'Exported {summary}.'),
+                                   file=discord.File(path, filename=f'export-{ctx.guild.id}.zip'))
+
+    @commands.command()
+    @commands.guild_only()
+    async def history(self, ctx: Context, count: int = 5) -> None:
+        """Lists the winners of this server's most recently finished contests."""
+        count = max(min(count, 10), 1)
+
+        lines = await self.bot.run_read(self._read_history, ctx.guild.id, count)
+        embed = helpers.general_embed(title='History', message='\n'.join(lines) or 'No contests have finished yet.', timestamp=True)
+        await ctx.send(embed=embed)
+
+    @staticmethod
+    def _read_history(session: Session, guild_id: int, count: int) -> List[str]:
+        """Lists the winners of a guild's most recently finished periods, one line per period."""
+        guild: Guild = session.query(Guild).get(guild_id)
+        periods = session.query(Period.id, Period.finished_time) \
+            .filter(Period.guild_id == guild.id, Period.results.any()) \
+            .order_by(Period.finished_time.desc(), Period.id.desc()) \
+            .limit(count).all()
+
+        winners: Dict[int, list] = {period_id: [] for period_id, _ in periods}
+        if len(winners) > 0:
+            query = session.query(Result.period_id, Result.submission_id, Result.user_id, Result.count) \
+                .filter(Result.period_id.in_(winners.keys()), Result.position == 1) \
+                .order_by(Result.submission_id)
+            for period_id, submission_id, user_id, votes in query.all():
+                winners[period_id].append((submission_id, user_id, votes))
+
+        lines = []
+        for period_id, finished_time in periods:
+            date = finished_time.strftime('%Y-%m-%d') if finished_time is not None else 'Unknown'
+            won = ', '.join(f'<@{user_id}> with {votes} vote{"s" if votes != 1 else ""} '
+                            f'[Jump]({jump_url(guild_id, guild.submission_channel, submission_id)})'
+                            for submission_id, user_id, votes in winners[period_id])
+            lines.append(f'`{date}` :trophy: {won or "No submissions"}')
+        return lines
+
+    @commands.command(name='stats')
+    @commands.guild_only()
+    async def user_stats(self, ctx: Context, member: discord.Member = None) -> None:
+        """Shows a user's contest statistics in this server."""
+        member = member or ctx.author
+        summary = await self.bot.run_read(stats.user_summary, ctx.guild.id, member.id)
+
+        if summary is None:
+            await ctx.send(embed=helpers.general_embed(message=f'{member.mention} has not submitted to any finished contests yet.'))
+            return
+
+        description = f'Contests: {summary.contests}\n' \
+                      f'Wins: {summary.wins}\n' \
+                      f'Best Position: {summary.best_position}\n' \
+                      f'Votes Received: {summary.votes} ({summary.average_votes:.1f} per contest)\n' \
+                      f'Current Streak: {summary.streak} (Best: {summary.best_streak})'
+        embed = helpers.general_embed(title=f'Statistics for {member.display_name}', message=description, timestamp=True)
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    @commands.guild_only()
+    async def winners(self, ctx: Context, count: int = 10) -> None:
+        """Lists the users who have won the most contests in this server."""
+        count = max(min(count, 15), 1)
+        summaries = await self.bot.run_read(stats.top_winners, ctx.guild.id, limit=count)
+
+        description = ''.join(f'`{str(position).zfill(2)}` <@{summary.user}> with {summary.wins} win{"s" if summary.wins != 1 else ""}'
+                              f' from {summary.contests} contest{"s" if summary.contests != 1 else ""}\n'
+                              for position, summary in enumerate(summaries, start=1))
+        embed = helpers.general_embed(title='Winners', message=description or 'No contests have finished yet.', timestamp=True)
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    @commands.guild_only()
+    async def turnout(self, ctx: Context, count: int = 5) -> None:
+        """Shows the number of submissions, voters and votes in this server's most recently finished contests."""
+        count = max(min(count, 15), 1)
+        periods = await self.bot.run_read(stats.turnout, ctx.guild.id, limit=count)
+
+        description = ''.join(f'`{period.finished_time.strftime("%Y-%m-%d") if period.finished_time is not None else "Unknown"}` '
+                              f'{period.submissions} submissions, {period.voters} voters, {period.votes} votes\n'
+                              for period in periods)
+        embed = helpers.general_embed(title='Turnout', message=description or 'No contests have finished yet.', timestamp=True)
+        await ctx.send(embed=embed)
 
 
 def setup(bot) -> None:
@@ -1,12 +1,17 @@
 import logging
-from typing import List
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
 
 import discord
 from discord.ext import commands
+from sqlalchemy.orm import Session
 
-from bot import constants, helpers
+from bot import constants, helpers, metrics
 from bot.bot import ContestBot
-from bot.models import Guild, Period, PeriodStates, Submission
+from bot.coalesce import EventCoalescer
+from bot.duplicates import HashedSubmission, Match
+from bot.constants import ReactionMarker
+from bot.models import Period, PeriodStates, Submission
 
 logger = logging.getLogger(__file__)
 logger.setLevel(constants.LOGGING_LEVEL)
@@ -20,181 +25,276 @@ class ContestEventsCog(commands.Cog):
 
     def __init__(self, bot: ContestBot):
         self.bot = bot
+        self.votes = EventCoalescer(self.handle_votes)  # Upvote reaction events, batched per message
+        bot.metrics.gauge('contest_coalesced_reactions', 'Reaction events waiting', lambda: self.votes.depth)
+
+    def cog_unload(self) -> None:
+        self.votes.close()
 
     @commands.Cog.listener()
+    @metrics.timed('on_message')
     async def on_message(self, message: discord.Message):
         if message.author == self.bot.user or message.author.bot or not message.guild: return
+        if not await self.bot.is_submission_channel(message.guild.id, message.channel.id): return
 
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(message.guild.id)
-
-            channel: discord.TextChannel = message.channel
-            if channel.id == guild.submission_channel:
-                attachments = message.attachments
-
-                # Ensure that the submission contains at least one attachment
-                if len(attachments) == 0:
-                    await self.bot.reject(message, f'Each submission must contain exactly one image.')
-                # Ensure the image contains no more than one attachment
-                elif len(attachments) > 1:
-                    await self.bot.reject(message, f'Each submission must contain exactly one image.')
-                elif guild.current_period is None:
-                    await self.bot.reject(message, f'A period has not been started. Submissions should not be allowed at this moment.')
-                elif guild.current_period.state != PeriodStates.SUBMISSIONS:
-                    logger.warning(f'Valid submission was sent outside of Submissions in'
-                                   f' {channel.id}/{message.id}. Permissions error? Removing.')
-                    await message.delete()
-                else:
-                    attachment = attachments[0]
-                    # TODO: Add helper for displaying error/warning messages
-                    if attachment.is_spoiler():
-                        await self.bot.reject(message, 'Attachment must not make use of a spoiler.')
-                    elif attachment.width is None:
-                        await self.bot.reject(message, 'Attachment must be a image or video.')
-                    else:
-                        last_submission: Submission = session.query(Submission).filter_by(period=guild.current_period,
-                                                                                          user=message.author.id).first()
-                        if last_submission is not None:
-                            # delete last submission
-                            submission_msg = await channel.fetch_message(last_submission.id)
-                            if submission_msg is None:
-                                logger.error(f'Unexpected: submission message {last_submission.id} could not be found.')
-                            else:
-                                self.bot.expected_msg_deletions.append(submission_msg.id)
-                                await submission_msg.delete()
-                                logger.info(f'Old submission deleted. {last_submission.id} (Old) -> {message.id} (New)')
-
-                            # Delete the old submission row
-                            session.delete(last_submission)
-
-                        # Add the new submission row
-                        session.add(Submission(id=message.id, user=message.author.id, period=guild.current_period,
-                                               timestamp=message.created_at))
-                        logger.info(f'New submission created ({message.id}).')
+        config = await self.bot.guild_config(message.guild.id)
+        channel: discord.TextChannel = message.channel
+        attachments = message.attachments
+
+        # Ensure that the submission contains at least one attachment
+        if len(attachments) == 0:
+            await self.bot.reject(message, f'Each submission must contain exactly one image.')
+        # Ensure the image contains no more than one attachment
+        elif len(attachments) > 1:
+            await self.bot.reject(message, f'Each submission must contain exactly one image.')
+        elif config.period_id is None:
+            await self.bot.reject(message, f'A period has not been started. Submissions should not be allowed at this moment.')
+        elif config.period_state != PeriodStates.SUBMISSIONS:
+            logger.warning(f'Valid submission was sent outside of Submissions in'
+                           f' {channel.id}/{message.id}. Permissions error? Removing.')
+            await message.delete()
+        else:
+            attachment = attachments[0]
+            # TODO: Add helper for displaying error/warning messages
+            if attachment.is_spoiler():
+                await self.bot.reject(message, 'Attachment must not make use of a spoiler.')
+            elif attachment.width is None:
+                await self.bot.reject(message, 'Attachment must be a image or video.')
+            else:
+                guild_id, period_id, author_id = config.id, config.period_id, message.author.id
+                phash = await self.bot.hash_attachment(attachment)
+
+                # Sessions are only held between awaits, never across them.
+                match, last_submission_id = await self.bot.run_read(self._find_previous, guild_id, period_id, author_id, phash)
+                if match is not None:
+                    logger.info(f'Submission {message.id} rejected as a duplicate of {match.submission.id} '
+                                f'({match.distance} bits apart).')
+                    await self.bot.reject(message, 'This image has already been submitted to a contest here.')
+                    return
+
+                if last_submission_id is not None:
+                    await self.delete_submission_message(channel, last_submission_id, message.id)
+
+                replaced = await self.bot.run_session(self._store_submission, period_id, message.id, author_id, message.created_at,
+                                                      phash)
+                # Submissions stored after the one read above, such as by a second message sent moments before this one.
+                for submission_id in replaced:
+                    if submission_id != last_submission_id:
+                        await self.delete_submission_message(channel, submission_id, message.id)
+                self.bot.duplicates.remove(guild_id, replaced)
+
+                # Only index the hash once it is stored.
+                if phash is not None:
+                    self.bot.duplicates.add(guild_id, phash, HashedSubmission(id=message.id, user=author_id, period_id=period_id))
+                logger.info(f'New submission created ({message.id}).')
+
+    def _find_previous(self, session: Session, guild_id: int, period_id: int, user: int,
+                       phash: Optional[int]) -> Tuple[Optional[Match], Optional[int]]:
+        """Finds a earlier submission the new one duplicates, if any, and the ID of the user's current submission, if any."""
+        match = self.bot.duplicates.find(session, guild_id, phash, user=user, period_id=period_id) if phash is not None else None
+        last_submission_id = session.query(Submission.id).filter_by(period_id=period_id, user=user).first()
+        return match, last_submission_id[0] if last_submission_id is not None else None
+
+    async def delete_submission_message(self, channel: discord.TextChannel, submission_id: int, replacement_id: int) -> None:
+        """Deletes the message of a submission which is being replaced by a newer one from the same user."""
+        submission_msg = await channel.fetch_message(submission_id)
+        if submission_msg is None:
+            logger.error(f'Unexpected: submission message {submission_id} could not be found.')
+        else:
+            self.bot.expected_msg_deletions.add(submission_msg.id)
+            await submission_msg.delete()
+            logger.info(f'Old submission deleted. {submission_id} (Old) -> {replacement_id} (New)')
+
+    @staticmethod
+    def _store_submission(session: Session, period_id: int, message_id: int, user: int, timestamp: datetime,
+                          phash: Optional[int]) -> List[int]:
+        """
+        Adds a new submission row, deleting every other row the user has in the period, and returning their IDs.
+
+        The user's submissions are re-read here rather than trusted from before the write was queued, so two messages sent at
+        once still leave only one of them stored.
+        """
+        replaced = session.query(Submission).filter(Submission.period_id == period_id, Submission.user == user,
+                                                    Submission.id != message_id).all()
+        for submission in replaced:
+            session.delete(submission)
+        session.add(Submission(id=message_id, user=user, period_id=period_id, timestamp=timestamp, phash=phash))
+        return [submission.id for submission in replaced]
 
     @commands.Cog.listener()
+    @metrics.timed('on_raw_message_delete')
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
         """Handles submission deletions by the users, moderators or other bots for any reason."""
         await self.bot.wait_until_ready()
 
         # Ignore messages we delete
-        if payload.message_id in self.bot.expected_msg_deletions:
-            self.bot.expected_msg_deletions.remove(payload.message_id)
+        if self.bot.expected_msg_deletions.consume(payload.message_id):
             return
 
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(payload.guild_id)
-            if payload.channel_id != guild.submission_channel: return
+        if not await self.bot.is_submission_channel(payload.guild_id, payload.channel_id): return
 
-            submission: Submission = session.query(Submission).get(payload.message_id)
-            if submission is None:
-                logger.error(f'Submission {payload.message_id} could not be deleted from database as it was not found.')
-            else:
-                author: str = payload.cached_message.author.display_name if payload.cached_message is not None else 'Unknown'
-                logger.info(f'Submission {payload.message_id} by {author} deleted by outside source.')
-                session.delete(submission)
+        # Buffered votes for the submission are dropped, and any already being written are waited out before deleting it.
+        self.bot.vote_buffer.forget([payload.message_id])
+        await self.bot.vote_buffer.flush()
+        if not await self.bot.run_session(self._delete_submission, payload.message_id):
+            logger.error(f'Submission {payload.message_id} could not be deleted from database as it was not found.')
+        else:
+            author: str = payload.cached_message.author.display_name if payload.cached_message is not None else 'Unknown'
+            logger.info(f'Submission {payload.message_id} by {author} deleted by outside source.')
+            self.bot.duplicates.remove(payload.guild_id, [payload.message_id])
+
+    @staticmethod
+    def _delete_submission(session: Session, submission_id: int) -> bool:
+        """Deletes a submission and it's votes, returning whether or not it was found."""
+        submission: Submission = session.query(Submission).get(submission_id)
+        if submission is None: return False
+        session.delete(submission)
+        return True
 
     @commands.Cog.listener()
+    @metrics.timed('on_raw_bulk_message_delete')
     async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
-        deleted: List[int] = []
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(payload.guild_id)
-            if payload.channel_id == guild.submission_channel:
-                for message_id in payload.message_ids:
-                    submission: Submission = session.query(Submission).get(message_id)
-                    if submission is not None:
-                        deleted.append(message_id)
-                        session.delete(submission)
+        """Handles purges in the submission channel, removing every affected submission and it's votes in one transaction."""
+        if not await self.bot.is_submission_channel(payload.guild_id, payload.channel_id): return
+
+        self.bot.vote_buffer.forget(payload.message_ids)
+        await self.bot.vote_buffer.flush()
+        deleted, votes = await self.bot.run_session(self._delete_submissions, payload.message_ids)
+        self.bot.duplicates.remove(payload.guild_id, [submission_id for submission_id, _ in deleted])
 
         if len(deleted) > 0:
-            logger.info(f'{len(deleted)} submissions deleted in bulk message deletion.')
-            logger.debug(f'Messages deleted: {", ".join(map(str, deleted))}')
+            logger.info(f'{len(deleted)} submissions and {votes} votes deleted in bulk deletion of {len(payload.message_ids)} messages.')
+            logger.debug(f'Messages deleted: {", ".join(str(submission_id) for submission_id, _ in deleted)}')
+
+    def _delete_submissions(self, session: Session, message_ids: Iterable[int]) -> Tuple[List[Tuple[int, int]], int]:
+        deleted, votes = Submission.delete_many(session, message_ids)
+        self.bot.leaderboards.removed(session, deleted)
+        return deleted, votes
 
     @commands.Cog.listener()
+    @metrics.timed('on_raw_reaction_add')
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent) -> None:
         # Skip reactions we add ourselves
         if payload.user_id == self.bot.user.id: return
+        if not await self.bot.is_submission_channel(payload.guild_id, payload.channel_id): return
 
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(payload.guild_id)
-            if payload.channel_id == guild.submission_channel:
-                channel: discord.TextChannel = self.bot.get_channel(payload.channel_id)
-                message: discord.PartialMessage = channel.get_partial_message(payload.message_id)
-
-                if helpers.is_upvote(payload.emoji):
-                    submission: Submission = session.query(Submission).get(payload.message_id)
-                    if submission is None:
-                        logger.warning(f'Upvote reaction added to message {payload.message_id}, but no Submission found in database.')
-                    else:
-                        period: Period = submission.period
-                        if period.active and period.state == PeriodStates.VOTING:
-                            await submission.update(self.bot, message=await message.fetch())
-                        else:
-                            logger.warning(f'User attempted to add a reaction to a Submission outside '
-                                           f'of it\'s Period activity ({period.active}/{period.state}).')
-                            await message.remove_reaction(payload.emoji, payload.member)
-                else:
-                    # Remove the emoji since it's not supposed to be there anyways.
-                    # If permissions were setup correctly, only moderators or admins should be able to trigger this.
-                    await message.remove_reaction(payload.emoji, payload.member)
+        if helpers.is_upvote(payload.emoji):
+            self.votes.submit(payload.message_id, payload)
+        else:
+            # Remove the emoji since it's not supposed to be there anyways.
+            # If permissions were setup correctly, only moderators or admins should be able to trigger this.
+            message = self.bot.get_message(payload.channel_id, payload.message_id)
+            await message.remove_reaction(payload.emoji, payload.member)
 
     @commands.Cog.listener()
+    @metrics.timed('on_raw_reaction_remove')
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent) -> None:
         """Deal with reactions we remove or removed manually by users."""
         # Skip reactions we removed ourselves.
-        try:
-            index = self.bot.expected_react_deletions.index((payload.message_id, payload.emoji.id))
-            del self.bot.expected_react_deletions[index]
+        if self.bot.expected_react_deletions.consume((payload.message_id, payload.user_id)):
             logger.debug(f'Skipping expected reaction removal {payload.message_id}.')
             return
-        except ValueError:
-            pass
-
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(payload.guild_id)
-            if payload.channel_id == guild.submission_channel and helpers.is_upvote(payload.emoji):
-                submission: Submission = session.query(Submission).get(payload.message_id)
-                if submission is None:
-                    logger.warning(f'Upvote reaction removed from message {payload.message_id}, but no Submission found in database.')
-                else:
-                    message = await self.bot.fetch_message(payload.channel_id, payload.message_id)
-                    await submission.update(self.bot, message=message)
+
+        if not helpers.is_upvote(payload.emoji) or not await self.bot.is_submission_channel(payload.guild_id, payload.channel_id): return
+        self.votes.submit(payload.message_id, payload)
+
+    @metrics.timed('handle_votes')
+    async def handle_votes(self, message_id: int, payloads: List[discord.RawReactionActionEvent]) -> None:
+        """
+        Applies a batch of upvote reactions added to or removed from a single message, in the order they happened.
+
+        Votes are applied to the period's buffered tally and written behind in batches (see bot.votes). If any of them disagree
+        with the tally, the message is re-scanned once after the whole batch.
+        """
+        channel_id = payloads[0].channel_id
+        votes = self.bot.vote_buffer.cached(message_id) or await self.bot.vote_buffer.load(message_id)
+        if votes is None:
+            await self.reject_votes(message_id, channel_id, payloads)
+            return
+
+        rescan, to_clear = False, []
+        for payload in payloads:
+            applied, cleared = votes.apply(message_id, payload.user_id, added=payload.event_type == 'REACTION_ADD')
+            rescan = rescan or not applied
+            to_clear.extend(cleared)
+        self.bot.vote_buffer.changed()
+        await self.bot.remove_vote_reactions(channel_id, to_clear)
+
+        if rescan:
+            logger.debug(f'Votes on {message_id} did not match stored votes, re-scanning the message.')
+            await self.rescan(message_id, channel_id, votes.period_id)
+
+    async def rescan(self, message_id: int, channel_id: int, period_id: int) -> None:
+        """Replaces a submission's votes with the users reacting to it's message, paging through every one of them."""
+        message = await self.bot.fetch_message(channel_id, message_id)
+        voters, saw_self = set(), False
+        for reaction in message.reactions:
+            if helpers.is_upvote(reaction.emoji):
+                async for user in reaction.users():
+                    if user.id == self.bot.user.id:
+                        saw_self = True
+                    else:
+                        voters.add(user.id)
+
+        await self.bot.vote_buffer.flush()
+        to_clear = await self.bot.run_session(self._replace_votes, message_id, voters)
+        await self.bot.vote_buffer.reset(period_id)
+        await self.bot.remove_vote_reactions(channel_id, to_clear)
+
+        # If we never saw ourselves in the reaction, add the Upvote emoji
+        if not saw_self: await message.add_reaction(self.bot.get_emoji(constants.Emoji.UPVOTE))
+
+    @staticmethod
+    def _replace_votes(session: Session, message_id: int, voters: Set[int]) -> List[ReactionMarker]:
+        submission: Submission = session.query(Submission).get(message_id)
+        if submission is None or not submission.period.voting: return []
+        return submission.replace_votes(voters, session)
+
+    async def reject_votes(self, message_id: int, channel_id: int, payloads: List[discord.RawReactionActionEvent]) -> None:
+        """Removes upvotes added to a message which is not a submission in a voting period, as they can not be counted."""
+        period = await self.bot.run_read(self._read_submission_period, message_id)
+        if period is None:
+            logger.warning(f'{len(payloads)} upvote reactions changed on message {message_id}, but no Submission found in database.')
+            return
+
+        active, state = period
+        logger.warning(f'User(s) attempted to change reactions on a Submission outside '
+                       f'of it\'s Period activity ({active}/{state}).')
+
+        added = [ReactionMarker(message=message_id, user=payload.user_id) for payload in payloads if payload.event_type == 'REACTION_ADD']
+        await self.bot.remove_vote_reactions(channel_id, added)
+
+    @staticmethod
+    def _read_submission_period(session: Session, submission_id: int) -> Optional[Tuple[bool, PeriodStates]]:
+        """The activity and state of a submission's period, or None if there is no such submission."""
+        return session.query(Period.active, Period.state).join(Submission).filter(Submission.id == submission_id).first()
 
     @commands.Cog.listener()
     async def on_raw_reaction_clear(self, payload: discord.RawReactionActionEvent) -> None:
         """Deal with all emojis being cleared for a specific message. Remove all votes for a given submission and then re-add the bot's."""
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(payload.guild_id)
-            if payload.channel_id == guild.submission_channel:
-                submission: Submission = session.query(Submission).get(payload.message_id)
-                if submission is None:
-                    logger.warning(f'Witnessed reactions removed from message {payload.message_id}, but no Submission found in database.')
-                else:
-                    if submission.period.voting:
-                        submission.votes = []
-                        message = self.bot.get_message(payload.channel_id, payload.message_id)
-                        await message.add_reaction(self.bot.get_emoji(constants.Emoji.UPVOTE))
-                    else:
-                        logger.debug(f'All reactions cleared on Submission ({submission.id}) outside of it\'s voting period.')
+        if not await self.bot.is_submission_channel(payload.guild_id, payload.channel_id): return
+        await self.clear_votes(payload.message_id, payload.channel_id, 'reactions')
 
     @commands.Cog.listener()
     async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent) -> None:
         """Deal with a specific emoji being cleared for a message. If it was the upvote, clear votes for the submission and add back the bot's"""
-        with self.bot.get_session() as session:
-            guild: Guild = session.query(Guild).get(payload.guild_id)
-            if payload.channel_id == guild.submission_channel:
-                if helpers.is_upvote(payload.emoji):
-                    submission: Submission = session.query(Submission).get(payload.message_id)
-                    if submission is None:
-                        logger.warning(f'Witnessed all upvote reactions removed from message {payload.message_id},'
-                                       f' but no Submission found in database.')
-                    else:
-                        if submission.period.voting:
-                            submission.votes = []
-                            message = self.bot.get_message(payload.channel_id, payload.message_id)
-                            await message.add_reaction(self.bot.get_emoji(constants.Emoji.UPVOTE))
-                        else:
-                            logger.debug(f'Upvote reactions cleared on Submission ({submission.id}) outside of it\'s voting period.')
+        if not helpers.is_upvote(payload.emoji) or not await self.bot.is_submission_channel(payload.guild_id, payload.channel_id): return
+        await self.clear_votes(payload.message_id, payload.channel_id, 'upvote reactions')
+
+    async def clear_votes(self, message_id: int, channel_id: int, cleared: str) -> None:
+        """Removes every vote on a submission whose upvotes were cleared, then adds back the bot's own upvote."""
+        votes = self.bot.vote_buffer.cached(message_id) or await self.bot.vote_buffer.load(message_id)
+        if votes is not None:
+            votes.clear(message_id)
+            self.bot.vote_buffer.changed()
+            message = self.bot.get_message(channel_id, message_id)
+            await message.add_reaction(self.bot.get_emoji(constants.Emoji.UPVOTE))
+            return
+
+        if await self.bot.run_read(self._read_submission_period, message_id) is None:
+            logger.warning(f'Witnessed all {cleared} removed from message {message_id}, but no Submission found in database.')
+        else:
+            logger.debug(f'All {cleared} cleared on Submission ({message_id}) outside of it\'s voting period.')
 
 
 def setup(bot) -> None:
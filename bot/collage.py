@@ -0,0 +1,185 @@
+import asyncio
+import io
+import logging
+import math
+import multiprocessing
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, TYPE_CHECKING
+
+import discord
+
+from bot import constants
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = ImageDraw = ImageFont = None
+
+if TYPE_CHECKING:
+    from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+FILENAME = 'results.jpg'
+
+# A submission shown in a collage, in the same order as a Result row.
+Entry = namedtuple('Entry', ['position', 'submission_id', 'user_id', 'count'])
+
+
+def available() -> bool:
+    """Whether or not collages can be rendered. Requires Pillow, which is optional."""
+    return Image is not None
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype('DejaVuSans-Bold.ttf', size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _tile(data: Optional[bytes], size: int):
+    """Decodes a image, scaled and cropped to fill a square tile. Unreadable or missing images become a blank tile."""
+    if data is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.draft('RGB', (size, size))  # JPEGs are decoded straight to roughly the size needed.
+                image = image.convert('RGB')
+                scale = size / min(image.size)
+                image = image.resize((max(size, round(image.width * scale)), max(size, round(image.height * scale))), Image.LANCZOS)
+                left, top = (image.width - size) // 2, (image.height - size) // 2
+                return image.crop((left, top, left + size, top + size))
+        except Exception as error:
+            logger.warning(f'Could not decode image for collage: {error}')
+    return Image.new('RGB', (size, size), (54, 57, 63))
+
+
+def render(images: Sequence[Optional[bytes]], entries: Sequence[Entry], tile: int = constants.COLLAGE_TILE,
+           columns: int = constants.COLLAGE_COLUMNS) -> bytes:
+    """
+    Composites images into a grid, each labelled with it's rank and vote count, and encodes the result as a JPEG.
+
+    Runs in a worker process, so it is kept to plain arguments and return values.
+
+    :param images: The encoded image of each entry, or None where it could not be downloaded.
+    :param entries: The entry each image belongs to, in the order they should appear.
+    :param tile: The width and height of each image in the grid, in pixels.
+    :param columns: The maximum number of images in each row.
+    """
+    columns = max(1, min(columns, len(entries)))
+    rows = math.ceil(len(entries) / columns)
+    canvas = Image.new('RGB', (columns * tile, rows * tile), (32, 34, 37))
+    font = _font(max(12, tile // 12))
+    bar = max(20, tile // 7)
+
+    for index, (data, entry) in enumerate(zip(images, entries)):
+        image = _tile(data, tile).convert('RGBA')
+        overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        draw.rectangle((0, tile - bar, tile, tile), fill=(0, 0, 0, 160))
+        label = f'#{entry.position}  {entry.count} vote{"s" if entry.count != 1 else ""}'
+        _, top, _, bottom = draw.textbbox((0, 0), label, font=font)
+        draw.text((8, tile - bar + (bar - (bottom - top)) // 2 - top), label, font=font, fill=(255, 255, 255, 255))
+        image = Image.alpha_composite(image, overlay).convert('RGB')
+        canvas.paste(image, ((index % columns) * tile, (index // columns) * tile))
+
+    output = io.BytesIO()
+    canvas.save(output, format='JPEG', quality=85, optimize=True)
+    return output.getvalue()
+
+
+class CollageRenderer(object):
+    """
+    Renders collages of a finished period's top submissions, caching the most recent ones by period.
+
+    Source images are downloaded concurrently, skipping any larger than the size cap, then decoded and composited in a
+    process pool so the work never blocks the event loop (or holds the GIL). Requests for a period already being rendered
+    wait on the same render instead of starting another.
+    """
+
+    def __init__(self, bot: 'ContestBot', executor: Optional[Executor] = None, maxsize: int = constants.COLLAGE_CACHE_SIZE,
+                 max_bytes: int = constants.COLLAGE_MAX_BYTES) -> None:
+        """
+        :param bot: The bot used to fetch the submission messages.
+        :param executor: Where collages are rendered. Defaults to a process pool, started on first use.
+        :param maxsize: The number of collages kept in memory.
+        :param max_bytes: Attachments larger than this are not downloaded, leaving a blank tile in their place.
+        """
+        self.bot = bot
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._executor = executor
+        self._cache: 'OrderedDict[int, bytes]' = OrderedDict()  # Period ID -> encoded collage, least recently used first
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            # Spawned rather than forked, as forking a process with running threads is unsafe.
+            self._executor = ProcessPoolExecutor(max_workers=constants.COLLAGE_PROCESSES,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def get(self, period_id: int, channel_id: int, entries: Sequence[Entry]) -> Optional[bytes]:
+        """
+        Returns the collage of a finished period, rendering it if it is not already cached.
+
+        :param period_id: The period, which must be finished so it's entries never change.
+        :param channel_id: The submission channel the entries were posted in.
+        :param entries: The top entries of the period, in order.
+        :return: The encoded collage, or None if there is nothing to show or Pillow is not installed.
+        """
+        if not available() or len(entries) == 0: return None
+
+        data = self._cache.get(period_id)
+        if data is not None:
+            self._cache.move_to_end(period_id)
+            return data
+
+        pending = self._pending.get(period_id)
+        if pending is None:
+            pending = self._pending[period_id] = asyncio.ensure_future(self._render(channel_id, list(entries)))
+            pending.add_done_callback(lambda _: self._pending.pop(period_id, None))
+
+        data = await asyncio.shield(pending)
+        self._cache[period_id] = data
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return data
+
+    async def _render(self, channel_id: int, entries: List[Entry]) -> bytes:
+        messages = await self.bot.fetch_messages(channel_id, [entry.submission_id for entry in entries])
+        images = await asyncio.gather(*(self.download(messages.get(entry.submission_id)) for entry in entries))
+        logger.debug(f'Downloaded {sum(image is not None for image in images)} of {len(entries)} images for a collage.')
+        return await self.bot.loop.run_in_executor(self.executor, render, images, entries)
+
+    async def download(self, message: Optional[discord.Message]) -> Optional[bytes]:
+        """Downloads the first attachment of a message, unless it is missing or larger than the size cap."""
+        if message is None or len(message.attachments) == 0: return None
+        attachment = message.attachments[0]
+        if attachment.size > self.max_bytes:
+            logger.debug(f'Skipping attachment {attachment.id} for a collage, as it is {attachment.size} bytes.')
+            return None
+        try:
+            return await attachment.read()
+        except discord.HTTPException as error:
+            logger.warning(f'Could not download attachment {attachment.id} for a collage: {error}')
+            return None
+
+    def invalidate(self, period_id: Optional[int] = None) -> None:
+        """Drops the cached collage of a single period, or of every period if no ID is given."""
+        if period_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(period_id, None)
+
+    def shutdown(self) -> None:
+        """Stops the process pool, if it was started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __len__(self) -> int:
+        return len(self._cache)
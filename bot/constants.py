@@ -9,6 +9,15 @@ BASE_DIR = os.path.dirname(os.path.abspath(os.path.join(__file__, '..')))
 TOKEN = os.path.join(BASE_DIR, 'token.dat')
 DATABASE = os.path.join(BASE_DIR, 'database.db')
 DATABASE_URI = f'sqlite:///{DATABASE}'
+MIGRATIONS = os.path.join(BASE_DIR, 'alembic')  # Alembic's script directory, checked to skip schema creation on start.
+RECORDING = os.path.join(BASE_DIR, 'events.jsonl')  # Where gateway events are recorded to when bot.replay is loaded.
+
+# Database tuning (see bot.db)
+DATABASE_THREADS = 4  # Number of threads reads can be moved onto, off the event loop.
+WRITE_QUEUE_SIZE = 1000  # Number of write operations queued for the writer before submitting more waits (see bot.writer).
+SQLITE_BUSY_TIMEOUT = 30  # Seconds a connection waits for a lock before raising 'database is locked'.
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file to memory map.
+SQLITE_CACHE_SIZE = 64 * 1024  # KiB of page cache per connection.
 
 # Discord-related constants
 GENERAL_COLOR = discord.Color(0x4a90e2)
@@ -18,6 +27,27 @@ SUCCESS_COLOR = discord.Color(0x73E560)
 # Other constants
 LOGGING_LEVEL = logging.DEBUG
 
+# Bulk Discord operations (see bot.executor)
+BULK_CONCURRENCY = 8  # Maximum number of operations running at once.
+BULK_BUCKET_CONCURRENCY = 4  # Maximum number of operations running at once against a single rate limit bucket.
+BULK_RETRIES = 3  # Number of times a transient failure is retried.
+BULK_BACKOFF = 1.0  # Seconds to wait before the first retry, doubled on each further retry.
+
+# Expected deletions (see bot.cache.ExpiringSet)
+EXPECTED_DELETION_TTL = 60  # Seconds to wait for the event of a message or reaction the bot deleted itself.
+EXPECTED_DELETION_MAXSIZE = 10000  # Maximum number of expected deletions remembered at once.
+
+# Reaction event coalescing (see bot.coalesce)
+COALESCE_WINDOW = 0.5  # Seconds to gather further reaction events for a message before handling them together.
+COALESCE_WORKERS = 4  # Maximum number of messages having their reaction events handled at once.
+
+# Vote buffering (see bot.votes)
+VOTE_FLUSH_INTERVAL = 0.25  # Seconds after a vote changes before it's written, along with every other change since.
+VOTE_FLUSH_CHANGES = 200  # Number of pending vote changes which are written straight away.
+
+# Reconciliation (see bot.reconcile)
+RECONCILE_CONCURRENCY = 4  # Maximum number of guilds reconciled at once.
+
 
 # Emote references
 class Emoji(object):
@@ -28,3 +58,23 @@ class Emoji(object):
 
 # Named Tuples
 ReactionMarker = namedtuple("ReactionMarker", ["message", "user", "emoji"], defaults=[Emoji.UPVOTE])
+
+# Duplicate submissions (see bot.duplicates)
+DUPLICATE_DISTANCE = 6  # Maximum number of bits two 64-bit image hashes may differ by to be considered the same image.
+IMAGE_THREADS = 2  # Number of threads images are hashed on.
+
+# Results collages (see bot.collage)
+COLLAGE_SIZE = 6  # Number of top submissions shown.
+COLLAGE_COLUMNS = 3
+COLLAGE_TILE = 320  # Width and height of each submission, in pixels.
+COLLAGE_MAX_BYTES = 8 * 1024 * 1024  # Attachments larger than this are left out rather than downloaded.
+COLLAGE_PROCESSES = 2  # Number of processes collages are rendered in.
+COLLAGE_CACHE_SIZE = 32  # Number of rendered collages kept in memory.
+
+# Exports (see bot.export)
+EXPORT_BATCH_SIZE = 1000  # Rows fetched from the database, and written, at a time.
+EXPORT_UPLOAD_LIMIT = 8 * 1024 * 1024  # Largest export archive that can be uploaded to Discord, in bytes.
+
+# Metrics (see bot.metrics)
+METRICS_HOST = '127.0.0.1'  # Only reachable locally; scrape through a local Prometheus or agent.
+METRICS_PORT = 9464  # Port the Prometheus endpoint listens on. Set to None to disable it.
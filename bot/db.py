@@ -0,0 +1,170 @@
+import logging
+from urllib.parse import quote
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from bot import constants
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+# Applied to every new SQLite connection to a database file.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers no longer block the writer (or each other).
+    'synchronous': 'NORMAL',  # Safe with WAL; only the checkpoint fsyncs instead of every commit.
+    'mmap_size': constants.SQLITE_MMAP_SIZE,
+    'cache_size': -constants.SQLITE_CACHE_SIZE,  # Negative values are in KiB rather than pages.
+    'temp_store': 'MEMORY',
+}
+
+# Applied to every read-only connection instead. The journal mode can only be changed by a connection which can write.
+SQLITE_READ_PRAGMAS = {
+    'mmap_size': constants.SQLITE_MMAP_SIZE,
+    'cache_size': -constants.SQLITE_CACHE_SIZE,
+    'temp_store': 'MEMORY',
+    'query_only': 1,
+}
+
+
+def is_memory_url(url) -> bool:
+    """Whether or not the SQLite URL given refers to a in-memory database."""
+    return url.database in (None, '', ':memory:') or 'mode=memory' in str(url)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record, pragmas=None) -> None:
+    """Engine `connect` listener applying the tuning pragmas to each new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in (pragmas or SQLITE_PRAGMAS).items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+    finally:
+        cursor.close()
+
+
+def set_sqlite_read_pragmas(dbapi_connection, connection_record) -> None:
+    """Engine `connect` listener applying the tuning pragmas to each new read-only SQLite connection."""
+    set_sqlite_pragmas(dbapi_connection, connection_record, SQLITE_READ_PRAGMAS)
+
+
+def disable_pysqlite_transactions(dbapi_connection, connection_record) -> None:
+    """Engine `connect` listener stopping pysqlite from emitting it's own deferred BEGIN, so `begin_immediate` can replace it."""
+    dbapi_connection.isolation_level = None
+
+
+def begin_immediate(conn) -> None:
+    """
+    Engine `begin` listener starting every transaction with BEGIN IMMEDIATE, taking the write lock up front.
+
+    A deferred transaction which reads before writing fails straight away with "database is locked" if another process takes
+    the write lock in between, as waiting could deadlock. Taking the lock when the transaction begins lets it wait out the busy
+    timeout instead, which is needed once several processes write to the same file.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+
+
+def create_engine(url: str = constants.DATABASE_URI, immediate: bool = False, **kwargs) -> Engine:
+    """
+    Creates a SQLAlchemy engine, tuned for the bot when backed by a SQLite database file.
+
+    File databases use WAL journaling with relaxed syncing, memory mapped I/O and a larger page cache, along with a connection
+    pool shared between the event loop and the database threads. In-memory databases share a single connection between every
+    thread instead, as each new connection to them would be a separate, empty database.
+
+    :param url: The database URL.
+    :param immediate: Begin every transaction on a SQLite database file with BEGIN IMMEDIATE, for processes sharing the file.
+    :param kwargs: Any further arguments for `sqlalchemy.create_engine`, overriding the defaults chosen here.
+    """
+    parsed = make_url(url)
+    sqlite = parsed.get_backend_name() == 'sqlite'
+
+    if sqlite:
+        connect_args = kwargs.setdefault('connect_args', {})
+        connect_args.setdefault('check_same_thread', False)  # Connections are handed between threads by the pool.
+        if is_memory_url(parsed):
+            kwargs.setdefault('poolclass', StaticPool)
+        else:
+            connect_args.setdefault('timeout', constants.SQLITE_BUSY_TIMEOUT)
+            kwargs.setdefault('poolclass', QueuePool)
+            kwargs.setdefault('pool_size', constants.DATABASE_THREADS + 1)  # One for each database thread and the event loop.
+            kwargs.setdefault('max_overflow', constants.DATABASE_THREADS)
+
+    engine = sqlalchemy.create_engine(url, **kwargs)
+    if sqlite and not is_memory_url(parsed):
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+        if immediate:
+            event.listen(engine, 'connect', disable_pysqlite_transactions)
+            event.listen(engine, 'begin', begin_immediate)
+    return engine
+
+
+def create_read_engine(url: str = constants.DATABASE_URI, **kwargs) -> Engine:
+    """
+    Creates a engine for reading only, with it's own pool of read-only connections to a SQLite database file.
+
+    With WAL journaling, readers never wait on the writer, so reads are kept off the write connection entirely (see
+    bot.writer). In-memory databases cannot be opened twice, so they should be read through the engine they were created with.
+
+    :param url: The database URL.
+    :param kwargs: Any further arguments for `sqlalchemy.create_engine`, overriding the defaults chosen here.
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite': return sqlalchemy.create_engine(url, **kwargs)
+    if is_memory_url(parsed): raise ValueError('In-memory databases can not be opened by a separate read-only engine.')
+
+    connect_args = kwargs.setdefault('connect_args', {})
+    connect_args.setdefault('check_same_thread', False)
+    connect_args.setdefault('timeout', constants.SQLITE_BUSY_TIMEOUT)
+    kwargs.setdefault('poolclass', QueuePool)
+    kwargs.setdefault('pool_size', constants.DATABASE_THREADS + 1)
+    kwargs.setdefault('max_overflow', constants.DATABASE_THREADS)
+
+    engine = sqlalchemy.create_engine(f'sqlite:///file:{quote(parsed.database)}?mode=ro&uri=true', **kwargs)
+    event.listen(engine, 'connect', set_sqlite_read_pragmas)
+    return engine
+
+
+def migration_scripts(directory: str = constants.MIGRATIONS):
+    """Alembic's script directory, or None if Alembic or it's scripts are unavailable."""
+    try:
+        from alembic.script import ScriptDirectory
+        return ScriptDirectory(directory)
+    except Exception as error:
+        logger.debug(f'Could not read the migration scripts: {error}')
+        return None
+
+
+def ensure_schema(engine: Engine, directory: str = constants.MIGRATIONS) -> bool:
+    """
+    Creates any missing tables, unless Alembic reports the database is already migrated to it's head revision.
+
+    A empty database is stamped with the head revision once created, so later starts can skip creation entirely. Databases
+    with tables but no recorded revision are left unstamped, as their revision cannot be known.
+
+    :param engine: The engine to check and create tables with.
+    :param directory: Alembic's script directory.
+    :return: Whether or not the tables were created.
+    """
+    from bot.models import Base
+
+    scripts = migration_scripts(directory)
+    with engine.begin() as connection:
+        if scripts is None:
+            Base.metadata.create_all(connection)
+            return True
+
+        from alembic.runtime.migration import MigrationContext
+        context = MigrationContext.configure(connection)
+        heads = set(scripts.get_heads())
+        if len(heads) > 0 and set(context.get_current_heads()) == heads:
+            logger.debug(f'Database is at head revision {", ".join(sorted(heads))}, skipping schema creation.')
+            return False
+
+        empty = len(sqlalchemy.inspect(connection).get_table_names()) == 0
+        Base.metadata.create_all(connection)
+        if empty and len(heads) > 0:
+            context.stamp(scripts, 'heads')
+    return True
@@ -0,0 +1,206 @@
+import io
+import logging
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Set, TYPE_CHECKING, Tuple
+
+from bot import constants
+from bot.models import Period, Submission
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+HASH_SIZE = 8  # The hash is HASH_SIZE * HASH_SIZE bits.
+
+# A hashed submission, as held by a `DuplicateIndex`.
+HashedSubmission = namedtuple('HashedSubmission', ['id', 'user', 'period_id'])
+# A submission found to be near a hash, and the number of bits their hashes differ by.
+Match = namedtuple('Match', ['distance', 'submission'])
+
+
+def available() -> bool:
+    """Whether or not images can be hashed. Requires Pillow, which is optional."""
+    return Image is not None
+
+
+def dhash(data: bytes, size: int = HASH_SIZE) -> Optional[int]:
+    """
+    Computes the difference hash of a image: it is shrunk to (size + 1) x size greyscale pixels, and each bit records whether
+    a pixel is brighter than it's right-hand neighbour. Resizing, recompression and small edits change only a few bits.
+
+    :param data: The encoded image.
+    :param size: The width and height of the hash, in bits.
+    :return: The hash, or None if Pillow is unavailable or the image could not be read.
+    """
+    if Image is None: return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('L', (size * 8, size * 8))  # JPEGs are decoded straight to a fraction of their size.
+            pixels = image.convert('L').resize((size + 1, size), Image.BILINEAR).tobytes()
+    except Exception as error:
+        logger.warning(f'Could not hash image: {error}')
+        return None
+
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            offset = row * (size + 1) + column
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """The number of bits two hashes differ by."""
+    return bin(a ^ b).count('1')
+
+
+class HashIndex(object):
+    """
+    A multi-index hash table, answering "which hashes are within N bits of this one" without comparing against each.
+
+    Hashes are split into N + 1 chunks, each with a table of the hashes holding that exact chunk. Two hashes differing by N
+    bits or fewer must share at least one chunk, so only the hashes found in the tables are compared. A BK-tree would visit
+    most of itself here, as the distances between 64-bit hashes crowd around 32.
+    """
+
+    def __init__(self, radius: int = constants.DUPLICATE_DISTANCE, bits: int = HASH_SIZE * HASH_SIZE) -> None:
+        self.radius = radius
+        chunks = radius + 1
+        bounds = [bits * index // chunks for index in range(chunks + 1)]
+        self._chunks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]  # Shift & mask pairs
+        self._tables: List[Dict[int, List[Tuple[int, object]]]] = [{} for _ in self._chunks]
+        self._size = 0
+
+    def add(self, value: int, item) -> None:
+        """Adds a item under a hash."""
+        entry = (value, item)
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            table.setdefault((value >> shift) & mask, []).append(entry)
+        self._size += 1
+
+    def search(self, value: int, radius: Optional[int] = None) -> List[Tuple[int, object]]:
+        """
+        Returns every item whose hash is within the given number of bits, as (distance, item) pairs, nearest first.
+
+        :param value: The hash to search near.
+        :param radius: The maximum distance. It may not be larger than the radius the index was built for, which is the default.
+        """
+        radius = self.radius if radius is None else radius
+        if radius > self.radius: raise ValueError(f'Cannot search {radius} bits away in a index built for {self.radius}.')
+
+        found, seen = [], set()
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            for entry in table.get((value >> shift) & mask, ()):
+                if id(entry) in seen: continue
+                seen.add(id(entry))
+                distance = hamming(value, entry[0])
+                if distance <= radius: found.append((distance, entry[1]))
+
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class DuplicateIndex(object):
+    """
+    Holds a `HashIndex` of every hashed submission for each guild that has been asked about, across all of it's periods.
+
+    Indexes are loaded from the database on first use and kept up to date with `add` and `remove` afterwards. Removed
+    submissions are remembered and skipped rather than taken out of the index.
+
+    Indexes are loaded and searched on database threads while the event loop changes them, so every access holds a lock. The
+    database is read without it, and hashes added while a guild's index loads are applied once it has been read.
+    """
+
+    def __init__(self, radius: int = constants.DUPLICATE_DISTANCE) -> None:
+        self.radius = radius
+        self._lock = threading.Lock()
+        self._indexes: Dict[int, HashIndex] = {}
+        self._removed: Dict[int, Set[int]] = {}  # Guild ID -> Submission IDs
+        self._loading: Dict[int, List[Tuple[int, HashedSubmission]]] = {}  # Guild ID -> hashes added while it's index loads
+
+    def get(self, session: 'Session', guild_id: int) -> HashIndex:
+        """Returns the guild's index, loading it from the database if it is not already cached."""
+        with self._lock:
+            index = self._indexes.get(guild_id)
+            if index is not None: return index
+            self._loading.setdefault(guild_id, [])
+            self._removed.setdefault(guild_id, set())
+
+        index = HashIndex(self.radius)
+        rows = session.query(Submission.phash, Submission.id, Submission.user, Submission.period_id) \
+            .join(Period) \
+            .filter(Period.guild_id == guild_id, Submission.phash.isnot(None)).all()
+        for value, submission_id, user, period_id in rows:
+            index.add(value, HashedSubmission(id=submission_id, user=user, period_id=period_id))
+
+        with self._lock:
+            # Another thread may have finished loading it first.
+            if guild_id in self._indexes: return self._indexes[guild_id]
+            for value, submission in self._loading.pop(guild_id, ()):
+                index.add(value, submission)
+            self._indexes[guild_id] = index
+            self._removed.setdefault(guild_id, set())
+        logger.debug(f'Loaded {len(index)} submission hashes for guild {guild_id}.')
+        return index
+
+    def find(self, session: 'Session', guild_id: int, value: int, user: Optional[int] = None,
+             period_id: Optional[int] = None) -> Optional[Match]:
+        """
+        Finds the submission nearest to a hash within the guild, if any are close enough to be a duplicate.
+
+        :param session: A SQLAlchemy session to load the guild's hashes with, if needed.
+        :param guild_id: The guild to search.
+        :param value: The hash of the new submission.
+        :param user: The user submitting. Together with the period, their own submission (which is about to be replaced) is ignored.
+        :param period_id: The period being submitted to.
+        """
+        index = self.get(session, guild_id)
+        with self._lock:
+            removed = self._removed.get(guild_id, ())
+            for distance, item in index.search(value):
+                if item.id in removed or (item.user == user and item.period_id == period_id): continue
+                return Match(distance=distance, submission=item)
+        return None
+
+    def add(self, guild_id: int, value: int, submission: HashedSubmission) -> None:
+        """Adds a committed submission's hash, if the guild's index is cached or being loaded."""
+        with self._lock:
+            index = self._indexes.get(guild_id)
+            if index is not None:
+                index.add(value, submission)
+            elif guild_id in self._loading:
+                self._loading[guild_id].append((value, submission))
+            else:
+                return
+            self._removed[guild_id].discard(submission.id)
+
+    def remove(self, guild_id: int, submission_ids: Iterable[int]) -> None:
+        """Marks submissions as removed, if the guild's index is cached or being loaded."""
+        with self._lock:
+            if guild_id in self._removed: self._removed[guild_id].update(submission_ids)
+
+    def invalidate(self, guild_id: Optional[int] = None) -> None:
+        """Drops the cached index of a single guild, or of every guild if no ID is given."""
+        with self._lock:
+            if guild_id is None:
+                self._indexes.clear()
+                self._removed.clear()
+                self._loading.clear()
+            else:
+                self._indexes.pop(guild_id, None)
+                self._removed.pop(guild_id, None)
+                self._loading.pop(guild_id, None)
+
+    def __len__(self) -> int:
+        return sum(map(len, self._indexes.values()))
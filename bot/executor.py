@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from collections import defaultdict, namedtuple
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+import aiohttp
+import discord
+
+from bot import constants
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+BulkResult = namedtuple('BulkResult', ['completed', 'skipped', 'failed'])
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether or not a error raised by a Discord operation is worth retrying."""
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+
+class BulkExecutor(object):
+    """
+    Runs a operation over many items concurrently, such as adding reactions to every submission in a channel.
+
+    Concurrency is bounded globally and per bucket. Items which share a Discord rate limit bucket (usually the channel) should
+    share a bucket key so that they do not pile up behind discord.py's per-route lock. Transient failures are retried with
+    exponential backoff, while any other failure is logged and counted.
+    """
+
+    def __init__(self, concurrency: int = constants.BULK_CONCURRENCY, bucket_concurrency: int = constants.BULK_BUCKET_CONCURRENCY,
+                 retries: int = constants.BULK_RETRIES, backoff: float = constants.BULK_BACKOFF) -> None:
+        self.concurrency = concurrency
+        self.bucket_concurrency = bucket_concurrency
+        self.retries = retries
+        self.backoff = backoff
+
+    async def run(self, items: Iterable[Any], operation: Callable[[Any], Awaitable[bool]],
+                  bucket: Optional[Callable[[Any], Hashable]] = None,
+                  progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> BulkResult:
+        """
+        Runs the operation once for every item.
+
+        :param items: The items to operate on.
+        :param operation: A coroutine function run for each item. It should return False if the item was skipped.
+        :param bucket: A function returning the rate limit bucket key of a item. All items share one bucket if not given.
+        :param progress: A coroutine function called with the number of finished items and the total after each item.
+        :return: The number of items completed, skipped and failed.
+        """
+        items: List[Any] = list(items)
+        total = len(items)
+        limit = asyncio.Semaphore(self.concurrency)
+        buckets: Dict[Hashable, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(self.bucket_concurrency))
+        counts = {'completed': 0, 'skipped': 0, 'failed': 0}
+
+        async def worker(item: Any) -> None:
+            key = bucket(item) if bucket is not None else None
+            async with buckets[key], limit:
+                try:
+                    done = await self._attempt(operation, item)
+                    counts['completed' if done else 'skipped'] += 1
+                except Exception as error:
+                    counts['failed'] += 1
+                    logger.error(f'Bulk operation {operation.__name__} failed for {item!r}.', exc_info=error)
+
+            if progress is not None:
+                await progress(sum(counts.values()), total)
+
+        await asyncio.gather(*(worker(item) for item in items))
+        return BulkResult(**counts)
+
+    async def _attempt(self, operation: Callable[[Any], Awaitable[bool]], item: Any) -> bool:
+        """Runs the operation for a single item, retrying transient failures."""
+        attempt = 0
+        while True:
+            try:
+                return await operation(item) is not False
+            except Exception as error:
+                if attempt >= self.retries or not is_transient(error): raise
+                delay = self.backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(f'Transient failure in {operation.__name__} for {item!r}, retrying in {delay:.2f}s ({attempt}/{self.retries}).')
+                await asyncio.sleep(delay)
@@ -0,0 +1,208 @@
+"""
+Exports guilds, periods, submissions and votes to CSV, JSONL or Parquet files, one per table.
+
+Rows are streamed from the database in batches as plain tuples, never loaded as ORM objects, so memory use stays constant
+however large the export. Parquet requires pyarrow, which is optional.
+
+    python -m bot.export --format parquet --guild 123 --since 2021-01-01 --output export/
+"""
+import argparse
+import csv
+import datetime
+import enum
+import importlib.util
+import json
+import logging
+import os
+import zipfile
+from typing import Any, Dict, List, Optional, Sequence, TYPE_CHECKING
+
+from sqlalchemy import Boolean, Column, DateTime, Enum, Integer
+from sqlalchemy.orm import Session
+
+from bot import constants
+from bot.models import Guild, Hash64, Period, Submission, Vote
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Query
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+TABLES = [Guild, Period, Submission, Vote]
+
+
+def convert(value: Any) -> Any:
+    """Converts a column's value to one that can be written as text: enums by name, and times in ISO 8601."""
+    if isinstance(value, enum.Enum): return value.name
+    if isinstance(value, datetime.datetime): return value.isoformat()
+    return value
+
+
+class CsvWriter(object):
+    extension = 'csv'
+
+    def __init__(self, path: str, columns: Sequence[Column]) -> None:
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([column.name for column in columns])
+
+    def write(self, rows: List[tuple]) -> None:
+        self._writer.writerows([convert(value) for value in row] for row in rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JsonlWriter(object):
+    extension = 'jsonl'
+
+    def __init__(self, path: str, columns: Sequence[Column]) -> None:
+        self._file = open(path, 'w', encoding='utf-8')
+        self._names = [column.name for column in columns]
+
+    def write(self, rows: List[tuple]) -> None:
+        self._file.writelines(json.dumps({name: convert(value) for name, value in zip(self._names, row)}) + '\n' for row in rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter(object):
+    """Writes each batch as a row group, with column types taken from the table rather than guessed from the values."""
+    extension = 'parquet'
+
+    def __init__(self, path: str, columns: Sequence[Column]) -> None:
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([(column.name, self.arrow_type(column)) for column in columns])
+        self._columns = [(index, isinstance(column.type, Enum)) for index, column in enumerate(columns)]
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def arrow_type(self, column: Column):
+        pyarrow = self._pyarrow
+        if isinstance(column.type, Hash64): return pyarrow.uint64()
+        if isinstance(column.type, Boolean): return pyarrow.bool_()
+        if isinstance(column.type, Integer): return pyarrow.int64()
+        if isinstance(column.type, DateTime): return pyarrow.timestamp('us')
+        return pyarrow.string()
+
+    def write(self, rows: List[tuple]) -> None:
+        arrays = [[row[index].name if enumerated and row[index] is not None else row[index] for row in rows]
+                  for index, enumerated in self._columns]
+        self._writer.write_table(self._pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {writer.extension: writer for writer in (CsvWriter, JsonlWriter, ParquetWriter)}
+
+
+def formats() -> List[str]:
+    """The formats which can be exported to. Parquet is only included if pyarrow is installed."""
+    if importlib.util.find_spec('pyarrow') is not None: return list(WRITERS)
+    return [extension for extension in WRITERS if extension != 'parquet']
+
+
+def query(session: Session, model, guild_id: Optional[int] = None, since: Optional[datetime.datetime] = None,
+          until: Optional[datetime.datetime] = None) -> 'Query':
+    """
+    Selects the columns of every row of a table within the guild and date range given, as tuples.
+
+    Periods are filtered by when they started, and submissions and votes by the period they belong to.
+    """
+    result = session.query(*model.__table__.columns)
+    if model is Guild:
+        if guild_id is not None: result = result.filter(Guild.id == guild_id)
+        return result.order_by(Guild.id)
+
+    if model is Submission: result = result.join(Period, Submission.period_id == Period.id)
+    elif model is Vote: result = result.join(Period, Vote.period_id == Period.id)
+    if guild_id is not None: result = result.filter(Period.guild_id == guild_id)
+    if since is not None: result = result.filter(Period.start_time >= since)
+    if until is not None: result = result.filter(Period.start_time < until)
+    return result.order_by(model.id)
+
+
+def export(session: Session, directory: str, file_format: str = 'csv', guild_id: Optional[int] = None,
+           since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+           batch: int = constants.EXPORT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Writes every table to a file in the directory given, named after the table.
+
+    :param session: A SQLAlchemy session to stream rows with. Nothing is loaded into it's identity map.
+    :param directory: Where the files are written. It is created if it does not exist.
+    :param file_format: One of `csv`, `jsonl` or `parquet`.
+    :param guild_id: Only export this guild.
+    :param since: Only export periods started at or after this time, along with their submissions and votes.
+    :param until: Only export periods started before this time, along with their submissions and votes.
+    :param batch: The number of rows fetched from the database, and written, at a time.
+    :return: The number of rows written for each table.
+    """
+    if file_format not in WRITERS: raise ValueError(f'Unknown export format {file_format!r}.')
+    os.makedirs(directory, exist_ok=True)
+
+    counts = {}
+    for model in TABLES:
+        table = model.__table__
+        writer = WRITERS[file_format](os.path.join(directory, f'{table.name}.{file_format}'), list(table.columns))
+        count, rows = 0, []
+        try:
+            for row in query(session, model, guild_id, since, until).yield_per(batch):
+                rows.append(tuple(row))
+                if len(rows) >= batch:
+                    writer.write(rows)
+                    count, rows = count + len(rows), []
+            if len(rows) > 0 or count == 0:
+                writer.write(rows)
+                count += len(rows)
+        finally:
+            writer.close()
+        counts[table.name] = count
+
+    logger.info(f'Exported {", ".join(f"{count} {name}" for name, count in counts.items())} rows to {directory} as {file_format}.')
+    return counts
+
+
+def archive(directory: str, filename: str = 'export.zip') -> str:
+    """Compresses every file in a directory into a zip archive placed inside it, returning the archive's path."""
+    path = os.path.join(directory, filename)
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as file:
+        for name in sorted(os.listdir(directory)):
+            if name != filename: file.write(os.path.join(directory, name), arcname=name)
+    return path
+
+
+def parse_date(value: str) -> datetime.datetime:
+    """Parses a date given as YYYY-MM-DD."""
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports guilds, periods, submissions and votes, one file per table.')
+    parser.add_argument('--format', choices=formats(), default='csv', help='The file format to write.')
+    parser.add_argument('--output', default='export', help='The directory to write the files to.')
+    parser.add_argument('--guild', type=int, default=None, help='Only export this guild.')
+    parser.add_argument('--since', type=parse_date, default=None, help='Only export periods started on or after this date (YYYY-MM-DD).')
+    parser.add_argument('--until', type=parse_date, default=None, help='Only export periods started before this date (YYYY-MM-DD).')
+    parser.add_argument('--database', default=constants.DATABASE_URI, help='The database to export from.')
+    parser.add_argument('--batch', type=int, default=constants.EXPORT_BATCH_SIZE, help='The number of rows handled at a time.')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] [%(funcName)s] %(message)s')
+
+    from bot.db import create_read_engine
+
+    engine = create_read_engine(arguments.database)
+    session = Session(bind=engine)
+    try:
+        written = export(session, arguments.output, arguments.format, guild_id=arguments.guild, since=arguments.since,
+                         until=arguments.until, batch=arguments.batch)
+    finally:
+        session.close()
+        engine.dispose()
+    for name, count in written.items():
+        print(f'{name}: {count} rows')
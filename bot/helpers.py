@@ -1,5 +1,7 @@
+import asyncio
 import datetime
-from typing import Any, Generator, List, Union
+import time
+from typing import Any, Awaitable, Callable, Generator, List, Union
 
 import discord
 
@@ -33,6 +35,19 @@ def success_embed(*args, **kwargs):
     return general_embed(*args, **kwargs)
 
 
+def format_duration(seconds: float) -> str:
+    """Formats a number of seconds as a short human readable duration, such as '1h 30m'."""
+    seconds = int(round(seconds))
+    parts = []
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            parts.append(f'{seconds // size}{unit}')
+            seconds %= size
+    if seconds or not parts:
+        parts.append(f'{seconds}s')
+    return ' '.join(parts)
+
+
 def ending_iterator(items: List[Any]) -> Generator[Any, None, None]:
     """A generator which iterates along the list until it reaches the end, where it continuously yields the final item forever."""
     index = 0
@@ -44,3 +59,24 @@ def ending_iterator(items: List[Any]) -> Generator[Any, None, None]:
         else:
             yield items[index]
             index += 1
+
+
+def progress_reporter(destination: discord.abc.Messageable, title: str,
+                      interval: float = 2.0) -> Callable[[int, int], Awaitable[None]]:
+    """Creates a progress callback which reports through a single message, edited at most once per interval and on completion."""
+    lock = asyncio.Lock()
+    state = {'message': None, 'last': 0.0}
+
+    async def report(done: int, total: int) -> None:
+        now = time.monotonic()
+        if done < total and now - state['last'] < interval: return
+        state['last'] = now
+
+        embed = general_embed(title=title, message=f'{done}/{total} ({done / total:.0%})')
+        async with lock:
+            if state['message'] is None:
+                state['message'] = await destination.send(embed=embed)
+            else:
+                await state['message'].edit(embed=embed)
+
+    return report
@@ -0,0 +1,273 @@
+import asyncio
+import bisect
+import logging
+from collections import namedtuple
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, TYPE_CHECKING, Tuple
+
+from sqlalchemy import event
+
+from bot import constants
+from bot.models import Result, Submission
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+RankedEntry = namedtuple('RankedEntry', ['position', 'emote', 'submission', 'user', 'count'])
+
+EMOTES = [':trophy:', ':second_place:', ':third_place:']
+
+
+def jump_url(guild_id: int, channel_id: int, message_id: int) -> str:
+    """Builds the link to a message without needing the channel to be cached."""
+    return f'https://discord.com/channels/{guild_id}/{channel_id}/{message_id}'
+
+
+class Leaderboard(object):
+    """
+    The ranked submissions of a single period.
+
+    Submissions are kept sorted by vote count (then age), so a vote change only moves a single entry. Tie-aware positions and
+    rendered pages are computed on first use and kept until the next change.
+    """
+
+    def __init__(self, period_id: int, entries: Iterable[Tuple[int, int, int]] = ()) -> None:
+        """
+        :param period_id: The period these submissions belong to.
+        :param entries: Tuples of Submission ID, User ID and vote count.
+        """
+        self.period_id = period_id
+        self._users: Dict[int, int] = {}
+        self._counts: Dict[int, int] = {}
+        self._order: List[Tuple[int, int]] = []  # Sort keys of (-count, submission ID)
+        self._ranks: Optional[List[RankedEntry]] = None
+        self._pages: Dict[Tuple, str] = {}
+        self.final = False  # Whether these are the recorded results of a finished period, which never change.
+
+        for submission_id, user_id, count in entries:
+            self._users[submission_id] = user_id
+            self._counts[submission_id] = count or 0
+        self._order = sorted((-count, submission_id) for submission_id, count in self._counts.items())
+
+    @classmethod
+    def from_results(cls, period_id: int, results: Iterable[Tuple[int, int, int, int]]) -> 'Leaderboard':
+        """
+        Creates a final leaderboard from the recorded standings of a finished period, without re-ranking them.
+
+        :param period_id: The finished period.
+        :param results: Tuples of position, Submission ID, User ID and vote count, in order.
+        """
+        board = cls(period_id)
+        board._ranks = []
+        for position, submission_id, user_id, count in results:
+            board._users[submission_id] = user_id
+            board._counts[submission_id] = count
+            board._order.append((-count, submission_id))
+            emote = EMOTES[position - 1] if position <= len(EMOTES) else ''
+            board._ranks.append(RankedEntry(position, emote, submission_id, user_id, count))
+        board.final = True
+        return board
+
+    def update(self, submission_id: int, user_id: int, count: int) -> None:
+        """Adds a submission, or moves it to it's new position after a vote change."""
+        if self.final: return
+        count = count or 0
+        if self._counts.get(submission_id) == count and submission_id in self._users: return
+
+        if submission_id in self._counts:
+            del self._order[bisect.bisect_left(self._order, (-self._counts[submission_id], submission_id))]
+        self._users[submission_id] = user_id
+        self._counts[submission_id] = count
+        bisect.insort(self._order, (-count, submission_id))
+        self._changed()
+
+    def remove(self, submission_id: int) -> None:
+        """Removes a submission from the leaderboard."""
+        if self.final or submission_id not in self._counts: return
+        del self._order[bisect.bisect_left(self._order, (-self._counts.pop(submission_id), submission_id))]
+        del self._users[submission_id]
+        self._changed()
+
+    def _changed(self) -> None:
+        self._ranks = None
+        self._pages.clear()
+
+    @property
+    def ranks(self) -> List[RankedEntry]:
+        """Every submission with it's position, which only advances when the vote count changes so that ties share a place."""
+        if self._ranks is None:
+            ranks, position, previous = [], 0, None
+            for negative_count, submission_id in self._order:
+                if negative_count != previous:
+                    position += 1
+                    previous = negative_count
+                emote = EMOTES[position - 1] if position <= len(EMOTES) else ''
+                ranks.append(RankedEntry(position, emote, submission_id, self._users[submission_id], -negative_count))
+            self._ranks = ranks
+        return self._ranks
+
+    def page(self, page: int = 0, count: int = 10) -> List[RankedEntry]:
+        """Returns a single page of ranked submissions."""
+        return self.ranks[page * count:(page + 1) * count]
+
+    def render(self, guild_id: int, channel_id: int, page: int = 0, count: int = 10) -> str:
+        """Renders a single page as the description of a leaderboard embed."""
+        key = (guild_id, channel_id, page, count)
+        if key not in self._pages:
+            self._pages[key] = ''.join(
+                    f'`{str(entry.position).zfill(2)}` {entry.emote + " " if entry.emote else ""}<@{entry.user}> with {entry.count} '
+                    f'vote{"s" if entry.count != 1 else ""} [Jump]({jump_url(guild_id, channel_id, entry.submission)})\n'
+                    for entry in self.page(page, count)
+            )
+        return self._pages[key]
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class LeaderboardCache(object):
+    """
+    Keeps a `Leaderboard` in memory for each period that has been asked for.
+
+    Once attached to a sessionmaker with `track`, every committed change to a Submission's vote count is applied to the
+    cached leaderboard of it's period, so the cache never has to be rebuilt from the database. Finished periods are served
+    from their recorded results instead, replacing the live leaderboard once the results are committed.
+
+    Leaderboards are only ever read and changed on the event loop. Changes committed on another thread, such as the
+    database writer's, are handed to the loop given and applied there, before the commit's caller is resumed.
+    """
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """
+        :param loop: The event loop leaderboards are used on. Changes are applied on whichever thread commits them if not given.
+        """
+        self.loop = loop
+        self._boards: Dict[int, Leaderboard] = {}
+        # Period ID -> the changes committed to it during each read of it's leaderboard still in progress. None marks results.
+        self._loading: Dict[int, List[List[Optional[Tuple[int, Optional[int], int, bool]]]]] = {}
+
+    def get(self, session: 'Session', period_id: int) -> Leaderboard:
+        """Returns the leaderboard of a period, loading it from the period's results or submissions if it is not already cached."""
+        board = self._boards.get(period_id)
+        if board is None:
+            board = self._boards[period_id] = self.read(session, period_id)
+        return board
+
+    async def load(self, period_id: int, run_read: Callable[..., Awaitable[Leaderboard]]) -> Leaderboard:
+        """
+        Returns the leaderboard of a period like `get`, but reads it with `run_read` (such as `ContestBot.run_read`) if it is not
+        already cached, so the event loop is never blocked. Changes committed while it is being read are applied once it arrives.
+        """
+        while period_id not in self._boards:
+            pending = []
+            self._loading.setdefault(period_id, []).append(pending)
+            try:
+                board = await run_read(self.read, period_id)
+            finally:
+                self._loading[period_id] = [changes for changes in self._loading[period_id] if changes is not pending]
+                if len(self._loading[period_id]) == 0: del self._loading[period_id]
+
+            # Read again if the period's results were recorded meanwhile, or keep any leaderboard cached meanwhile instead.
+            if period_id in self._boards or None in pending: continue
+            for submission_id, user_id, count, deleted in pending:
+                if deleted:
+                    board.remove(submission_id)
+                else:
+                    board.update(submission_id, user_id, count)
+            self._boards[period_id] = board
+        return self._boards[period_id]
+
+    @staticmethod
+    def read(session: 'Session', period_id: int) -> Leaderboard:
+        """Reads the leaderboard of a period from it's results, or from it's submissions if it has not finished, without caching it."""
+        results = session.query(Result.position, Result.submission_id, Result.user_id, Result.count) \
+            .filter_by(period_id=period_id) \
+            .order_by(Result.position, Result.submission_id).all()
+        if len(results) > 0:
+            board = Leaderboard.from_results(period_id, results)
+        else:
+            entries = session.query(Submission.id, Submission.user, Submission.count).filter_by(period_id=period_id).all()
+            board = Leaderboard(period_id, entries)
+        logger.debug(f'Loaded {"final" if board.final else "live"} leaderboard for period {period_id} ({len(board)} submissions).')
+        return board
+
+    def update(self, period_id: int, submission_id: int, user_id: int, count: int) -> None:
+        """Applies a submission's new vote count, if it's period's leaderboard is cached."""
+        board = self._boards.get(period_id)
+        if board is not None: board.update(submission_id, user_id, count)
+
+    def remove(self, period_id: int, submission_id: int) -> None:
+        """Removes a submission, if it's period's leaderboard is cached."""
+        board = self._boards.get(period_id)
+        if board is not None: board.remove(submission_id)
+
+    def invalidate(self, period_id: Optional[int] = None) -> None:
+        """Drops the cached leaderboard of a single period, or of every period if no ID is given."""
+        if period_id is None:
+            self._boards.clear()
+        else:
+            self._boards.pop(period_id, None)
+
+    def track(self, session_factory: 'sessionmaker') -> None:
+        """Listens to every session made by the factory, applying Submission changes once they have been committed."""
+        event.listen(session_factory, 'after_flush', self._after_flush)
+        event.listen(session_factory, 'after_commit', self._after_commit)
+        event.listen(session_factory, 'after_rollback', self._after_rollback)
+
+    @staticmethod
+    def removed(session: 'Session', submissions: Iterable[Tuple[int, int]]) -> None:
+        """
+        Records submissions deleted by a bulk statement, which the flush events never see, to be removed once committed.
+
+        :param session: The session the submissions were deleted in.
+        :param submissions: Tuples of Submission ID and Period ID.
+        """
+        pending = session.info.setdefault('leaderboard', {})
+        for submission_id, period_id in submissions:
+            pending[submission_id] = (period_id, None, 0, True)
+
+    @staticmethod
+    def _after_flush(session: 'Session', context) -> None:
+        pending = session.info.setdefault('leaderboard', {})
+        for instance in list(session.new) + list(session.dirty):
+            if isinstance(instance, Submission):
+                pending[instance.id] = (instance.period_id, instance.user, instance.count, False)
+            elif isinstance(instance, Result):
+                session.info.setdefault('leaderboard_finished', set()).add(instance.period_id)
+        for instance in session.deleted:
+            if isinstance(instance, Submission):
+                pending[instance.id] = (instance.period_id, instance.user, instance.count, True)
+
+    def _after_commit(self, session: 'Session') -> None:
+        changes = session.info.pop('leaderboard', {})
+        finished = session.info.pop('leaderboard_finished', set())
+        if len(changes) == 0 and len(finished) == 0: return
+
+        if self.loop is not None and not self._on_loop():
+            self.loop.call_soon_threadsafe(self._apply, changes, finished)
+        else:
+            self._apply(changes, finished)
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _apply(self, changes: Dict[int, Tuple[int, Optional[int], int, bool]], finished: Set[int]) -> None:
+        for submission_id, (period_id, user_id, count, deleted) in changes.items():
+            for pending in self._loading.get(period_id, ()): pending.append((submission_id, user_id, count, deleted))
+            if deleted:
+                self.remove(period_id, submission_id)
+            else:
+                self.update(period_id, submission_id, user_id, count)
+        for period_id in finished:
+            for pending in self._loading.get(period_id, ()): pending.append(None)
+            self.invalidate(period_id)
+
+    @staticmethod
+    def _after_rollback(session: 'Session') -> None:
+        session.info.pop('leaderboard', None)
+        session.info.pop('leaderboard_finished', None)
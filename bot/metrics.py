@@ -0,0 +1,245 @@
+import bisect
+import functools
+import logging
+import math
+import time
+import weakref
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import discord
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from bot import constants
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+
+HELP = {
+    'contest_handler_seconds': 'Time spent in event handlers and other hot paths.',
+    'contest_handler_errors_total': 'Exceptions raised by event handlers and other hot paths.',
+    'contest_db_query_seconds': 'Time spent executing database statements.',
+    'contest_db_write_seconds': 'Time spent applying and committing a queued write operation, by operation.',
+    'contest_discord_http_seconds': 'Time spent on Discord REST API requests, by route.',
+    'contest_discord_http_requests_total': 'Discord REST API requests made, by route and result.',
+    'contest_vote_flush_seconds': 'Time spent writing a batch of buffered vote changes.',
+    'contest_vote_flush_size': 'Vote changes written per batch.',
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets, along with their total. Observing is a single bisect."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last count is for observations above every bucket.
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in. Infinite if it falls above every bucket."""
+        if self.count == 0: return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank: return bound
+        return math.inf
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """Pairs of bucket upper bounds and the number of observations at or below them, ending with infinity."""
+        pairs, seen = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            pairs.append((bound, seen))
+        return pairs
+
+
+def format_labels(labels: Labels, **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+    if len(pairs) == 0: return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+
+class Metrics(object):
+    """
+    A registry of histograms, counters and gauges, rendered in the Prometheus text format.
+
+    Histograms and counters are updated in place as work happens. Gauges are functions, only called when the metrics are read,
+    so tracking a queue's depth costs nothing in between.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+        self.counters: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._engines = weakref.WeakSet()
+
+    def histogram(self, name: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: str) -> Histogram:
+        """Returns the histogram for a name and set of labels, creating it with the buckets given if needed."""
+        key = tuple(sorted(labels.items()))
+        histogram = self.histograms[name].get(key)
+        if histogram is None: histogram = self.histograms[name][key] = Histogram(buckets)
+        return histogram
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        self.histogram(name, **labels).observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        self.counters[name][tuple(sorted(labels.items()))] += amount
+
+    def gauge(self, name: str, description: str, function: Callable[[], float]) -> None:
+        """Registers (or replaces) a gauge, read by calling the function given."""
+        self.gauges[name] = (description, function)
+
+    def timed(self, name: str):
+        """Decorates a coroutine function, timing each call in `contest_handler_seconds` and counting any exceptions raised."""
+
+        def decorator(function):
+            histogram = self.histogram('contest_handler_seconds', handler=name)
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                except Exception:
+                    self.increment('contest_handler_errors_total', handler=name)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+
+            return wrapper
+
+        return decorator
+
+    def instrument_engine(self, engine: Engine) -> None:
+        """Times every statement executed through a engine. Does nothing if it is already instrumented."""
+        if engine in self._engines: return
+        self._engines.add(engine)
+        histogram = self.histogram('contest_db_query_seconds')
+
+        # Kept on the statement's execution context rather than the connection, so a statement which raises leaves nothing behind.
+        def before(conn, cursor, statement, parameters, context, executemany) -> None:
+            if context is not None: context._metrics_started = time.perf_counter()
+
+        def after(conn, cursor, statement, parameters, context, executemany) -> None:
+            started = getattr(context, '_metrics_started', None)
+            if started is not None: histogram.observe(time.perf_counter() - started)
+
+        event.listen(engine, 'before_cursor_execute', before)
+        event.listen(engine, 'after_cursor_execute', after)
+
+    def instrument_http(self, http: discord.http.HTTPClient) -> None:
+        """Times and counts every request made by discord.py's HTTP client, labelled by the route's path template."""
+        request = http.request
+
+        async def timed_request(route: discord.http.Route, **kwargs):
+            started, result = time.perf_counter(), 'error'
+            try:
+                response = await request(route, **kwargs)
+                result = 'ok'
+                return response
+            except discord.HTTPException as error:
+                result = str(error.status)
+                raise
+            finally:
+                self.observe('contest_discord_http_seconds', time.perf_counter() - started, method=route.method, route=route.path)
+                self.increment('contest_discord_http_requests_total', method=route.method, route=route.path, result=result)
+
+        http.request = timed_request
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, histograms in sorted(self.histograms.items()):
+            lines += [f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} histogram']
+            for labels, histogram in sorted(histograms.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{name}_bucket{format_labels(labels, le="+Inf" if bound == math.inf else repr(bound))} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        for name, counters in sorted(self.counters.items()):
+            lines += [f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} counter']
+            lines += [f'{name}{format_labels(labels)} {value}' for labels, value in sorted(counters.items())]
+        for name, (description, function) in sorted(self.gauges.items()):
+            try:
+                value = function()
+            except Exception as error:
+                logger.warning(f'Failed to read gauge {name}: {error}')
+                continue
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> List[str]:
+        """Summarizes the handler timings, database, HTTP and queue metrics as short lines of text."""
+        lines = []
+        for labels, histogram in sorted(self.histograms.get('contest_handler_seconds', {}).items()):
+            if histogram.count == 0: continue
+            errors = self.counters.get('contest_handler_errors_total', {}).get(labels, 0)
+            lines.append(f'`{dict(labels)["handler"]}` {histogram.count} calls, avg {histogram.sum / histogram.count * 1000:.1f}ms, '
+                         f'p99 < {histogram.quantile(0.99) * 1000:g}ms' + (f', {errors:g} errors' if errors else ''))
+
+        database = self.histograms.get('contest_db_query_seconds', {}).get(())
+        if database is not None and database.count > 0:
+            lines.append(f'Database: {database.count} statements, avg {database.sum / database.count * 1000:.2f}ms')
+
+        requests = self.counters.get('contest_discord_http_requests_total', {})
+        if len(requests) > 0:
+            routes: Dict[str, float] = defaultdict(float)
+            for labels, value in requests.items():
+                labels = dict(labels)
+                routes[f'{labels["method"]} {labels["route"]}'] += value
+            top = sorted(routes.items(), key=lambda item: -item[1])[:5]
+            lines.append(f'HTTP: {sum(routes.values()):g} requests; ' + ', '.join(f'`{route}` {count:g}' for route, count in top))
+
+        for name, (description, function) in sorted(self.gauges.items()):
+            try:
+                lines.append(f'{description}: {function():g}')
+            except Exception:
+                continue
+        return lines
+
+
+class MetricsServer(object):
+    """Serves a registry's metrics over HTTP for Prometheus to scrape."""
+
+    def __init__(self, metrics: Metrics, host: str = constants.METRICS_HOST, port: int = constants.METRICS_PORT) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        """Starts listening. Does nothing if already started."""
+        if self._runner is not None: return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.metrics.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+# The registry used by the bot, available at import time so hot paths can be decorated with `timed`.
+REGISTRY = Metrics()
+timed = REGISTRY.timed
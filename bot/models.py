@@ -1,17 +1,17 @@
 import datetime
 import enum
 import functools
-import itertools
 import logging
-from typing import Iterable, List, TYPE_CHECKING, Tuple, Union
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING, Tuple, Union
 
 import discord
-from sqlalchemy import Boolean, Column, DateTime, Enum, ForeignKey, Integer, JSON, Text
+from sqlalchemy import Boolean, Column, DateTime, Enum, ForeignKey, Index, Integer, Text, UniqueConstraint, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy_json import NestedMutableList
+from sqlalchemy.orm.collections import attribute_mapped_collection
+from sqlalchemy.types import TypeDecorator
 
-from bot import constants, exceptions, helpers
+from bot import constants, exceptions
 from bot.constants import ReactionMarker
 
 if TYPE_CHECKING:
@@ -24,6 +24,19 @@ logger.setLevel(constants.LOGGING_LEVEL)
 Base = declarative_base()
 
 
+class Hash64(TypeDecorator):
+    """A unsigned 64-bit hash, stored as SQLite's signed 64-bit integer."""
+    impl = Integer
+
+    def process_bind_param(self, value: Optional[int], dialect) -> Optional[int]:
+        if value is None: return None
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    def process_result_value(self, value: Optional[int], dialect) -> Optional[int]:
+        if value is None: return None
+        return value & ((1 << 64) - 1)
+
+
 # TODO: Contest names
 # TODO: Refactor Period into Contest (major)
 
@@ -76,17 +89,49 @@ def check_not_finished(func):
     return wrapper
 
 
+class Vote(Base):
+    """Represents a single user's vote on a Submission."""
+    __tablename__ = 'vote'
+    __table_args__ = (
+        UniqueConstraint('submission_id', 'user_id', name='uq_vote_submission_user'),  # Doubles as the per-submission lookup index
+        Index('ix_vote_period_user', 'period_id', 'user_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    submission_id = Column(Integer, ForeignKey('submission.id'), nullable=False)  # The submission this vote was cast on.
+    submission = relationship('Submission', back_populates='_votes')
+    user_id = Column(Integer, nullable=False)  # The ID of the user who voted.
+    period_id = Column(Integer, ForeignKey('period.id'), nullable=True)  # Copied from the Submission for period-wide lookups.
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)  # When the vote was recorded.
+
+    def __repr__(self) -> str:
+        return f'Vote(submission={self.submission_id}, user={self.user_id}, period={self.period_id})'
+
+
+@event.listens_for(Vote, 'before_insert')
+def _copy_vote_period(mapper, connection, target: Vote) -> None:
+    """Fills in the period of a Vote from it's Submission, which is only guaranteed to be known at flush time."""
+    if target.period_id is None and target.submission is not None:
+        target.period_id = target.submission.period_id
+
+
 class Submission(Base):
     """Represents a Message the bot has seen and remembered as a valid active submission."""
     __tablename__ = 'submission'
+    __table_args__ = (
+        Index('ix_submission_period_count', 'period_id', 'count'),
+    )
 
     id = Column(Integer, primary_key=True)  # Doubles as the ID this Guild has in Discord
     user = Column(Integer)  # The ID of the user who submitted it.
     timestamp = Column(DateTime)  # When the Submission was posted
 
-    _votes: List[int] = Column("votes",
-                               NestedMutableList.as_mutable(JSON))  # A list of IDs correlating to users who voted on this submission.
-    count = Column(Integer, default=0, nullable=False)
+    # The votes on this submission, keyed by the ID of the user who voted.
+    _votes: Dict[int, Vote] = relationship('Vote', back_populates='submission', order_by='Vote.id',
+                                           collection_class=attribute_mapped_collection('user_id'),
+                                           cascade='all, delete-orphan')
+    count = Column(Integer, default=0, nullable=False)  # Denormalized number of votes, kept in sync with _votes.
+    phash = Column(Hash64)  # Perceptual hash of the submitted image, used to find resubmitted images (see bot.duplicates).
 
     period_id = Column(Integer, ForeignKey("period.id"))  # The id of the period this Submission relates to.
     period = relationship("Period", back_populates="submissions")  # The period this submission was made in.
@@ -94,129 +139,165 @@ class Submission(Base):
     @property
     def votes(self) -> List[int]:
         """Getter function for _votes descriptor."""
-        return self._votes
+        return list(self._votes)
 
     @votes.setter
-    def votes(self, votes: List[int]) -> None:
+    def votes(self, votes: Iterable[int]) -> None:
         """"Setter function for _votes descriptor. Modifies count column."""
         votes = list(dict.fromkeys(votes))  # Remove duplicate values while retaining order
-        self._votes = votes
+        existing = self._votes
+        self._votes = {user: existing.get(user) or Vote(user_id=user, period_id=self.period_id) for user in votes}
         self.count = len(votes)
 
-    def __init__(self, **kwargs):
-        # Adds default column behavior for Mutable JSON votes column
-        kwargs.setdefault("votes", [])
-        super().__init__(**kwargs)
+    def _vote_session(self) -> Optional['Session']:
+        """The session to reach this Submission's votes through directly, if they have not been loaded."""
+        state = inspect(self)
+        return state.session if state.persistent and '_votes' in state.unloaded else None
+
+    def _find_vote(self, session: 'Session', user: int) -> Optional[Vote]:
+        return session.query(Vote).filter_by(submission_id=self.id, user_id=user).first()
+
+    def has_vote(self, user: int) -> bool:
+        """Whether or not the given user has voted on this submission."""
+        session = self._vote_session()
+        if session is not None: return self._find_vote(session, user) is not None
+        return user in self._votes
 
     def increment(self, user: int) -> None:
-        """Increase the number of votes by one."""
+        """
+        Increase the number of votes by one.
+
+        If this Submission's votes have not been loaded, the vote is looked up and inserted by it's own key rather than
+        loading every other vote first.
+        """
         if user == self.user:
             raise exceptions.SelfVoteException()
-        elif user in self.votes:
+        elif self.has_vote(user):
             raise exceptions.DatabaseDoubleVoteException()
-        self.votes.append(user)
+
+        session = self._vote_session()
+        if session is not None:
+            session.add(Vote(submission_id=self.id, user_id=user, period_id=self.period_id))
+        else:
+            self._votes[user] = Vote(user_id=user, period_id=self.period_id)
+        self.count = (self.count or 0) + 1
 
     def decrement(self, user: int) -> None:
-        """Decrease the number of votes by one."""
-        if user not in self.votes:
-            raise exceptions.DatabaseNoVoteException()
-        self.votes.remove(user)
+        """Decrease the number of votes by one, without loading the rest of the votes if they have not been loaded."""
+        session = self._vote_session()
+        if session is not None:
+            vote = self._find_vote(session, user)
+            if vote is None:
+                raise exceptions.DatabaseNoVoteException()
+            session.delete(vote)
+        else:
+            if user not in self._votes:
+                raise exceptions.DatabaseNoVoteException()
+            del self._votes[user]
+        self.count = (self.count or 0) - 1
 
     def clear_other_votes(self, ignore: Union[int, Iterable[int]], users: Union[int, Iterable[int]],
                           session: 'Session') -> List[ReactionMarker]:
         """
-        Removes votes from all submissions in the database for a specific user.
+        Removes votes from all other submissions in this Submission's period for a specific user.
         Returns a list of combination Message and User IDs
 
-        :param ignore: The Submission ID(s) to ignore.
+        :param ignore: The Submission ID(s) to ignore, in addition to this one.
         :param users: The User ID(s) to clear.
         :param session: A SQLAlchemy session to use for querying.
         :return: A list of tuples containing a Message ID then User ID who voted for submissions other than the ones being ignored.
         """
         if isinstance(ignore, int): ignore = [ignore]
+        return Submission.clear_votes(session, self.period_id, users, ignore={self.id, *ignore})
+
+    @staticmethod
+    def clear_votes(session: 'Session', period_id: int, users: Union[int, Iterable[int]],
+                    ignore: Iterable[int] = ()) -> List[ReactionMarker]:
+        """
+        Removes the votes of any number of users from every submission in a period, in a single pass.
+
+        :param session: A SQLAlchemy session to use for querying.
+        :param period_id: The Period whose submissions should be cleared.
+        :param users: The User ID(s) to clear.
+        :param ignore: The Submission ID(s) to leave untouched.
+        :return: A list of tuples containing a Message ID then User ID, grouped by Message ID.
+        """
         if isinstance(users, int): users = [users]
         ignore, users = set(ignore), set(users)
         if len(ignore) == 0: logger.warning(f'Clearing ALL votes for user(s): {users}')
         if len(users) == 0: return []
 
+        query = session.query(Vote).filter(Vote.period_id == period_id, Vote.user_id.in_(users))
+        if len(ignore) > 0: query = query.filter(Vote.submission_id.notin_(ignore))
+
         found = []
-        submissions = session.query(Submission).filter(Submission.id != self.id).all()
-        for submission in submissions:
-            # Ignore submissions in the ignore list
-            if submission.id in ignore:
-                continue
+        for vote in query.order_by(Vote.submission_id).all():
+            vote.submission.discard_vote(vote, session)
+            found.append(ReactionMarker(message=vote.submission_id, user=vote.user_id))
 
-            # Find what users voted for this submission that we are clearing
-            votes = set(submission.votes)
-            same = votes.intersection(users)
-            if len(same) == 0:
-                continue
+        return found
 
-            # Remove votes from the submission by said users
-            submission.votes = list(votes - same)
+    @staticmethod
+    def delete_many(session: 'Session', ids: Iterable[int]) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Deletes any number of submissions and their votes with one bulk statement each, skipping IDs that are not submissions.
 
-            # For each user we found that voted, return a tuple Message ID & User ID
-            for shared_user in same:
-                found.append(ReactionMarker(message=submission.id, user=shared_user))
+        Bulk statements skip the session's flush events, so callers keeping state for these submissions must update it themselves.
 
-        return found
+        :param session: A SQLAlchemy session to use for querying.
+        :param ids: The Message IDs which may be submissions.
+        :return: A list of tuples containing a Submission ID then Period ID for each deleted submission, and the number of votes deleted.
+        """
+        ids = set(ids)
+        if len(ids) == 0: return [], 0
+
+        found = session.query(Submission.id, Submission.period_id).filter(Submission.id.in_(ids)).order_by(Submission.id).all()
+        if len(found) == 0: return [], 0
+
+        found_ids = [submission_id for submission_id, _ in found]
+        votes = session.query(Vote).filter(Vote.submission_id.in_(found_ids)).delete(synchronize_session=False)
+        session.query(Submission).filter(Submission.id.in_(found_ids)).delete(synchronize_session=False)
+        return found, votes
+
+    def discard_vote(self, vote: Vote, session: 'Session') -> None:
+        """Removes a Vote row belonging to this submission without loading the rest of it's votes if they are not already loaded."""
+        if '_votes' in inspect(self).unloaded:
+            session.delete(vote)
+            self.count -= 1
+        else:
+            self.decrement(vote.user_id)
 
-    async def update(self, bot: 'ContestBot', message: discord.Message = None, force: bool = True) -> None:
+    def replace_votes(self, voters: Iterable[int], session: 'Session') -> List[ReactionMarker]:
         """
-        Updates the number of votes in the database by thoroughly evaluating the message.
+        Replaces this Submission's votes with the users found reacting to it's message when it was re-scanned.
 
-        :param bot: A instance of the bot to use to query and act on messages.
-        :param message: The message correlating to this Submission
-        :param force: If True, update the submission even outside of it's relevant voting period.
+        Users who voted since the last check have their votes on other submissions removed, and the author's own reaction is
+        never counted.
+
+        :param voters: The IDs of every user (other than the bot) with a upvote reaction on the message.
+        :param session: The SQLAlchemy session this Submission belongs to.
+        :return: The reactions to remove: the author's own, then those of new voters on other submissions.
         """
-        saw_self, current, old = False, set(), set(self.votes)  # Votes currently on the message and votes only on the submission
-
-        for reaction in message.reactions:
-            if helpers.is_upvote(reaction.emoji):
-                reacting_user: Union[discord.Member, discord.User]
-                async for reacting_user in reaction.users():
-                    # Check if this is our bot reacting
-                    if reacting_user.id == bot.user.id:
-                        saw_self = True
-                    else:
-                        current.add(reacting_user.id)
+        current, old = set(voters), set(self.votes)
+        to_clear = []
+        if self.user in current:
+            to_clear.append(ReactionMarker(message=self.id, user=self.user))
+            current.discard(self.user)
 
         to_add, to_remove, report = current - old, old - current, ''
         if len(to_add) > 0:
             report += f'Added: {", ".join(map(str, to_add))}'
+            # Remove the votes of every user who has added a reaction since the last check in other submissions
+            to_clear += self.clear_other_votes(ignore=self.id, users=to_add, session=session)
 
-            with bot.get_session() as session:
-                channel: discord.TextChannel = message.channel
-
-                # Iterate through each user who has added a reaction since the last check
-                for user_id in to_add:
-                    # Remove their votes in other submissions
-                    reactions_to_clear = self.clear_other_votes(ignore=self.id, users=user_id, session=session)
-
-                    # Then remove all upvote reactions from that user from other submission
-                    for message_id, reaction_tuples in itertools.groupby(reactions_to_clear, lambda marker: marker.message):
-                        message_to_clear: discord.Message = await channel.fetch_message(message_id)
-                        reaction_marker: ReactionMarker
-
-                        # Should only iterate once, but we'll ready it for multiple users
-                        for reaction_marker in reaction_tuples:
-                            await message_to_clear.remove_reaction(
-                                    bot.get_emoji(constants.Emoji.UPVOTE),
-                                    await message.guild.fetch_member(reaction_marker.user)
-                            )
-
-        # Update the current list of votes
-        if self.period.voting or force:
-            self.votes = list(current)
+        # Keep the existing votes first so that their order is retained
+        self.votes = [user for user in self.votes if user in current] + sorted(to_add)
 
         if len(to_remove) > 0:
             if report: report += ' '
             report += f'Removed: {", ".join(map(str, to_remove))}'
         if report: logger.debug(report)
-
-        # If we never saw ourselves in the reaction, add the Upvote emoji
-        if not saw_self and self.period.voting:
-            await message.add_reaction(constants.Emoji.UPVOTE)
+        return to_clear
 
     def __repr__(self) -> str:
         return f'Submission(id={self.id}, user={self.user}, period={self.period_id}, {self.count} votes)'
@@ -236,7 +317,9 @@ class Period(Base):
     active = Column(Boolean, default=True)  # Whether this Period is currently running. State will not necessarily be FINISHED.
     completed = Column(Boolean, default=False)  # Whether this Period was completed to the end, properly.
 
-    # TODO: Add automatic duration based advancement logic and tracking columns.
+    schedules = relationship("Schedule", back_populates="period")  # Timed advancements of this period.
+    results: List['Result'] = relationship("Result", back_populates="period",
+                                           order_by="(Result.position, Result.submission_id)")  # Final standings, once finished.
 
     start_time = Column(DateTime, default=datetime.datetime.utcnow())  # When this period was created/started (Ready state).
     submissions_time = Column(DateTime, nullable=True)  # When this period switched to the Submissions state.
@@ -244,12 +327,17 @@ class Period(Base):
     voting_time = Column(DateTime, nullable=True)  # When this period switched to the Voting state.
     finished_time = Column(DateTime, nullable=True)  # When this period switched to the Finished state.
 
-    async def get_submission_messages(self, bot: 'ContestBot') -> List[Tuple[Submission, discord.Message]]:
+    async def get_submission_messages(self, bot: 'ContestBot', bulk: bool = True) -> List[Tuple[Submission, Optional[discord.Message]]]:
         """
         Returns a list of tuples containing Submission objects and full Discord Messages
 
         :param bot: the active Discord Bot instance
+        :param bulk: If True, page through the submission channel's history instead of fetching each message individually.
         """
+        if bulk:
+            messages = await bot.fetch_messages(self.guild.submission_channel, [submission.id for submission in self.submissions])
+            return [(submission, messages.get(submission.id)) for submission in self.submissions]
+
         found = []
         for submission in self.submissions:
             try:
@@ -275,6 +363,7 @@ class Period(Base):
             self.finished_time = datetime.datetime.utcnow()
             self.completed = True
             self.active = False
+            self.finalize()
 
         self.state = next_state
         return next_state
@@ -293,6 +382,27 @@ class Period(Base):
         """
         self.finished_time = datetime.datetime.utcnow()
         self.active = False
+        if self.state == PeriodStates.VOTING: self.finalize()
+
+    def finalize(self) -> List['Result']:
+        """
+        Records the final standings of this Period's submissions as Result rows, ranked by vote count then age.
+
+        Submissions with the same number of votes share a position. The standings are only ever recorded once; later calls
+        return the existing results, so a finished Period never has it's votes re-counted or re-sorted.
+        """
+        if len(self.results) > 0: return self.results
+
+        position, previous = 0, None
+        for submission in sorted(self.submissions, key=lambda submission: (-(submission.count or 0), submission.id)):
+            count = submission.count or 0
+            if count != previous:
+                position += 1
+                previous = count
+            self.results.append(Result(submission_id=submission.id, user_id=submission.user, position=position, count=count))
+
+        logger.info(f'Recorded final standings of {len(self.results)} submissions for {self}.')
+        return self.results
 
     def permission_explanation(self) -> str:
         """Returns a quick explanation of the period's current state."""
@@ -310,3 +420,87 @@ class Period(Base):
 
     def __repr__(self) -> str:
         return f'Period(id={self.id}, guild={self.guild_id}, {self.state.name}, active={self.active})'
+
+
+class Result(Base):
+    """Represents the final standing of a submission in a finished Period. Written once when the Period ends, then never changed."""
+    __tablename__ = 'result'
+    __table_args__ = (
+        UniqueConstraint('period_id', 'submission_id', name='uq_result_period_submission'),
+        Index('ix_result_period_position', 'period_id', 'position'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    period_id = Column(Integer, ForeignKey('period.id'), nullable=False)  # The finished period.
+    period = relationship('Period', back_populates='results')
+    submission_id = Column(Integer, nullable=False)  # The submission's Message ID. Kept even if the submission is later deleted.
+    user_id = Column(Integer, nullable=False)  # The user who submitted it.
+    position = Column(Integer, nullable=False)  # The final position, starting at 1. Shared by submissions with the same count.
+    count = Column(Integer, nullable=False)  # The final number of votes.
+
+    def __repr__(self) -> str:
+        return f'Result(period={self.period_id}, #{self.position}, submission={self.submission_id}, {self.count} votes)'
+
+
+class PeriodStats(Base):
+    """Represents the precomputed turnout of a finished Period, written once alongside it's results."""
+    __tablename__ = 'period_stats'
+    __table_args__ = (
+        Index('ix_period_stats_guild_finished', 'guild_id', 'finished_time'),
+    )
+
+    period_id = Column(Integer, ForeignKey('period.id'), primary_key=True)  # The finished period.
+    guild_id = Column(Integer, ForeignKey('guild.id'), nullable=False)  # The guild the period ran in.
+    finished_time = Column(DateTime, nullable=True)  # When the period finished.
+    submissions = Column(Integer, nullable=False, default=0)  # The number of submissions.
+    voters = Column(Integer, nullable=False, default=0)  # The number of distinct users who voted.
+    votes = Column(Integer, nullable=False, default=0)  # The total number of votes cast.
+    top_count = Column(Integer, nullable=False, default=0)  # The vote count of the winning submission(s).
+
+    def __repr__(self) -> str:
+        return f'PeriodStats(period={self.period_id}, {self.submissions} submissions, {self.voters} voters, {self.votes} votes)'
+
+
+class UserStats(Base):
+    """Represents the running totals of a user's contest history within a single guild, updated as each Period finishes."""
+    __tablename__ = 'user_stats'
+    __table_args__ = (
+        UniqueConstraint('guild_id', 'user_id', name='uq_user_stats_guild_user'),
+        Index('ix_user_stats_guild_wins', 'guild_id', 'wins'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    guild_id = Column(Integer, ForeignKey('guild.id'), nullable=False)  # The guild these totals belong to.
+    user_id = Column(Integer, nullable=False)  # The user these totals belong to.
+    contests = Column(Integer, nullable=False, default=0)  # The number of finished periods the user submitted to.
+    wins = Column(Integer, nullable=False, default=0)  # The number of finished periods the user placed first in.
+    votes = Column(Integer, nullable=False, default=0)  # The total number of votes the user's submissions received.
+    best_position = Column(Integer, nullable=True)  # The user's best final position.
+    streak = Column(Integer, nullable=False, default=0)  # Consecutive finished periods submitted to, ending at `last_period_id`.
+    best_streak = Column(Integer, nullable=False, default=0)  # The longest streak the user has had.
+    last_period_id = Column(Integer, ForeignKey('period.id'), nullable=True)  # The last finished period the user submitted to.
+
+    def __repr__(self) -> str:
+        return f'UserStats(guild={self.guild_id}, user={self.user_id}, {self.contests} contests, {self.wins} wins)'
+
+
+class Schedule(Base):
+    """Represents a timed advancement of a Period out of a given state, remembered until it has been carried out."""
+    __tablename__ = 'schedule'
+    __table_args__ = (
+        UniqueConstraint('period_id', 'state', name='uq_schedule_period_state'),
+        Index('ix_schedule_completed_due', 'completed', 'due'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    period_id = Column(Integer, ForeignKey('period.id'), nullable=False)  # The period to advance.
+    period = relationship('Period', back_populates='schedules')
+    state = Column(Enum(PeriodStates), nullable=False)  # The state the period is advanced out of. Stale if it has already left it.
+    due = Column(DateTime, nullable=False)  # When the period should be advanced.
+    completed = Column(Boolean, default=False, nullable=False)  # Whether this schedule was carried out (or found to be stale).
+
+    channel_id = Column(Integer, nullable=True)  # The channel the advancement is reported in.
+    user_id = Column(Integer, nullable=True)  # The user to ping back in the report, if any.
+
+    def __repr__(self) -> str:
+        return f'Schedule(id={self.id}, period={self.period_id}, {self.state.name}, due={self.due}, completed={self.completed})'
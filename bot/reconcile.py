@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Set, TYPE_CHECKING, Tuple
+
+import discord
+from sqlalchemy import func
+
+from bot import constants, helpers
+from bot.constants import ReactionMarker
+from bot.models import Guild, Period, Submission, Vote
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+    from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+
+class ReconcileReport(namedtuple('ReconcileReport', ['guild', 'period', 'duration', 'submissions', 'votes_added', 'votes_removed',
+                                                    'deleted', 'reactions_removed'])):
+    """A summary of the changes made while reconciling a single guild."""
+
+    @property
+    def touched(self) -> int:
+        """The total number of votes, submissions and reactions changed."""
+        return self.votes_added + self.votes_removed + self.deleted + self.reactions_removed
+
+
+class Reconciler(object):
+    """
+    Brings the stored submissions and votes of each guild's current period back in line with what is actually in Discord.
+
+    Reactions added or removed and messages deleted while the bot was offline are never seen as events, so this reads the
+    submission channel's history in bulk, diffs it against the database and applies every change in a single transaction.
+    """
+
+    def __init__(self, bot: 'ContestBot', concurrency: int = constants.RECONCILE_CONCURRENCY) -> None:
+        self.bot = bot
+        self.concurrency = concurrency
+
+    async def reconcile_all(self, guild_ids: Optional[Iterable[int]] = None, thorough: bool = False) -> List[ReconcileReport]:
+        """
+        Reconciles many guilds concurrently, bounded by the configured concurrency.
+
+        :param guild_ids: The guilds to reconcile. Defaults to every guild the bot is currently in.
+        :param thorough: If True, page through the reacting users of every submission, even when the counts already match.
+        :return: A report for each guild which had a active period to reconcile.
+        """
+        if guild_ids is None: guild_ids = [guild.id for guild in self.bot.guilds]
+        limit = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+
+        async def reconcile(guild_id: int) -> Optional[ReconcileReport]:
+            async with limit:
+                try:
+                    return await self.reconcile_guild(guild_id, thorough=thorough)
+                except Exception as error:
+                    logger.error(f'Failed to reconcile guild {guild_id}.', exc_info=error)
+
+        reports = [report for report in await asyncio.gather(*map(reconcile, guild_ids)) if report is not None]
+        logger.info(f'Reconciled {len(reports)} guild{"s" if len(reports) != 1 else ""} in {time.perf_counter() - start:.2f}s, '
+                    f'touching {sum(report.touched for report in reports)} entities.')
+        return reports
+
+    async def reconcile_guild(self, guild_id: int, thorough: bool = False) -> Optional[ReconcileReport]:
+        """
+        Reconciles the current period of a single guild.
+
+        :param guild_id: The guild to reconcile.
+        :param thorough: If True, page through the reacting users of every submission, even when the counts already match.
+        :return: A report of what was changed, or None if the guild has no active period.
+        """
+        start = time.perf_counter()
+
+        config = await self.bot.guild_config(guild_id)
+        if config is None or config.period_id is None: return None
+
+        # Votes changed by live events while history is fetched are only written once the differences found have been, so
+        # the stale snapshot taken here never overwrites them.
+        await self.bot.vote_buffer.flush()
+        async with self.bot.vote_buffer.hold(config.period_id):
+            # Read everything needed up front so no session is held open while talking to Discord.
+            state = await self.bot.run_read(self._read, guild_id)
+            if state is None: return None
+            period_id, channel_id, voting, stored = state
+            if period_id != config.period_id:
+                # The cached period is the one being held, so the differences can only be written for that one.
+                logger.warning(f'Skipping reconciliation of guild {guild_id}: period {period_id} is current, but period '
+                               f'{config.period_id} was cached.')
+                return None
+
+            messages = await self.bot.fetch_messages(channel_id, stored)
+            deleted = [submission_id for submission_id in stored if submission_id not in messages]
+
+            actual: Dict[int, Set[int]] = {}
+            missing_reaction: List[discord.Message] = []
+            if voting:
+                for submission_id, message in messages.items():
+                    voters, reacted = await self._voters(message, stored[submission_id], thorough)
+                    if not reacted:
+                        missing_reaction.append(message)
+                    if voters != stored[submission_id]:
+                        actual[submission_id] = voters
+
+            self.bot.vote_buffer.forget(deleted)
+            report, to_clear = await self.bot.run_session(self._apply, guild_id, period_id, deleted, actual)
+            self.bot.duplicates.remove(guild_id, deleted)
+        await self.bot.vote_buffer.reset(period_id)  # Reloaded on the next vote, with the changes just made.
+
+        # Reactions are only touched once the transaction has been committed.
+        await self.bot.remove_vote_reactions(channel_id, to_clear)
+        emoji = self.bot.get_emoji(constants.Emoji.UPVOTE)
+        for message in missing_reaction:
+            await message.add_reaction(emoji)
+
+        report = report._replace(duration=time.perf_counter() - start, submissions=len(stored))
+        logger.info(f'Reconciled period {period_id} of guild {guild_id} in {report.duration:.2f}s: '
+                    f'{report.votes_added} votes added, {report.votes_removed} removed, {report.deleted} submissions deleted, '
+                    f'{report.reactions_removed} reactions removed.')
+        return report
+
+    async def _voters(self, message: discord.Message, stored: Set[int], thorough: bool) -> Tuple[Set[int], bool]:
+        """
+        Returns the IDs of every user (other than the bot) with a upvote reaction on the message, and whether or not the bot's
+        own upvote is present. Users are only paged through when the reaction count disagrees with the stored votes.
+        """
+        for reaction in message.reactions:
+            if helpers.is_upvote(reaction.emoji):
+                if not thorough and reaction.count - (1 if reaction.me else 0) == len(stored):
+                    return stored, reaction.me
+                return {user.id async for user in reaction.users() if user.id != self.bot.user.id}, reaction.me
+        return set(), False
+
+    @staticmethod
+    def _read(session: 'Session', guild_id: int) -> Optional[Tuple[int, int, bool, Dict[int, Set[int]]]]:
+        """Reads the current period, submission channel, voting state and stored votes of a guild, if it has a active period."""
+        guild: Guild = session.query(Guild).get(guild_id)
+        period: Period = guild.current_period if guild is not None else None
+        if period is None or not period.active or guild.submission_channel is None: return None
+
+        # Every vote is read with a single query, rather than one for each submission.
+        stored: Dict[int, Set[int]] = {submission_id: set()
+                                       for submission_id, in session.query(Submission.id).filter_by(period_id=period.id)}
+        for submission_id, user_id in session.query(Vote.submission_id, Vote.user_id).filter(Vote.period_id == period.id):
+            stored[submission_id].add(user_id)
+        return period.id, guild.submission_channel, period.voting, stored
+
+    @staticmethod
+    def _apply(session: 'Session', guild_id: int, period_id: int, deleted: List[int],
+               actual: Dict[int, Set[int]]) -> Tuple[ReconcileReport, List[ReactionMarker]]:
+        """Applies the differences found in a single transaction, returning a partial report and the reactions to remove."""
+        added = removed = deleted_count = 0
+        to_clear: List[ReactionMarker] = []
+
+        # Only submissions still stored are counted, as they may have been deleted since they were read.
+        for submission_id in deleted:
+            submission: Submission = session.query(Submission).get(submission_id)
+            if submission is not None:
+                removed += submission.count
+                deleted_count += 1
+                session.delete(submission)
+
+        for submission in session.query(Submission).filter(Submission.id.in_(actual)).all():
+            voters = actual[submission.id]
+            if submission.user in voters:
+                to_clear.append(ReactionMarker(message=submission.id, user=submission.user))
+                voters = voters - {submission.user}
+
+            old = set(submission.votes)
+            added += len(voters - old)
+            removed += len(old - voters)
+            # Keep the existing votes first so that they are treated as the oldest below
+            submission.votes = [user for user in submission.votes if user in voters] + sorted(voters - old)
+
+        # Users who voted on several submissions while we were away keep only their oldest vote.
+        session.flush()
+        duplicates = session.query(Vote.user_id) \
+            .filter(Vote.period_id == period_id) \
+            .group_by(Vote.user_id) \
+            .having(func.count(Vote.id) > 1)
+        duplicates = [user_id for user_id, in duplicates.all()]
+        if len(duplicates) > 0:
+            votes = session.query(Vote) \
+                .filter(Vote.period_id == period_id, Vote.user_id.in_(duplicates)) \
+                .order_by(Vote.user_id, Vote.id) \
+                .all()
+            kept: Set[int] = set()
+            for vote in votes:
+                if vote.user_id in kept:
+                    to_clear.append(ReactionMarker(message=vote.submission_id, user=vote.user_id))
+                    vote.submission.discard_vote(vote, session)
+                    removed += 1
+                else:
+                    kept.add(vote.user_id)
+
+        report = ReconcileReport(guild=guild_id, period=period_id, duration=0.0, submissions=0, votes_added=added,
+                                 votes_removed=removed, deleted=deleted_count, reactions_removed=len(to_clear))
+        return report, sorted(to_clear)
@@ -0,0 +1,89 @@
+"""
+Records the gateway events of a contest, so they can be replayed against the bot to measure it's performance.
+
+To record, load this module as an extension alongside the contest cogs. Events from each guild's submission channel are
+written to `constants.RECORDING`, with message content dropped and user IDs replaced by pseudonyms. Recordings are replayed
+by `benchmarks/replay.py`:
+
+    python -m benchmarks.replay events.jsonl --speed 10
+"""
+import json
+import logging
+import time
+from collections import namedtuple
+from typing import Dict, List, TextIO
+
+from discord.ext import commands
+
+from bot import constants
+from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+# Gateway events read by ContestEventsCog.
+RECORDED_EVENTS = {'MESSAGE_CREATE', 'MESSAGE_DELETE', 'MESSAGE_DELETE_BULK', 'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE',
+                   'MESSAGE_REACTION_REMOVE_ALL', 'MESSAGE_REACTION_REMOVE_EMOJI'}
+
+RecordedEvent = namedtuple('RecordedEvent', ['at', 'type', 'period', 'state', 'data'])
+
+BOT_USER_ID = 1  # The bot's own pseudonym, which the fake Discord of the replay harness also gives the bot.
+
+
+class EventRecorder(commands.Cog):
+    """Writes sanitized gateway events from submission channels to a file, one JSON object per line."""
+
+    def __init__(self, bot: ContestBot, path: str = constants.RECORDING) -> None:
+        self.bot = bot
+        self.file: TextIO = open(path, 'a', encoding='utf-8')
+        self.started = time.monotonic()
+        self.users: Dict[int, int] = {}  # User ID -> pseudonym
+        self.recorded = 0
+
+    def cog_unload(self) -> None:
+        self.file.close()
+
+    def pseudonym(self, user_id: int) -> int:
+        """Replaces a User ID with a small number that is consistent within the recording. The bot keeps it's replay ID."""
+        if user_id == self.bot.user.id: return BOT_USER_ID
+        if user_id not in self.users: self.users[user_id] = BOT_USER_ID + 1 + len(self.users)
+        return self.users[user_id]
+
+    def sanitize(self, event_type: str, data: dict) -> dict:
+        """Keeps only the IDs and flags the bot reads from a event, replacing User IDs."""
+        sanitized = {key: int(data[key]) for key in ('guild_id', 'channel_id', 'message_id', 'id') if key in data}
+        if 'ids' in data: sanitized['ids'] = [int(message_id) for message_id in data['ids']]
+        if 'user_id' in data: sanitized['user_id'] = self.pseudonym(int(data['user_id']))
+        if 'emoji' in data: sanitized['emoji'] = {'id': int(data['emoji']['id']) if data['emoji'].get('id') else None,
+                                                  'name': data['emoji'].get('name')}
+        if event_type == 'MESSAGE_CREATE':
+            author = data.get('author', {})
+            sanitized['author'] = {'id': self.pseudonym(int(author['id'])), 'bot': author.get('bot', False)}
+            sanitized['attachments'] = [{'width': attachment.get('width'), 'spoiler': attachment.get('filename', '').startswith('SPOILER_')}
+                                        for attachment in data.get('attachments', [])]
+        return sanitized
+
+    @commands.Cog.listener()
+    async def on_socket_response(self, message: dict) -> None:
+        event_type, data = message.get('t'), message.get('d')
+        if event_type not in RECORDED_EVENTS or not isinstance(data, dict) or 'guild_id' not in data: return
+        if not await self.bot.is_submission_channel(int(data['guild_id']), int(data['channel_id'])): return
+
+        config = await self.bot.guild_config(int(data['guild_id']))
+        line = {'at': round(time.monotonic() - self.started, 3), 't': event_type, 'period': config.period_id,
+                'state': config.period_state.name if config.period_state is not None else None, 'd': self.sanitize(event_type, data)}
+        self.file.write(json.dumps(line) + '\n')
+        self.recorded += 1
+        if self.recorded % 100 == 0: self.file.flush()
+
+
+def load(path: str) -> List[RecordedEvent]:
+    """Reads a recording, in the order it was recorded."""
+    with open(path, 'r', encoding='utf-8') as file:
+        return [RecordedEvent(at=line['at'], type=line['t'], period=line['period'], state=line['state'], data=line['d'])
+                for line in map(json.loads, filter(str.strip, file))]
+
+
+def setup(bot) -> None:
+    bot.add_cog(EventRecorder(bot))
+
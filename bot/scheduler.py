@@ -0,0 +1,94 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import List, Optional, Set, TYPE_CHECKING, Tuple
+
+from bot import constants
+from bot.models import Period, Schedule
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+    from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+
+class Scheduler(object):
+    """
+    Dispatches a `schedule_due` event (handled by `on_schedule_due` listeners) for each Schedule once it's due time passes.
+
+    Pending schedules are kept in a heap ordered by due time, so a single task sleeps until the nearest deadline instead of
+    polling every guild. Schedules live in the database and are read back on start, so any that fell due while the bot was
+    offline are dispatched straight away, oldest first.
+    """
+
+    def __init__(self, bot: 'ContestBot') -> None:
+        self.bot = bot
+        self._heap: List[Tuple[datetime, int]] = []  # Due time & Schedule ID pairs
+        self._cancelled: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Loads every pending schedule from the database and starts waiting on them. Does nothing if already started."""
+        if self._task is not None: return
+        self._wakeup = asyncio.Event()
+
+        pending = await self.bot.run_read(self._load)
+        for due, schedule_id in pending:
+            self.add(schedule_id, due)
+        overdue = sum(1 for due, _ in pending if due <= datetime.utcnow())
+        logger.info(f'Scheduler started with {len(pending)} pending schedule{"s" if len(pending) != 1 else ""} ({overdue} overdue).')
+
+        self._task = asyncio.ensure_future(self._run())
+
+    def _load(self, session: 'Session') -> List[Tuple[datetime, int]]:
+        """Reads the pending schedules of the guilds run by this process."""
+        rows = session.query(Schedule.due, Schedule.id, Period.guild_id).filter_by(completed=False).join(Period).all()
+        return [(due, schedule_id) for due, schedule_id, guild_id in rows if self.bot.owns_guild(guild_id)]
+
+    def add(self, schedule_id: int, due: datetime) -> None:
+        """Starts waiting on a schedule which has been committed to the database."""
+        self._cancelled.discard(schedule_id)
+        heapq.heappush(self._heap, (due, schedule_id))
+        if self._wakeup is not None: self._wakeup.set()
+
+    def cancel(self, schedule_id: int) -> None:
+        """Stops waiting on a schedule, if it is being waited on. It is not removed from the database."""
+        if any(pending == schedule_id for _, pending in self._heap): self._cancelled.add(schedule_id)
+
+    def stop(self) -> None:
+        """Stops the scheduler task."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def next_due(self) -> Optional[datetime]:
+        """The due time of the nearest pending schedule."""
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        """The number of schedules being waited on. Cancelled schedules stay in the heap until due, but are not counted."""
+        return sum(1 for _, schedule_id in self._heap if schedule_id not in self._cancelled)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+
+            now = datetime.utcnow()
+            while self._heap and self._heap[0][0] <= now:
+                due, schedule_id = heapq.heappop(self._heap)
+                if schedule_id in self._cancelled:
+                    self._cancelled.discard(schedule_id)
+                    continue
+                logger.debug(f'Schedule {schedule_id} is due ({(now - due).total_seconds():.1f}s late).')
+                self.bot.dispatch('schedule_due', schedule_id)
+
+            timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
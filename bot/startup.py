@@ -0,0 +1,56 @@
+import time
+import tracemalloc
+from collections import namedtuple
+from typing import Callable, List
+
+# A single step of startup. Memory is the KiB allocated during the step, or None if memory was not traced.
+Phase = namedtuple('Phase', ['name', 'seconds', 'memory'])
+
+
+class StartupTimer(object):
+    """
+    Records how long each phase of startup took, from imports through to the bot being ready.
+
+    This module only imports the standard library, so it can be imported (and started) before anything heavy. If memory is
+    traced, the KiB allocated during each phase are recorded too, at the cost of slowing everything down while tracing.
+    """
+
+    def __init__(self, memory: bool = False, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self.memory = memory
+        self.phases: List[Phase] = []
+        if memory and not tracemalloc.is_tracing(): tracemalloc.start()
+        self._started = self._last = clock()
+        self._allocated = self._traced()
+
+    def _traced(self) -> int:
+        return tracemalloc.get_traced_memory()[0] if self.memory else 0
+
+    def mark(self, name: str) -> Phase:
+        """Ends the current phase, naming it."""
+        now, allocated = self.clock(), self._traced()
+        phase = Phase(name=name, seconds=now - self._last,
+                      memory=(allocated - self._allocated) / 1024 if self.memory else None)
+        self.phases.append(phase)
+        self._last, self._allocated = now, allocated
+        return phase
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the timer was started."""
+        return self.clock() - self._started
+
+    def stop(self) -> None:
+        """Stops tracing memory, if it was traced."""
+        if self.memory: tracemalloc.stop()
+
+    def report(self) -> List[str]:
+        """Describes each phase and it's share of the total, as lines of text."""
+        total = sum(phase.seconds for phase in self.phases)
+        lines = []
+        for phase in self.phases:
+            line = f'{phase.name}: {phase.seconds * 1000:.1f}ms ({phase.seconds / total if total > 0 else 0:.0%})'
+            if phase.memory is not None: line += f', {phase.memory:+,.0f} KiB'
+            lines.append(line)
+        lines.append(f'Total: {total * 1000:.1f}ms')
+        return lines
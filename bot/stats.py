@@ -0,0 +1,121 @@
+import logging
+from collections import namedtuple
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from sqlalchemy import distinct, event, func
+
+from bot import constants
+from bot.models import Period, PeriodStats, Result, UserStats, Vote
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session, sessionmaker
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+UserSummary = namedtuple('UserSummary', ['user', 'contests', 'wins', 'votes', 'average_votes', 'best_position', 'streak',
+                                         'best_streak'])
+Turnout = namedtuple('Turnout', ['period', 'finished_time', 'submissions', 'voters', 'votes', 'top_count'])
+
+
+def record_period(session: 'Session', period: Period) -> Optional[PeriodStats]:
+    """
+    Folds the results of a finished period into it's guild's statistics, touching only the rows of it's participants.
+
+    :param session: A SQLAlchemy session to use for querying.
+    :param period: The finished period, with it's results recorded.
+    :return: The period's new statistics, or None if they were already recorded.
+    """
+    if session.query(PeriodStats).get(period.id) is not None: return None
+
+    previous_id = latest_period_id(session, period.guild_id)
+    voters = session.query(func.count(distinct(Vote.user_id))).filter(Vote.period_id == period.id).scalar()
+    stats = PeriodStats(period_id=period.id, guild_id=period.guild_id, finished_time=period.finished_time,
+                        submissions=len(period.results), voters=voters or 0, votes=sum(result.count for result in period.results),
+                        top_count=max((result.count for result in period.results), default=0))
+    session.add(stats)
+
+    # Users should only have one submission per period, but older periods may have more.
+    totals: Dict[int, List[int]] = {}  # User ID -> [best position, votes received]
+    for result in period.results:
+        position, votes = totals.get(result.user_id, (result.position, 0))
+        totals[result.user_id] = [min(position, result.position), votes + result.count]
+
+    rows = {}
+    if len(totals) > 0:
+        query = session.query(UserStats).filter(UserStats.guild_id == period.guild_id, UserStats.user_id.in_(totals.keys()))
+        rows = {row.user_id: row for row in query.all()}
+
+    for user_id, (position, votes) in totals.items():
+        row = rows.get(user_id)
+        if row is None:
+            row = UserStats(guild_id=period.guild_id, user_id=user_id, contests=0, wins=0, votes=0, streak=0, best_streak=0)
+            session.add(row)
+
+        row.contests += 1
+        row.wins += 1 if position == 1 else 0
+        row.votes += votes
+        row.best_position = position if row.best_position is None else min(row.best_position, position)
+        row.streak = row.streak + 1 if previous_id is not None and row.last_period_id == previous_id else 1
+        row.best_streak = max(row.best_streak, row.streak)
+        row.last_period_id = period.id
+
+    logger.debug(f'Recorded statistics for {period} ({len(totals)} participants).')
+    return stats
+
+
+def track(session_factory: 'sessionmaker') -> None:
+    """Listens to every session made by the factory, recording statistics in the same flush as a period's results."""
+    event.listen(session_factory, 'before_flush', _before_flush)
+
+
+def _before_flush(session: 'Session', context, instances) -> None:
+    periods = {instance.period for instance in session.new if isinstance(instance, Result)}
+    if len(periods) == 0: return
+
+    with session.no_autoflush:
+        for period in sorted(periods, key=lambda period: (period.finished_time is None, period.finished_time, period.id)):
+            record_period(session, period)
+
+
+def latest_period_id(session: 'Session', guild_id: int) -> Optional[int]:
+    """Returns the ID of the guild's most recently finished period with recorded statistics."""
+    row = session.query(PeriodStats.period_id) \
+        .filter_by(guild_id=guild_id) \
+        .order_by(PeriodStats.finished_time.desc(), PeriodStats.period_id.desc()) \
+        .first()
+    return row[0] if row is not None else None
+
+
+def summarize(row: UserStats, latest: Optional[int]) -> UserSummary:
+    """Creates a summary of a user's statistics. Streaks only count if the user submitted to the latest finished period."""
+    return UserSummary(user=row.user_id, contests=row.contests, wins=row.wins, votes=row.votes,
+                       average_votes=row.votes / row.contests if row.contests > 0 else 0.0, best_position=row.best_position,
+                       streak=row.streak if row.last_period_id == latest else 0, best_streak=row.best_streak)
+
+
+def user_summary(session: 'Session', guild_id: int, user_id: int) -> Optional[UserSummary]:
+    """Returns a user's statistics within a guild, or None if they have never submitted to a finished period."""
+    row = session.query(UserStats).filter_by(guild_id=guild_id, user_id=user_id).first()
+    if row is None: return None
+    return summarize(row, latest_period_id(session, guild_id))
+
+
+def top_winners(session: 'Session', guild_id: int, limit: int = 10) -> List[UserSummary]:
+    """Returns the users of a guild with the most wins, breaking ties by the total votes received."""
+    rows = session.query(UserStats) \
+        .filter(UserStats.guild_id == guild_id, UserStats.wins > 0) \
+        .order_by(UserStats.wins.desc(), UserStats.votes.desc(), UserStats.user_id) \
+        .limit(limit).all()
+    latest = latest_period_id(session, guild_id)
+    return [summarize(row, latest) for row in rows]
+
+
+def turnout(session: 'Session', guild_id: int, limit: int = 10) -> List[Turnout]:
+    """Returns the turnout of a guild's most recently finished periods, newest first."""
+    rows = session.query(PeriodStats) \
+        .filter_by(guild_id=guild_id) \
+        .order_by(PeriodStats.finished_time.desc(), PeriodStats.period_id.desc()) \
+        .limit(limit).all()
+    return [Turnout(period=row.period_id, finished_time=row.finished_time, submissions=row.submissions, voters=row.voters,
+                    votes=row.votes, top_count=row.top_count) for row in rows]
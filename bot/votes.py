@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, TYPE_CHECKING, Tuple
+
+from sqlalchemy import func
+
+from bot import constants
+from bot.constants import ReactionMarker
+from bot.models import Submission, Vote
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+    from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+FLUSH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # Changes written per flush
+
+# A vote change waiting to be written: the Period it belongs to, whether it was added or removed, and when it happened.
+Change = Tuple[int, bool, datetime]
+
+
+class PeriodVotes(object):
+    """
+    The votes of a single voting period, held in memory as the authoritative tally of who has voted for what.
+
+    Every vote added or removed is also recorded as a pending change until it is written to the database. A change which
+    undoes one still pending cancels it out, so a vote added then removed before a flush is never written at all.
+    """
+
+    def __init__(self, period_id: int, authors: Dict[int, int], votes: Iterable[Tuple[int, int]] = ()) -> None:
+        """
+        :param period_id: The period the votes belong to.
+        :param authors: The author of each of the period's submissions, keyed by Submission ID.
+        :param votes: The stored votes, as tuples of Submission ID and User ID.
+        """
+        self.period_id = period_id
+        self.authors: Dict[int, int] = {}
+        self.voters: Dict[int, Set[int]] = {}  # Submission ID -> User IDs
+        self.choices: Dict[int, Set[int]] = defaultdict(set)  # User ID -> Submission IDs
+        self.changes: Dict[Tuple[int, int], Change] = {}  # Submission ID & User ID -> pending change
+
+        for submission_id, author in authors.items():
+            self.add_submission(submission_id, author)
+        for submission_id, user in votes:
+            self.voters[submission_id].add(user)
+            self.choices[user].add(submission_id)
+
+    def add_submission(self, submission_id: int, author: int, voters: Iterable[int] = ()) -> None:
+        """Starts tracking a submission, along with it's stored votes."""
+        self.authors[submission_id] = author
+        self.voters[submission_id] = set(voters)
+        for user in self.voters[submission_id]:
+            self.choices[user].add(submission_id)
+
+    def count(self, submission_id: int) -> int:
+        return len(self.voters[submission_id])
+
+    def apply(self, submission_id: int, user: int, added: bool) -> Tuple[bool, List[ReactionMarker]]:
+        """
+        Applies a single reaction event to the tally.
+
+        Self votes are not counted, and a new vote removes the user's votes on the period's other submissions.
+
+        :return: False if the event disagrees with the tally and the message should be re-scanned, and the reactions to remove.
+        """
+        voters = self.voters[submission_id]
+        if not added:
+            if user not in voters: return False, []
+            self._change(submission_id, user, False)
+            return True, []
+
+        if user == self.authors[submission_id]: return True, [ReactionMarker(message=submission_id, user=user)]
+        if user in voters: return False, []
+
+        cleared = [ReactionMarker(message=other, user=user) for other in sorted(self.choices[user])]
+        for marker in cleared:
+            self._change(marker.message, user, False)
+        self._change(submission_id, user, True)
+        return True, cleared
+
+    def clear(self, submission_id: int) -> int:
+        """Removes every vote on a submission, returning the number removed."""
+        voters = list(self.voters[submission_id])
+        for user in voters:
+            self._change(submission_id, user, False)
+        return len(voters)
+
+    def forget(self, submission_id: int) -> None:
+        """Stops tracking a deleted submission, dropping it's votes and any of their pending changes."""
+        for user in self.voters.pop(submission_id, ()):
+            self.choices[user].discard(submission_id)
+            self.changes.pop((submission_id, user), None)
+        self.authors.pop(submission_id, None)
+
+    def _change(self, submission_id: int, user: int, added: bool) -> None:
+        if added:
+            self.voters[submission_id].add(user)
+            self.choices[user].add(submission_id)
+        else:
+            self.voters[submission_id].discard(user)
+            self.choices[user].discard(submission_id)
+
+        key = (submission_id, user)
+        if key in self.changes:
+            del self.changes[key]  # Undoes a change which was never written.
+        else:
+            self.changes[key] = (self.period_id, added, datetime.utcnow())
+
+    def take(self) -> Dict[Tuple[int, int], Change]:
+        """Returns the pending changes, leaving none pending."""
+        changes, self.changes = self.changes, {}
+        return changes
+
+    def restore(self, changes: Dict[Tuple[int, int], Change]) -> None:
+        """Puts back changes which could not be written, cancelling out any made since that undo them."""
+        for key, change in changes.items():
+            if key[0] not in self.authors: continue
+            newer = self.changes.get(key)
+            if newer is None:
+                self.changes[key] = change
+            elif newer[1] != change[1]:
+                del self.changes[key]
+
+
+class VoteBuffer(object):
+    """
+    Buffers vote changes in memory, writing them behind in batches rather than committing a transaction for every reaction.
+
+    Each voting period's votes are loaded once, then kept up to date in memory as reaction events arrive. Changes are flushed
+    in a single transaction once `interval` seconds have passed since the first one, or straight away once `max_changes` are
+    pending. Anything else which writes votes or ends a period's voting must flush first, using `reset` or `close_period`.
+    """
+
+    def __init__(self, bot: 'ContestBot', interval: float = constants.VOTE_FLUSH_INTERVAL,
+                 max_changes: int = constants.VOTE_FLUSH_CHANGES) -> None:
+        """
+        :param bot: The bot whose database sessions changes are written with.
+        :param interval: Seconds to wait after a change before flushing it.
+        :param max_changes: The number of pending changes which causes a immediate flush.
+        """
+        self.bot = bot
+        self.interval = interval
+        self.max_changes = max_changes
+        self._periods: Dict[int, PeriodVotes] = {}
+        self._submissions: Dict[int, int] = {}  # Submission ID -> Period ID, for every tracked submission
+        self._closed: Set[int] = set()  # Periods no longer accepting votes, which must never be loaded again.
+        self._held: Dict[int, asyncio.Event] = {}  # Periods whose changes are kept pending -> set once they are released
+        self._lock = asyncio.Lock()  # Held while flushing or loading, so a load never reads around a flush in progress.
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._scheduled = False
+        self._tasks: Set[asyncio.Future] = set()
+
+        self._flush_seconds = bot.metrics.histogram('contest_vote_flush_seconds')
+        self._flush_size = bot.metrics.histogram('contest_vote_flush_size', buckets=FLUSH_SIZE_BUCKETS)
+
+    @property
+    def pending(self) -> int:
+        """The number of vote changes waiting to be written."""
+        return sum(len(votes.changes) for votes in self._periods.values())
+
+    @property
+    def _writable(self) -> int:
+        return sum(len(votes.changes) for period_id, votes in self._periods.items() if period_id not in self._held)
+
+    def cached(self, submission_id: int) -> Optional[PeriodVotes]:
+        """Returns the votes of the period a submission belongs to, if they are loaded."""
+        return self._periods.get(self._submissions.get(submission_id))
+
+    async def load(self, submission_id: int) -> Optional[PeriodVotes]:
+        """
+        Returns the votes of the period a submission belongs to, loading them from the database if needed.
+
+        :return: The period's votes, or None if the submission could not be found or it's period is not voting.
+        """
+        async with self._lock:
+            votes = self.cached(submission_id)
+            if votes is not None: return votes
+
+            loaded = await self.bot.run_read(self._read, submission_id)
+            if loaded is None or loaded.period_id in self._closed: return None
+
+            votes = self._periods.get(loaded.period_id)
+            if votes is None:
+                votes = self._periods[loaded.period_id] = loaded
+                logger.debug(f'Loaded votes for period {loaded.period_id} ({len(loaded.authors)} submissions).')
+            else:
+                # Only a submission the period did not have when it was loaded can get here.
+                votes.add_submission(submission_id, loaded.authors[submission_id], loaded.voters[submission_id])
+            for tracked in loaded.authors:
+                if tracked in votes.authors: self._submissions[tracked] = loaded.period_id
+            return votes
+
+    @staticmethod
+    def _read(session: 'Session', submission_id: int) -> Optional[PeriodVotes]:
+        submission: Submission = session.query(Submission).get(submission_id)
+        if submission is None or not submission.period.voting: return None
+
+        period_id = submission.period_id
+        authors = dict(session.query(Submission.id, Submission.user).filter(Submission.period_id == period_id))
+        votes = session.query(Vote.submission_id, Vote.user_id).filter(Vote.period_id == period_id)
+        return PeriodVotes(period_id, authors, votes)
+
+    def changed(self) -> None:
+        """Schedules a flush of the pending changes, which happens immediately if enough are pending."""
+        if self._writable >= self.max_changes:
+            self._start()
+        elif self._timer is None and self._writable > 0:
+            self._timer = self.bot.loop.call_later(self.interval, self._start)
+
+    def _start(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._scheduled: return  # A flush is already waiting to start, and will take these changes too.
+        self._scheduled = True
+        task = asyncio.ensure_future(self._flush_scheduled())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_scheduled(self) -> None:
+        try:
+            await self.flush()
+        except Exception as error:
+            logger.error('Failed to flush buffered votes, they will be retried.', exc_info=error)
+            self.changed()
+
+    async def flush(self) -> int:
+        """
+        Writes every pending change in a single transaction, waiting for any flush already in progress first. Changes to
+        periods which are held are left pending.
+
+        Changes which fail to be written are kept pending, and the error is raised.
+
+        :return: The number of changes written.
+        """
+        async with self._lock:
+            self._scheduled = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            taken = {period_id: votes.take() for period_id, votes in self._periods.items()
+                     if len(votes.changes) > 0 and period_id not in self._held}
+            changes = {key: change for period in taken.values() for key, change in period.items()}
+            if len(changes) == 0: return 0
+
+            started = time.perf_counter()
+            try:
+                await self.bot.run_session(self._write, changes)
+            except Exception:
+                for period_id, period in taken.items():
+                    if period_id in self._periods: self._periods[period_id].restore(period)
+                raise
+
+            self._flush_seconds.observe(time.perf_counter() - started)
+            self._flush_size.observe(len(changes))
+            logger.debug(f'Flushed {len(changes)} vote changes in {(time.perf_counter() - started) * 1000:.1f}ms.')
+            return len(changes)
+
+    @staticmethod
+    def _write(session: 'Session', changes: Dict[Tuple[int, int], Change]) -> None:
+        """Writes vote changes with bulk statements, then re-counts the votes of every submission changed."""
+        removed: Dict[int, List[int]] = defaultdict(list)  # Submission ID -> User IDs
+        added = []
+        for (submission_id, user), (period_id, is_added, timestamp) in changes.items():
+            if is_added:
+                added.append({'submission_id': submission_id, 'user_id': user, 'period_id': period_id, 'timestamp': timestamp})
+            else:
+                removed[submission_id].append(user)
+
+        for submission_id, users in removed.items():
+            session.query(Vote).filter(Vote.submission_id == submission_id, Vote.user_id.in_(users)).delete(synchronize_session=False)
+        if len(added) > 0:
+            # Votes already stored by something writing around the buffer (such as a reconciliation) are skipped.
+            session.execute(Vote.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite'), added)
+
+        # Counts are set on loaded Submissions, rather than with a bulk update, so the leaderboards see them change.
+        changed = {submission_id for submission_id, _ in changes}
+        counts = dict(session.query(Vote.submission_id, func.count(Vote.id))
+                      .filter(Vote.submission_id.in_(changed))
+                      .group_by(Vote.submission_id))
+        for submission in session.query(Submission).filter(Submission.id.in_(changed)):
+            submission.count = counts.get(submission.id, 0)
+
+    async def reset(self, period_id: int) -> None:
+        """
+        Writes out a period's pending changes, then drops it's votes so they are loaded again on the next event.
+
+        Used after the period's votes are changed in the database directly, such as by re-scanning a message.
+        """
+        while True:
+            held = self._held.get(period_id)
+            if held is not None:
+                await held.wait()
+                continue
+            await self.flush()
+            votes = self._periods.get(period_id)
+            if votes is None or len(votes.changes) == 0: break
+
+        votes = self._periods.pop(period_id, None)
+        if votes is not None:
+            for submission_id in votes.authors:
+                self._submissions.pop(submission_id, None)
+
+    @asynccontextmanager
+    async def hold(self, period_id: int) -> AsyncIterator[None]:
+        """
+        Keeps a period's changes pending, though still applied to it's tally, until the block exits.
+
+        Used while the period's votes are rewritten from a snapshot taken before some of those changes, such as by a
+        reconciliation, so the changes are written on top of it afterwards rather than overwritten by it.
+        """
+        while period_id in self._held:
+            await self._held[period_id].wait()
+        released = self._held[period_id] = asyncio.Event()
+        try:
+            yield
+        finally:
+            del self._held[period_id]
+            released.set()
+            self.changed()
+
+    async def close_period(self, period_id: int) -> None:
+        """Stops buffering votes for a period which is leaving the voting state, writing out any still pending."""
+        self._closed.add(period_id)
+        await self.reset(period_id)
+
+    def forget(self, submission_ids: Iterable[int]) -> None:
+        """Stops tracking deleted submissions. Flush afterwards to wait out any flush which may still be writing their votes."""
+        for submission_id in submission_ids:
+            votes = self._periods.get(self._submissions.pop(submission_id, None))
+            if votes is not None: votes.forget(submission_id)
+
+    async def close(self) -> None:
+        """Writes out every pending change, for shutting down."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    def __len__(self) -> int:
+        return len(self._periods)
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TYPE_CHECKING, TypeVar
+
+from bot import constants
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Connection
+    from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+T = TypeVar('T')
+
+
+class DatabaseWriter(object):
+    """
+    Owns the only connection the bot writes to the database with, applying queued write operations one at a time.
+
+    Each operation is a function called with a session bound to that connection, committed once it returns, on a thread of
+    it's own. Operations run in the order they were queued and never overlap, so writers never wait on SQLite's lock (or fail
+    with "database is locked") because of each other, and each caller simply awaits the result of it's own operation.
+    """
+
+    def __init__(self, bot: 'ContestBot', maxsize: int = constants.WRITE_QUEUE_SIZE) -> None:
+        """
+        :param bot: The bot whose engine and sessionmaker are written with.
+        :param maxsize: The number of operations which can be queued before submitting waits for room.
+        """
+        self.bot = bot
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database-writer')
+        self._connection: Optional['Connection'] = None  # Only touched on the writer's thread.
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Queues `func(session, *args, **kwargs)`, waiting for it to be applied and committed.
+
+        `func` runs on the writer's thread and should return plain values rather than ORM objects. If it raises, the
+        transaction is rolled back and the exception is raised here.
+        """
+        if self._task is None: self._task = asyncio.ensure_future(self._run())
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((func, args, kwargs, future))
+        return await future
+
+    async def _run(self) -> None:
+        """Applies queued operations until none are left. The next submission starts it again."""
+        loop = asyncio.get_event_loop()
+        while not self._queue.empty():
+            func, args, kwargs, future = self._queue.get_nowait()
+            try:
+                if future.cancelled(): continue
+                started = time.perf_counter()
+                try:
+                    result = await loop.run_in_executor(self._executor, self._execute, func, args, kwargs)
+                except Exception as error:
+                    if not future.cancelled(): future.set_exception(error)
+                else:
+                    if not future.cancelled(): future.set_result(result)
+                finally:
+                    self.bot.metrics.observe('contest_db_write_seconds', time.perf_counter() - started,
+                                             operation=getattr(func, '__name__', 'unknown'))
+            finally:
+                self._queue.task_done()
+        self._task = None
+
+    def _execute(self, func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        if self._connection is None:
+            self._connection = self.bot.engine.connect()
+        session = self.bot.Session(bind=self._connection)
+        try:
+            result = func(session, *args, **kwargs)
+            session.commit()
+            return result
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _disconnect(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def drain(self) -> None:
+        """Waits for every operation queued so far to be applied."""
+        await self._queue.join()
+
+    async def close(self) -> None:
+        """Waits for every queued operation to be applied, then closes the write connection."""
+        await self.drain()
+        await asyncio.get_event_loop().run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=True)
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
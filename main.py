@@ -1,39 +1,103 @@
+import argparse
 import logging
-
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+import multiprocessing
+from typing import List, Optional, TYPE_CHECKING
 
 from bot import constants
-from bot.bot import ContestBot
-from bot.models import Base
+from bot.startup import StartupTimer
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+initial_extensions = ['bot.cogs.contest_commands',
+                      'bot.cogs.contest_events']
 
 
-def load_db(url=constants.DATABASE_URI) -> Engine:
-    engine = create_engine(url)
-    Base.metadata.create_all(engine)
+def load_db(url=constants.DATABASE_URI, **kwargs) -> 'Engine':
+    from bot.db import create_engine, ensure_schema
+
+    engine = create_engine(url, **kwargs)
+    ensure_schema(engine)
     return engine
 
 
-if __name__ == "__main__":
-    logger = logging.getLogger(__file__)
-    logger.setLevel(constants.LOGGING_LEVEL)
+def shard_groups(shard_count: int, processes: int) -> List[List[int]]:
+    """Splits the shard IDs between processes as evenly as possible, in contiguous groups."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def run(shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None,
+        metrics_port: Optional[int] = constants.METRICS_PORT, immediate: bool = False, profile: bool = False) -> None:
+    """
+    Runs the bot until it is closed.
 
+    :param shard_ids: The shards run by this process. All of them if not given.
+    :param shard_count: The total number of shards. Chosen by Discord if not given.
+    :param metrics_port: The port metrics are served on, or None to not serve them.
+    :param immediate: Whether or not other processes share the database, requiring transactions to take the write lock upfront.
+    :param profile: Whether or not to trace the memory allocated during each phase of startup, as well as their timings.
+    """
+    startup = StartupTimer(memory=profile)
     # noinspection PyArgumentList
-    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] [%(funcName)s] %(message)s',
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] [%(processName)s] [%(funcName)s] %(message)s',
                         handlers=[
                             logging.FileHandler(f"bot.log", encoding='utf-8'),
                             logging.StreamHandler()
                         ])
 
-    initial_extensions = ['bot.cogs.contest_commands',
-                          'bot.cogs.contest_events']
+    # Imported here rather than at module level, so their cost is counted in the startup profile.
+    from bot.bot import ContestBot
+    from bot.db import create_engine, create_read_engine
+    startup.mark('imports')
 
-    engine = load_db()
-    bot = ContestBot(engine, description='A assistant for the Photography Lounge\'s monday contests')
+    engine = create_engine(immediate=immediate)
+    bot = ContestBot(engine, read_engine=create_read_engine(), metrics_port=metrics_port, extensions=initial_extensions, startup=startup, shard_ids=shard_ids,
+                     shard_count=shard_count, description='A assistant for the Photography Lounge\'s monday contests')
+    startup.mark('setup')
 
-    for extension in initial_extensions:
-        bot.load_extension(extension)
-
-    logger.info('Starting bot...')
+    logger.info(f'Starting bot{f" with shards {shard_ids} of {shard_count}" if shard_ids is not None else ""}...')
     with open('token.dat', 'r') as file:
         bot.run(file.read(), bot=True, reconnect=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs the contest bot.')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='The total number of shards. Chosen by Discord if not given.')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='The number of processes to split the shards between. Requires --shards.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Trace the memory allocated during each phase of startup, logged once ready.')
+    args = parser.parse_args()
+
+    if args.processes > 1 and args.shards is None: parser.error('--processes requires --shards.')
+
+    # The schema is checked once, up front, so processes don't race to create it.
+    load_db().dispose()
+
+    if args.processes <= 1:
+        run(shard_ids=list(range(args.shards)) if args.shards is not None else None, shard_count=args.shards,
+            profile=args.profile_startup)
+    else:
+        context = multiprocessing.get_context('spawn')
+        workers = []
+        for index, group in enumerate(shard_groups(args.shards, args.processes)):
+            port = constants.METRICS_PORT + index if constants.METRICS_PORT is not None else None
+            worker = context.Process(target=run, name=f'shards-{group[0]}-{group[-1]}',
+                                     kwargs=dict(shard_ids=group, shard_count=args.shards, metrics_port=port, immediate=True,
+                                                 profile=args.profile_startup))
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,20 @@
+import pytest
+from sqlalchemy.orm import Session, sessionmaker
+
+from main import load_db
+
+
+@pytest.fixture(scope='class')
+def SessionClass():
+    engine = load_db('sqlite:///')
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture(scope='function')
+def session(SessionClass: sessionmaker):
+    s: Session = SessionClass()
+    try:
+        yield s
+    finally:
+        s.close()
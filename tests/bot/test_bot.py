@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.bot import ContestBot
+from bot.models import Guild, Period, Submission
+from bot.startup import StartupTimer
+from main import load_db
+
+
+class FakeChannel(object):
+    """A submission channel whose history is served in pages of 100, like Discord's."""
+
+    def __init__(self, message_ids):
+        self.id = 100
+        self.messages = [SimpleNamespace(id=message_id, reactions=[]) for message_id in sorted(message_ids)]
+        self.pages = 0
+
+    def history(self, limit=None, after=None, oldest_first=True):
+        async def iterator():
+            remaining = [message for message in self.messages if after is None or message.id > after.id]
+            for start in range(0, len(remaining), 100):
+                self.pages += 1
+                for message in remaining[start:start + 100]:
+                    yield message
+
+        return iterator()
+
+
+def make_bot(monkeypatch, channel: FakeChannel) -> ContestBot:
+    bot = ContestBot(load_db('sqlite:///'))
+    monkeypatch.setattr(bot, 'get_channel', lambda channel_id: channel)
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_fetch_messages(monkeypatch) -> None:
+    channel = FakeChannel(range(1, 1001))
+    bot = make_bot(monkeypatch, channel)
+
+    # Starts at the oldest ID and stops once everything has been found
+    wanted = list(range(401, 601, 2))
+    found = await bot.fetch_messages(channel.id, wanted)
+    assert sorted(found) == wanted
+    assert all(found[message_id].id == message_id for message_id in found)
+    assert channel.pages == 2
+
+    # Messages which no longer exist are left out, without reading past the newest ID
+    channel = FakeChannel([message_id for message_id in range(1, 1001) if message_id != 450])
+    bot = make_bot(monkeypatch, channel)
+    assert sorted(await bot.fetch_messages(channel.id, [449, 450, 451])) == [449, 451]
+    assert channel.pages == 1
+
+
+@pytest.mark.asyncio
+async def test_get_submission_messages(monkeypatch) -> None:
+    channel = FakeChannel([10, 11, 13])
+    bot = make_bot(monkeypatch, channel)
+
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=channel.id)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period] + [Submission(id=i, user=i, period=period) for i in (10, 11, 12, 13)])
+        session.flush()
+
+        pairs = await period.get_submission_messages(bot)
+        assert [(submission.id, message.id if message else None) for submission, message in pairs] == \
+               [(10, 10), (11, 11), (12, None), (13, 13)]
+        assert channel.pages == 1
+
+
+@pytest.mark.asyncio
+async def test_extensions_load_on_connect() -> None:
+    timer = StartupTimer()
+    bot = ContestBot(load_db('sqlite:///'), extensions=['bot.cogs.contest_events'], startup=timer)
+    assert len(bot.cogs) == 0
+
+    await bot.on_connect()
+    await bot.on_connect()
+    assert list(bot.cogs) == ['ContestEventsCog']
+    assert [phase.name for phase in timer.phases] == ['connect', 'extensions']
+
+    bot.finish_startup()
+    assert bot.startup is None and timer.phases[-1].name == 'ready'
+    assert bot.metrics.gauges['contest_startup_seconds'][1]() == sum(phase.seconds for phase in timer.phases)
+    bot.database_executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_guild_config(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    with bot.get_session() as session:
+        session.add(Guild(id=1, prefix='!', submission_channel=10))
+    assert await bot.guild_config(None) is None and await bot.guild_config(2) is None
+
+    # Cache misses are read on a database thread, and cached unless a newer configuration was stored meanwhile
+    run_read, reads = bot.run_read, []
+
+    async def counted_read(func, *args):
+        reads.append(args)
+        config = await run_read(func, *args)
+        if len(reads) == 2: bot.guild_cache.store(config._replace(prefix='?'))
+        return config
+
+    monkeypatch.setattr(bot, 'run_read', counted_read)
+    assert (await bot.guild_config(1)).prefix == '!' and await bot.is_submission_channel(1, 10)
+    assert len(reads) == 1
+
+    bot.guild_cache.invalidate(1)
+    assert (await bot.guild_config(1)).prefix == '?' and bot.guild_cache.get(1).prefix == '?'
+    bot.database_executor.shutdown()
@@ -0,0 +1,114 @@
+from sqlalchemy.orm import Session
+
+from bot.cache import ExpiringSet, GuildCache, shard_id
+from bot.models import Guild, Period, PeriodStates
+
+
+def test_guild_cache_load(session: Session) -> None:
+    active, inactive = Guild(id=1, prefix='!', submission_channel=10), Guild(id=2, active=False)
+    session.add_all([active, inactive])
+    session.commit()
+
+    cache = GuildCache()
+    assert cache.load(session) == 1
+    assert 1 in cache and 2 not in cache
+
+    config = cache.get(1)
+    assert config.prefix == '!'
+    assert config.submission_channel == 10
+    assert config.period_id is None and config.period_state is None and not config.period_active
+
+
+def test_guild_cache_fill(session: Session) -> None:
+    session.add_all([Guild(id=1, prefix='!'), Guild(id=2), Guild(id=3, active=False)])
+    session.commit()
+
+    cache = GuildCache()
+    configs = cache.read(session)
+    assert [config.id for config in configs] == [1, 2] and len(cache) == 0
+
+    # Guilds cached while the others were read keep their newer entry
+    cache.store(configs[0]._replace(prefix='?'))
+    assert cache.fill(configs) == 1
+    assert cache.get(1).prefix == '?' and cache.get(2).prefix == '$'
+
+
+def test_guild_cache_update(session: Session) -> None:
+    guild = Guild(id=1, submission_channel=10)
+    session.add(guild)
+    session.commit()
+
+    cache = GuildCache()
+    cache.update(guild)
+    assert cache.get(1).prefix == '$'
+
+    period = Period(id=1, guild=guild)
+    session.add(period)
+    session.commit()
+    guild.current_period = period
+    period.advance_state()
+    session.commit()
+
+    cache.update(guild)
+    config = cache.get(1)
+    assert config.period_id == 1
+    assert config.period_state == PeriodStates.SUBMISSIONS
+    assert config.period_active
+
+    cache.invalidate(1)
+    assert cache.get(1) is None and len(cache) == 0
+
+
+def test_guild_cache_shards(session: Session) -> None:
+    guilds = [Guild(id=guild_id << 22) for guild_id in range(1, 7)]  # Guild N lands on shard N % 3
+    session.add_all(guilds)
+    session.commit()
+    assert [shard_id(guild.id, 3) for guild in guilds] == [1, 2, 0, 1, 2, 0]
+
+    cache = GuildCache(shard_count=3)
+    assert cache.load(session, shard_ids=[0, 2]) == 4
+    assert cache.shard_sizes() == {0: 2, 2: 2}
+    assert (1 << 22) not in cache and (3 << 22) in cache
+
+    cache.invalidate_shard(2)
+    assert len(cache) == 2 and cache.get(2 << 22) is None
+    assert cache.load(session, shard_ids=[2]) == 2 and len(cache) == 4
+
+    cache.resize(2)
+    assert len(cache) == 0
+    assert cache.load(session) == 6 and cache.shard_sizes() == {0: 3, 1: 3}
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_expiring_set() -> None:
+    clock = FakeClock()
+    expected = ExpiringSet(ttl=10, maxsize=3, clock=clock)
+
+    expected.add(1)
+    expected.add((2, 3))
+    assert 1 in expected and (2, 3) in expected and 4 not in expected
+    assert expected.consume(1) and not expected.consume(1)
+    assert (expected.hits, expected.misses) == (1, 1)
+
+    # Entries which never see their event expire instead of lingering
+    clock.now = 11
+    assert (2, 3) not in expected
+    assert len(expected) == 0 and expected.expirations == 1
+
+    # A per-entry time-to-live overrides the default
+    expected.add(5, ttl=1)
+    expected.add(6)
+    clock.now = 12.5
+    assert not expected.consume(5) and expected.consume(6)
+
+    # The oldest entries are evicted once full
+    for item in range(10, 15): expected.add(item)
+    assert len(expected) == 3 and 10 not in expected and 14 in expected
+    assert expected.stats()['evictions'] == 2
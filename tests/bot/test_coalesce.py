@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from bot.coalesce import EventCoalescer
+
+
+@pytest.mark.asyncio
+async def test_coalescer_batches_per_key() -> None:
+    batches = []
+
+    async def handler(key, events) -> None:
+        batches.append((key, events))
+
+    coalescer = EventCoalescer(handler, window=0.01, workers=2)
+    for event in range(5):
+        coalescer.submit('a', event)
+        coalescer.submit('b', -event)
+    assert coalescer.depth == 10
+
+    await coalescer.drain()
+    assert sorted(batches) == [('a', [0, 1, 2, 3, 4]), ('b', [0, -1, -2, -3, -4])]
+    assert coalescer.depth == 0
+
+
+@pytest.mark.asyncio
+async def test_coalescer_ordering_and_workers() -> None:
+    handled, running, peak = [], [0], [0]
+
+    async def handler(key, events) -> None:
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.02)
+        handled.append((key, events))
+        running[0] -= 1
+
+    coalescer = EventCoalescer(handler, window=0.01, workers=2)
+    for key in range(6): coalescer.submit(key, 'first')
+
+    # Events arriving while a key's batch is running wait for the next batch of that key
+    await asyncio.sleep(0.015)
+    coalescer.submit(0, 'second')
+    await coalescer.drain()
+
+    assert peak[0] == 2
+    assert [events for key, events in handled if key == 0] == [['first'], ['second']]
+    assert len(handled) == 7
+
+
+@pytest.mark.asyncio
+async def test_coalescer_handler_errors() -> None:
+    seen = []
+
+    async def handler(key, events) -> None:
+        seen.append(key)
+        raise RuntimeError('Handler failure')
+
+    coalescer = EventCoalescer(handler, window=0)
+    coalescer.submit(1, None)
+    coalescer.submit(2, None)
+    await coalescer.drain()
+    assert sorted(seen) == [1, 2]
@@ -0,0 +1,48 @@
+import asyncio
+import io
+
+import pytest
+
+from tests import fakes
+from bot import collage
+from bot.bot import ContestBot
+from bot.collage import CollageRenderer, Entry
+from main import load_db
+
+
+def test_render() -> None:
+    Image = pytest.importorskip('PIL.Image')
+    entries = [Entry(1, 10, 100, 5), Entry(2, 11, 101, 3), Entry(2, 12, 102, 3)]
+    data = collage.render([fakes.image(1), None, b'not a image'], entries, tile=64, columns=2)
+
+    with Image.open(io.BytesIO(data)) as rendered:
+        assert rendered.format == 'JPEG' and rendered.size == (128, 128)
+
+
+@pytest.mark.asyncio
+async def test_collage_renderer() -> None:
+    pytest.importorskip('PIL')
+    bot = ContestBot(load_db('sqlite:///'))
+    fake = fakes.FakeDiscord()
+    fake.attach(bot)
+    channel = fake.channel(100, 1)
+    attachments = [fakes.FakeAttachment(width=320, data=fakes.image(seed)) for seed in range(3)]
+    attachments.append(fakes.FakeAttachment(width=320, data=fakes.image(3), size=10 ** 9))
+    for message_id, attachment in enumerate(attachments, start=10):
+        channel.add(message_id, author_id=message_id * 10, attachments=[attachment])
+
+    # Rendered in a real process pool, once, however many times it is asked for at once
+    renderer = CollageRenderer(bot, maxsize=1, max_bytes=10 ** 6)
+    entries = [Entry(position, message_id, message_id * 10, 10 - position) for position, message_id in enumerate(range(10, 15), 1)]
+    first, second = await asyncio.gather(renderer.get(1, 100, entries), renderer.get(1, 100, entries))
+    assert first == second and first.startswith(b'\xff\xd8')
+    assert [attachment.reads for attachment in attachments] == [1, 1, 1, 0]  # The oversized attachment is never downloaded
+
+    # Served from the cache afterwards, until evicted by another period
+    assert await renderer.get(1, 100, entries) == first and attachments[0].reads == 1
+    await renderer.get(2, 100, entries[:1])
+    assert len(renderer) == 1 and attachments[0].reads == 2
+    assert await renderer.get(3, 100, []) is None
+
+    renderer.shutdown()
+    bot.database_executor.shutdown()
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from tests import fakes
+from bot.bot import ContestBot
+from bot.cogs.contest_commands import ContestCommandsCog
+from bot.models import Guild, Period, PeriodStates, Result, Submission
+from main import load_db
+
+
+@pytest.mark.asyncio
+async def test_close() -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    fake = fakes.FakeDiscord()
+    fake.attach(bot)
+    channel = fake.channel(100, 1)
+    cog = ContestCommandsCog(bot)
+    ctx = SimpleNamespace(guild=SimpleNamespace(id=1), channel=channel, send=channel.send)
+
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=guild, state=PeriodStates.VOTING)
+        session.add_all([guild, period, Submission(id=10, user=100, period=period), Submission(id=11, user=101, period=period)])
+        session.commit()
+        guild.current_period = period
+        bot.guild_cache.update(guild)
+
+    # A vote still buffered when the period is closed is written before the results are recorded
+    votes = await bot.vote_buffer.load(11)
+    assert votes.apply(11, 5, added=True) == (True, [])
+    await cog.close.callback(cog, ctx)
+
+    config = await bot.guild_config(1)
+    assert config.period_id == 1 and not config.period_active
+    with bot.get_session() as session:
+        assert [(result.submission_id, result.position, result.count) for result in session.query(Result).order_by(Result.position)] == \
+               [(11, 1, 1), (10, 2, 0)]
+    assert channel.sent[0]['embed'].description.endswith('The current period has been closed.')
+    assert channel.sent[1]['embed'].title == 'Results'
+
+    # Once closed, there is nothing left to close
+    await cog.close.callback(cog, ctx)
+    assert channel.sent[2]['embed'].description.endswith('No period is currently active.')
+
+    bot.collages.shutdown()
+    bot.database_executor.shutdown()
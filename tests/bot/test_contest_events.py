@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from tests import fakes
+from bot import duplicates
+from bot.bot import ContestBot
+from bot.cogs.contest_events import ContestEventsCog
+from bot.models import Guild, Period, Submission
+from main import load_db
+
+
+def accepting_submissions(bot: ContestBot) -> fakes.FakeChannel:
+    """Starts guild 1's period and opens it for submissions, returning it's submission channel."""
+    fake = fakes.FakeDiscord()
+    fake.attach(bot)
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period])
+        session.commit()
+        guild.current_period = period
+        period.advance_state()
+        bot.guild_cache.update(guild)
+    return fake.channel(100, 1)
+
+
+def stored(bot: ContestBot) -> list:
+    with bot.get_session() as session:
+        return [(submission.id, submission.user) for submission in session.query(Submission).order_by(Submission.id)]
+
+
+@pytest.mark.asyncio
+async def test_on_message(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    channel = accepting_submissions(bot)
+    cog = ContestEventsCog(bot)
+
+    # Messages without exactly one image are rejected
+    for message_id, attachments in ((10, []), (11, [fakes.FakeAttachment(width=100)] * 2), (12, [fakes.FakeAttachment()])):
+        await cog.on_message(channel.add(message_id, author_id=5, attachments=attachments))
+    assert stored(bot) == [] and len(channel.messages) == 0 and len(channel.sent) == 3
+
+    # Two submissions sent at once by the same user both see no earlier submission, but only one of them is kept
+    reads, both_read = [], asyncio.Event()
+    run_read = bot.run_read
+
+    async def racing_read(*args):
+        result = await run_read(*args)
+        reads.append(result)
+        if len(reads) == 2: both_read.set()
+        await both_read.wait()
+        return result
+
+    monkeypatch.setattr(bot, 'run_read', racing_read)
+    first, second = (channel.add(message_id, author_id=5, attachments=[fakes.FakeAttachment(width=100)]) for message_id in (20, 21))
+    await asyncio.gather(cog.on_message(first), cog.on_message(second))
+    monkeypatch.setattr(bot, 'run_read', run_read)
+
+    assert reads == [(None, None), (None, None)]
+    [(kept, _)] = stored(bot)
+    replaced = ({20, 21} - {kept}).pop()
+    assert list(channel.messages) == [kept] and replaced in bot.expected_msg_deletions
+
+    # A later submission replaces the kept one, leaving other users' submissions alone
+    await cog.on_message(channel.add(30, author_id=6, attachments=[fakes.FakeAttachment(width=100)]))
+    await cog.on_message(channel.add(31, author_id=5, attachments=[fakes.FakeAttachment(width=100)]))
+    assert stored(bot) == [(30, 6), (31, 5)]
+    assert list(channel.messages) == [30, 31]
+
+    bot.database_executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_on_message_duplicates() -> None:
+    pytest.importorskip('PIL')
+    bot = ContestBot(load_db('sqlite:///'))
+    channel = accepting_submissions(bot)
+    cog = ContestEventsCog(bot)
+
+    await cog.on_message(channel.add(10, author_id=5, attachments=[fakes.FakeAttachment(width=320, data=fakes.image(1))]))
+    # A resized copy from another user is rejected, while a different image is indexed once it is stored
+    await cog.on_message(channel.add(11, author_id=6, attachments=[fakes.FakeAttachment(width=160, data=fakes.image(1, size=(160, 120)))]))
+    await cog.on_message(channel.add(12, author_id=6, attachments=[fakes.FakeAttachment(width=320, data=fakes.image(2))]))
+    assert stored(bot) == [(10, 5), (12, 6)]
+    assert list(channel.messages) == [10, 12] and len(channel.sent) == 1
+
+    with bot.read_session() as session:
+        match = bot.duplicates.find(session, 1, duplicates.dhash(fakes.image(2)))
+    assert match is not None and match.submission.id == 12
+
+    bot.image_executor.shutdown()
+    bot.database_executor.shutdown()
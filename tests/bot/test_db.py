@@ -1,33 +1,18 @@
 import random
 from itertools import count
-from typing import Generator
+from typing import Dict, Generator
 
 import pytest
+from sqlalchemy import func, inspect
 from sqlalchemy.orm import Session, sessionmaker
 
 from bot import exceptions
-from bot.models import Guild, Period, PeriodStates, Submission
-from main import load_db
+from bot.constants import ReactionMarker
+from bot.models import Guild, Period, PeriodStates, Result, Submission, Vote
 
 numbers = count()
 
 
-@pytest.fixture(scope='class')
-def SessionClass():
-    engine = load_db('sqlite:///')
-    yield sessionmaker(bind=engine)
-    engine.dispose()
-
-
-@pytest.fixture(scope='function')
-def session(SessionClass: sessionmaker):
-    s: Session = SessionClass()
-    try:
-        yield s
-    finally:
-        s.close()
-
-
 def test_submission_increment(session: Session):
     sub = Submission(id=1, user=1)
     session.bulk_save_objects([sub])
@@ -109,6 +94,43 @@ def test_advance_state(session: Session) -> None:
     assert not per2.active and not per2.completed
 
 
+def test_period_finalize(session: Session) -> None:
+    guild = Guild(id=1)
+    period = Period(id=1, guild=guild)
+    session.add(period)
+    session.commit()
+    for _ in range(3): period.advance_state()
+    session.add_all([Submission(id=1, user=1, period=period, votes=[2]),
+                     Submission(id=2, user=2, period=period, votes=[1, 3]),
+                     Submission(id=3, user=3, period=period, votes=[4]),
+                     Submission(id=4, user=4, period=period)])
+    session.commit()
+
+    period.advance_state()
+    session.commit()
+    standings = [(result.position, result.submission_id, result.user_id, result.count) for result in period.results]
+    assert standings == [(1, 2, 2, 2), (2, 1, 1, 1), (2, 3, 3, 1), (3, 4, 4, 0)]
+
+    # Results are recorded once and never re-counted
+    period.submissions[3].votes = [1, 2, 3]
+    assert period.finalize() is period.results
+    assert [result.count for result in period.results] == [2, 1, 1, 0]
+    assert session.query(Result).count() == 4
+
+    # Closing a period early only records results once voting has started
+    voting, paused = Period(id=2, guild=guild), Period(id=3, guild=guild)
+    session.add_all([voting, paused])
+    session.commit()
+    for _ in range(3): voting.advance_state()
+    for _ in range(2): paused.advance_state()
+    session.add_all([Submission(id=5, user=1, period=voting), Submission(id=6, user=1, period=paused)])
+    voting.deactivate()
+    paused.deactivate()
+    session.commit()
+    assert [result.submission_id for result in voting.results] == [5]
+    assert paused.results == []
+
+
 def test_submission_clear_other_votes(session: Session) -> None:
     guild = Guild(id=1)
     per = Period(id=1, guild=guild)
@@ -129,6 +151,64 @@ def test_submission_clear_other_votes(session: Session) -> None:
     assert sub3.votes == [3]
 
 
+def test_submission_clear_votes_period_scoped(session: Session) -> None:
+    guild = Guild(id=1)
+    old, new = Period(id=1, guild=guild), Period(id=2, guild=guild)
+    old_sub = Submission(id=1, user=1, period=old)
+    sub1 = Submission(id=2, user=2, period=new)
+    sub2 = Submission(id=3, user=3, period=new)
+    session.add_all([guild, old, new, old_sub, sub1, sub2])
+    session.commit()
+
+    old_sub.votes = [4, 5]
+    sub1.votes = [4, 5, 6]
+    sub2.votes = [4]
+    session.commit()
+
+    found = Submission.clear_votes(session, new.id, users=[4, 5], ignore=[sub2.id])
+    assert sorted(found) == [ReactionMarker(message=2, user=4), ReactionMarker(message=2, user=5)]
+    assert sub1.votes == [6] and sub1.count == 1
+    assert sub2.votes == [4]
+    assert old_sub.votes == [4, 5]
+
+    session.commit()
+    assert stored_counts(session, new.id) == {2: 1, 3: 1}
+
+
+def stored_counts(session: Session, period_id: int) -> Dict[int, int]:
+    """The number of Vote rows stored for each of a period's submissions."""
+    return dict(session.query(Vote.submission_id, func.count(Vote.id)).filter(Vote.period_id == period_id).group_by(Vote.submission_id))
+
+
+def test_submission_vote_rows(session: Session) -> None:
+    guild = Guild(id=1)
+    per = Period(id=1, guild=guild)
+    sub1 = Submission(id=1, user=1, period=per)
+    sub2 = Submission(id=2, user=2, period=per)
+    session.add_all([guild, per, sub1, sub2])
+    session.commit()
+
+    sub1.increment(2)
+    sub1.increment(3)
+    sub2.increment(3)
+    # Votes are checked and written by their own key, never loading the rest of the submission's votes
+    assert '_votes' in inspect(sub1).unloaded
+    with pytest.raises(exceptions.DatabaseDoubleVoteException):
+        sub1.increment(2)
+    session.commit()
+
+    assert session.query(Vote).filter_by(period_id=per.id).count() == 3
+    assert stored_counts(session, per.id) == {1: 2, 2: 1}
+
+    sub1.decrement(2)
+    with pytest.raises(exceptions.DatabaseNoVoteException):
+        sub1.decrement(2)
+    assert '_votes' in inspect(sub1).unloaded
+    session.commit()
+    assert session.query(Vote).filter_by(submission_id=sub1.id).one().user_id == 3
+    assert sub1.count == 1 and sub1.votes == [3]
+    assert stored_counts(session, per.id) == {1: 1, 2: 1}
+
 
 
 @pytest.fixture()
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+from sqlalchemy.orm import Session
+
+from tests import fakes
+from bot.duplicates import DuplicateIndex, HashIndex, HashedSubmission, dhash, hamming
+from bot.models import Guild, Period, Submission
+
+
+def test_dhash() -> None:
+    pytest.importorskip('PIL')
+    original = dhash(fakes.image(1))
+    assert original is not None and 0 <= original < 1 << 64
+
+    # Resized and recompressed copies stay close, while other images do not
+    assert hamming(original, dhash(fakes.image(1, size=(160, 120), image_format='JPEG', quality=60))) <= 6
+    assert min(hamming(original, dhash(fakes.image(seed))) for seed in range(2, 12)) > 12
+    assert dhash(b'not a image') is None
+
+
+def test_hash_index() -> None:
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    index = HashIndex(radius=8)
+    for position, value in enumerate(hashes):
+        index.add(value, position)
+    index.add(hashes[0], 'copy')
+    assert len(index) == 2001
+
+    # Every hash within the radius is found, exactly as comparing against each would
+    for query in hashes[:20] + [value ^ 0b1011_0110_1 for value in hashes[20:40]]:
+        expected = sorted((hamming(query, value), position) for position, value in enumerate(hashes) if hamming(query, value) <= 8)
+        found = [pair for pair in index.search(query) if pair[1] != 'copy']
+        assert sorted(found) == expected
+
+    assert index.search(hashes[0], 0) == [(0, 0), (0, 'copy')]
+    assert HashIndex().search(0) == []
+    with pytest.raises(ValueError):
+        index.search(0, 9)
+
+
+def test_duplicate_index(session: Session) -> None:
+    guild, other = Guild(id=1), Guild(id=2)
+    old, current = Period(id=1, guild=guild), Period(id=2, guild=guild)
+    session.add_all([guild, other, old, current, Period(id=3, guild=other)])
+    session.add_all([Submission(id=10, user=100, period=old, phash=0xFFFF_0000_FFFF_0000),
+                     Submission(id=11, user=101, period=old, phash=0x1234),
+                     Submission(id=12, user=102, period_id=3, phash=0x1234),
+                     Submission(id=13, user=103, period=old)])
+    session.commit()
+
+    # Hashes with the top bit set survive the round trip through SQLite's signed integers
+    assert session.query(Submission).get(10).phash == 0xFFFF_0000_FFFF_0000
+
+    index = DuplicateIndex(radius=4)
+    match = index.find(session, 1, 0xFFFF_0000_FFFF_0007, user=200, period_id=2)
+    assert match.distance == 3 and match.submission == HashedSubmission(id=10, user=100, period_id=1)
+    assert index.find(session, 1, 0xFFFF_FFFF_FFFF_FFFF) is None
+    assert len(index) == 2  # Only this guild's hashed submissions
+
+    # A user replacing their own submission in the same period is not a duplicate, but resubmitting old work is
+    index.add(1, 0xABCD, HashedSubmission(id=14, user=104, period_id=2))
+    assert index.find(session, 1, 0xABCD, user=104, period_id=2) is None
+    assert index.find(session, 1, 0xABCD, user=104, period_id=3).submission.id == 14
+
+    index.remove(1, [10])
+    assert index.find(session, 1, 0xFFFF_0000_FFFF_0000) is None
+    index.invalidate(1)
+    assert index.find(session, 1, 0x1234).submission.id == 11
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+
+import pytest
+import sqlalchemy
+
+from bot import constants
+from bot.bot import ContestBot
+from bot.db import create_engine, create_read_engine, ensure_schema
+from bot.models import Base, Guild
+from main import shard_groups
+
+
+def test_sqlite_pragmas(tmp_path) -> None:
+    engine = create_engine(f'sqlite:///{tmp_path / "database.db"}')
+    with engine.connect() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.execute('PRAGMA synchronous').scalar() == 1  # NORMAL
+        assert connection.execute('PRAGMA cache_size').scalar() == -constants.SQLITE_CACHE_SIZE
+    engine.dispose()
+
+
+def test_read_engine(tmp_path) -> None:
+    path = tmp_path / 'data base.db'
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    reader = create_read_engine(f'sqlite:///{path}')
+
+    # Reads see whatever has been committed, but can never write
+    with engine.begin() as connection:
+        connection.execute(Guild.__table__.insert().values(id=1))
+    with reader.connect() as connection:
+        assert connection.execute('SELECT COUNT(*) FROM guild').scalar() == 1
+        with pytest.raises(sqlalchemy.exc.OperationalError, match='readonly'):
+            connection.execute(Guild.__table__.insert().values(id=2))
+
+    # In-memory databases can not be opened a second time, so they share the write engine
+    with pytest.raises(ValueError):
+        create_read_engine('sqlite:///')
+    reader.dispose()
+    engine.dispose()
+
+
+def test_begin_immediate(tmp_path) -> None:
+    path = tmp_path / 'database.db'
+    engine = create_engine(f'sqlite:///{path}', immediate=True)
+    Base.metadata.create_all(engine)
+
+    # Even a transaction which has only read holds the write lock, so other processes wait on it rather than failing later.
+    with engine.begin() as connection:
+        connection.execute('SELECT 1')
+        other = sqlite3.connect(str(path), timeout=0)
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            other.execute('INSERT INTO guild (id, prefix, active) VALUES (1, \'$\', 1)')
+        other.close()
+
+    with engine.begin() as connection:
+        connection.execute(Guild.__table__.insert().values(id=2))
+    with engine.connect() as connection:
+        assert connection.execute('SELECT COUNT(*) FROM guild').scalar() == 1
+    engine.dispose()
+
+
+def test_ensure_schema(tmp_path) -> None:
+    engine = create_engine(f'sqlite:///{tmp_path / "database.db"}')
+
+    # A empty database is created and stamped at head, so the next start skips creation
+    assert ensure_schema(engine)
+    with engine.connect() as connection:
+        assert connection.execute('SELECT version_num FROM alembic_version').scalar() is not None
+    assert not ensure_schema(engine)
+
+    # Databases with tables but no revision are never stamped
+    legacy = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.tables['guild'].create(legacy)
+    assert ensure_schema(legacy) and ensure_schema(legacy)
+    assert 'alembic_version' not in sqlalchemy.inspect(legacy).get_table_names()
+    engine.dispose()
+    legacy.dispose()
+
+
+def test_shard_groups() -> None:
+    assert shard_groups(4, 1) == [[0, 1, 2, 3]]
+    assert shard_groups(5, 2) == [[0, 1, 2], [3, 4]]
+    assert shard_groups(2, 4) == [[0], [1]]
+
+
+@pytest.mark.asyncio
+async def test_owns_guild() -> None:
+    engine = create_engine('sqlite:///')
+    assert ContestBot(engine).owns_guild(1)
+
+    bot = ContestBot(engine, shard_ids=[1, 2], shard_count=3)
+    assert bot.owns_guild(1 << 22) and bot.owns_guild(5 << 22) and not bot.owns_guild(3 << 22)
+    assert bot.guild_cache.shard_count == 3
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_run_session(tmp_path) -> None:
+    engine = create_engine(f'sqlite:///{tmp_path / "database.db"}')
+    Base.metadata.create_all(engine)
+    bot = ContestBot(engine)
+
+    def add_guild(session, guild_id):
+        session.add(Guild(id=guild_id, prefix='!'))
+        return threading.current_thread().name
+
+    thread = await bot.run_session(add_guild, 1)
+    assert thread.startswith('database')
+    assert await bot.run_session(lambda session: session.query(Guild).get(1).prefix) == '!'
+
+    bot.database_executor.shutdown()
+    engine.dispose()
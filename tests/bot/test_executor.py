@@ -0,0 +1,78 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from bot.executor import BulkExecutor
+
+DELAY = 0.02  # Simulated latency of a single Discord HTTP request
+
+
+class FakeHTTP(object):
+    """A mocked Discord HTTP layer which sleeps for every request and fails selected items a number of times."""
+
+    def __init__(self, failures=None, status=503):
+        self.failures = dict(failures or {})
+        self.status = status
+        self.calls = 0
+        self.running = self.peak = 0
+
+    async def request(self, item) -> bool:
+        self.calls += 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(DELAY)
+            if self.failures.get(item, 0) > 0:
+                self.failures[item] -= 1
+                raise discord.HTTPException(SimpleNamespace(status=self.status, reason='Mocked'), 'Mocked failure')
+            return item % 5 != 0
+        finally:
+            self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_executor_speedup() -> None:
+    items = list(range(1, 41))
+
+    serial = FakeHTTP()
+    start = time.perf_counter()
+    for item in items: await serial.request(item)
+    serial_time = time.perf_counter() - start
+
+    http = FakeHTTP()
+    start = time.perf_counter()
+    result = await BulkExecutor(concurrency=8, bucket_concurrency=8).run(items, http.request)
+    bulk_time = time.perf_counter() - start
+
+    assert result.completed == 32 and result.skipped == 8 and result.failed == 0
+    assert http.peak == 8
+    assert bulk_time * 4 < serial_time
+
+
+@pytest.mark.asyncio
+async def test_bulk_executor_buckets_and_progress() -> None:
+    http = FakeHTTP()
+    reports = []
+
+    async def progress(done, total) -> None:
+        reports.append((done, total))
+
+    await BulkExecutor(concurrency=8, bucket_concurrency=2).run(range(10), http.request, bucket=lambda _: 'channel',
+                                                               progress=progress)
+    assert http.peak == 2
+    assert reports[-1] == (10, 10) and len(reports) == 10
+
+
+@pytest.mark.asyncio
+async def test_bulk_executor_retries() -> None:
+    http = FakeHTTP(failures={1: 2, 2: 5})
+    result = await BulkExecutor(retries=3, backoff=0).run([1, 2, 3], http.request)
+    assert result.completed == 2 and result.failed == 1
+    assert http.calls == 3 + 4 + 1
+
+    http = FakeHTTP(failures={1: 1}, status=403)
+    result = await BulkExecutor(retries=3, backoff=0).run([1], http.request)
+    assert result.failed == 1 and http.calls == 1
@@ -0,0 +1,69 @@
+import csv
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import Session
+
+from bot import export
+from bot.models import Guild, Period, PeriodStates, Submission, Vote
+
+
+def populate(session: Session) -> None:
+    for guild_id in (1, 2):
+        session.add(Guild(id=guild_id, submission_channel=guild_id * 10))
+        for month in (1, 2, 3):
+            period_id = guild_id * 10 + month
+            session.add(Period(id=period_id, guild_id=guild_id, state=PeriodStates.FINISHED, start_time=datetime(2021, month, 1)))
+            session.add(Submission(id=period_id * 10, user=5, period_id=period_id, count=2, phash=(1 << 64) - month))
+            session.add_all([Vote(submission_id=period_id * 10, user_id=user_id, period_id=period_id) for user_id in (6, 7)])
+    session.commit()
+    session.expunge_all()
+
+
+def test_export_csv(session: Session, tmp_path) -> None:
+    populate(session)
+    counts = export.export(session, str(tmp_path), 'csv', guild_id=1, since=datetime(2021, 2, 1), until=datetime(2021, 3, 1),
+                           batch=1)
+    assert counts == {'guild': 1, 'period': 1, 'submission': 1, 'vote': 2}
+    assert len(session.identity_map) == 0  # Rows are never loaded as objects
+
+    with open(tmp_path / 'period.csv', newline='') as file:
+        periods = list(csv.DictReader(file))
+    assert [(row['id'], row['guild_id'], row['state'], row['start_time']) for row in periods] == \
+           [('12', '1', 'FINISHED', '2021-02-01T00:00:00')]
+    with open(tmp_path / 'submission.csv', newline='') as file:
+        assert next(csv.DictReader(file))['phash'] == str((1 << 64) - 2)
+
+    path = export.archive(str(tmp_path))
+    with zipfile.ZipFile(path) as archive:
+        assert archive.namelist() == ['guild.csv', 'period.csv', 'submission.csv', 'vote.csv']
+
+
+def test_export_jsonl(session: Session, tmp_path) -> None:
+    populate(session)
+    assert export.export(session, str(tmp_path), 'jsonl')['vote'] == 12
+
+    with open(tmp_path / 'vote.jsonl') as file:
+        votes = [json.loads(line) for line in file]
+    assert {vote['period_id'] for vote in votes} == {11, 12, 13, 21, 22, 23}
+    assert set(votes[0]) == {'id', 'submission_id', 'user_id', 'period_id', 'timestamp'}
+
+    # Empty selections still write a file for every table
+    assert set(export.export(session, str(tmp_path / 'empty'), 'jsonl', guild_id=3).values()) == {0}
+    assert len(os.listdir(tmp_path / 'empty')) == 4
+    with pytest.raises(ValueError):
+        export.export(session, str(tmp_path), 'xml')
+
+
+def test_export_parquet(session: Session, tmp_path) -> None:
+    parquet = pytest.importorskip('pyarrow.parquet')
+    populate(session)
+    export.export(session, str(tmp_path), 'parquet', guild_id=2, batch=2)
+
+    table = parquet.read_table(str(tmp_path / 'submission.parquet'))
+    assert table.column('id').to_pylist() == [210, 220, 230]
+    assert table.column('phash').to_pylist() == [(1 << 64) - 1, (1 << 64) - 2, (1 << 64) - 3]
+    assert parquet.read_table(str(tmp_path / 'period.parquet')).column('state').to_pylist() == ['FINISHED'] * 3
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy.orm import Session, sessionmaker
+
+from bot.leaderboard import Leaderboard, LeaderboardCache
+from bot.models import Guild, Period, Submission, Vote
+
+
+def test_leaderboard_ranks() -> None:
+    board = Leaderboard(1, [(1, 10, 3), (2, 20, 5), (3, 30, 3), (4, 40, 0), (5, 50, 1)])
+    assert [(entry.position, entry.submission, entry.count) for entry in board.ranks] == \
+           [(1, 2, 5), (2, 1, 3), (2, 3, 3), (3, 5, 1), (4, 4, 0)]
+    assert [entry.emote for entry in board.ranks] == [':trophy:', ':second_place:', ':second_place:', ':third_place:', '']
+
+    # A vote change moves only that submission and resets the cached ranks
+    board.update(4, 40, 6)
+    assert [entry.submission for entry in board.page(0, 2)] == [4, 2]
+    assert [entry.submission for entry in board.page(1, 2)] == [1, 3]
+    board.remove(2)
+    assert board.ranks[1].position == 2 and board.ranks[1].submission == 1 and len(board) == 4
+
+
+def test_leaderboard_render() -> None:
+    board = Leaderboard(1, [(1, 10, 1), (2, 20, 2)])
+    first = board.render(5, 6, page=0, count=1)
+    assert first == '`01` :trophy: <@20> with 2 votes [Jump](https://discord.com/channels/5/6/2)\n'
+    assert board.render(5, 6, page=0, count=1) is first
+    assert board.render(5, 6, page=1, count=1).startswith('`02` :second_place: <@10> with 1 vote ')
+
+    board.update(1, 10, 3)
+    assert board.render(5, 6, page=0, count=1).startswith('`01` :trophy: <@10> with 3 votes')
+
+
+def test_leaderboard_cache_tracking(SessionClass: sessionmaker) -> None:
+    Tracked = sessionmaker(bind=SessionClass.kw['bind'])
+    cache = LeaderboardCache()
+    cache.track(Tracked)
+
+    session: Session = Tracked()
+    guild = Guild(id=1)
+    period = Period(id=1, guild=guild)
+    sub1, sub2 = Submission(id=1, user=1, period=period), Submission(id=2, user=2, period=period)
+    session.add_all([guild, period, sub1, sub2])
+    session.commit()
+
+    board = cache.get(session, period.id)
+    assert [entry.count for entry in board.ranks] == [0, 0]
+
+    sub2.increment(3)
+    session.flush()
+    session.rollback()
+    assert board.ranks[0].count == 0
+
+    sub2.increment(3)
+    session.commit()
+    assert board.ranks[0].submission == 2 and board.ranks[0].count == 1
+
+    session.delete(sub1)
+    session.commit()
+    assert [entry.submission for entry in board.ranks] == [2]
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_cache_threads(SessionClass: sessionmaker) -> None:
+    Tracked = sessionmaker(bind=SessionClass.kw['bind'])
+    loop = asyncio.get_event_loop()
+    cache = LeaderboardCache(loop)
+    cache.track(Tracked)
+
+    session: Session = Tracked()
+    guild = Guild(id=4)
+    period = Period(id=4, guild=guild)
+    session.add_all([guild, period, Submission(id=40, user=1, period=period), Submission(id=41, user=2, period=period)])
+    session.commit()
+    board = cache.get(session, period.id)
+    threads = []
+    board.update = lambda *args: (threads.append(threading.current_thread()), Leaderboard.update(board, *args))
+
+    # Changes committed on another thread are applied on the loop, before the thread's caller resumes
+    def vote() -> None:
+        session.query(Submission).get(41).increment(3)
+        session.commit()
+
+    await loop.run_in_executor(None, vote)
+    assert threads == [threading.current_thread()]
+    assert board.ranks[0].submission == 41 and board.ranks[0].count == 1
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_cache_load(SessionClass: sessionmaker) -> None:
+    Tracked = sessionmaker(bind=SessionClass.kw['bind'])
+    cache = LeaderboardCache()
+    cache.track(Tracked)
+
+    session: Session = Tracked()
+    guild = Guild(id=5)
+    period = Period(id=5, guild=guild)
+    session.add_all([guild, period, Submission(id=50, user=1, period=period), Submission(id=51, user=2, period=period)])
+    session.commit()
+
+    async def run_read(func, *args):
+        board = func(session, *args)
+        # A vote is committed after the leaderboard was read, but before it is handed back
+        session.query(Submission).get(51).increment(3)
+        session.commit()
+        return board
+
+    board = await cache.load(5, run_read)
+    assert board.ranks[0].submission == 51 and board.ranks[0].count == 1
+    assert await cache.load(5, None) is board and len(cache._loading) == 0
+    session.close()
+
+
+def test_leaderboard_cache_bulk_delete(SessionClass: sessionmaker) -> None:
+    Tracked = sessionmaker(bind=SessionClass.kw['bind'])
+    cache = LeaderboardCache()
+    cache.track(Tracked)
+
+    session: Session = Tracked()
+    guild = Guild(id=2)
+    period = Period(id=2, guild=guild)
+    session.add_all([guild, period,
+                     Submission(id=11, user=1, period=period, votes=[2, 3]),
+                     Submission(id=12, user=2, period=period, votes=[4]),
+                     Submission(id=13, user=3, period=period)])
+    session.commit()
+    board = cache.get(session, period.id)
+
+    # Messages which are not submissions are skipped, and votes go along with their submissions
+    deleted, votes = Submission.delete_many(session, [11, 13, 14])
+    cache.removed(session, deleted)
+    assert (deleted, votes) == ([(11, 2), (13, 2)], 2)
+    assert len(board) == 3
+
+    session.commit()
+    assert [entry.submission for entry in board.ranks] == [12]
+    assert session.query(Vote).count() == 1
+    assert Submission.delete_many(session, [11, 13]) == ([], 0)
+    session.close()
+
+
+def test_leaderboard_cache_finished(SessionClass: sessionmaker) -> None:
+    Tracked = sessionmaker(bind=SessionClass.kw['bind'])
+    cache = LeaderboardCache()
+    cache.track(Tracked)
+
+    session: Session = Tracked()
+    guild = Guild(id=3)
+    period = Period(id=3, guild=guild)
+    session.add_all([guild, period])
+    session.commit()
+    for _ in range(3): period.advance_state()
+    session.add_all([Submission(id=21, user=1, period=period, votes=[2]), Submission(id=22, user=2, period=period, votes=[1])])
+    session.commit()
+
+    live = cache.get(session, period.id)
+    assert not live.final
+
+    # Finishing the period swaps the live leaderboard for one read from it's results, which ignores any later changes
+    period.advance_state()
+    session.commit()
+    board = cache.get(session, period.id)
+    assert board is not live and board.final
+    assert [(entry.position, entry.emote, entry.submission) for entry in board.ranks] == [(1, ':trophy:', 21), (1, ':trophy:', 22)]
+
+    session.query(Submission).get(22).votes = [1, 3]
+    session.delete(session.query(Submission).get(21))
+    session.commit()
+    assert [(entry.submission, entry.count) for entry in cache.get(session, period.id).ranks] == [(21, 1), (22, 1)]
+    session.close()
@@ -0,0 +1,79 @@
+import math
+from types import SimpleNamespace
+
+import aiohttp
+import discord
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from bot.metrics import Histogram, Metrics, MetricsServer
+from bot.models import Guild
+from main import load_db
+
+
+def test_histogram() -> None:
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.1, 2), (1.0, 3), (math.inf, 4)]
+    assert (histogram.quantile(0.5), histogram.quantile(0.75), histogram.quantile(1.0)) == (0.1, 1.0, math.inf)
+    assert histogram.sum == pytest.approx(2.65)
+
+
+@pytest.mark.asyncio
+async def test_metrics_instrumentation() -> None:
+    metrics = Metrics()
+
+    @metrics.timed('handler')
+    async def handler(fail: bool) -> bool:
+        if fail: raise ValueError()
+        return True
+
+    assert await handler(False) and handler.__name__ == 'handler'
+    with pytest.raises(ValueError):
+        await handler(True)
+
+    engine = load_db('sqlite:///')
+    metrics.instrument_engine(engine)
+    metrics.instrument_engine(engine)
+    session = Session(bind=engine)
+    session.query(Guild).all()
+    # Statements which fail are not timed, and leave nothing on their connection
+    with pytest.raises(OperationalError):
+        session.execute('SELECT * FROM missing')
+    session.close()
+    with engine.connect() as connection:
+        assert len(connection.info.get('metrics_started', [])) == 0
+
+    async def request(route, **kwargs):
+        if route.method == 'DELETE': raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+        return {}
+
+    http = SimpleNamespace(request=request)
+    metrics.instrument_http(http)
+    await http.request(discord.http.Route('GET', '/channels/{channel_id}/messages/{message_id}', channel_id=1, message_id=2))
+    with pytest.raises(discord.NotFound):
+        await http.request(discord.http.Route('DELETE', '/channels/{channel_id}/messages/{message_id}', channel_id=1, message_id=2))
+    metrics.gauge('queue_depth', 'Queued', lambda: 3)
+
+    text = metrics.render()
+    assert 'contest_handler_seconds_count{handler="handler"} 2' in text
+    assert 'contest_handler_errors_total{handler="handler"} 1' in text
+    assert 'contest_db_query_seconds_count 1' in text
+    assert 'contest_discord_http_requests_total{method="DELETE",result="404",route="/channels/{channel_id}/messages/{message_id}"} 1' in text
+    assert 'queue_depth 3' in text
+
+    summary = '\n'.join(metrics.summary())
+    assert '`handler` 2 calls' in summary and '1 errors' in summary
+    assert 'HTTP: 2 requests' in summary and 'Queued: 3' in summary
+
+    # The endpoint serves the same text
+    server = MetricsServer(metrics, host='127.0.0.1', port=0)
+    await server.start()
+    port = server._runner.addresses[0][1]
+    async with aiohttp.ClientSession() as client:
+        async with client.get(f'http://127.0.0.1:{port}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'queue_depth 3' in await response.text()
+    await server.stop()
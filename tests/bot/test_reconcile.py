@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from bot import constants
+from bot.bot import ContestBot
+from bot.constants import ReactionMarker
+from bot.models import Guild, Period, PeriodStates, Submission
+from main import load_db
+
+BOT_ID = 999
+
+
+class FakeReaction(object):
+    def __init__(self, users):
+        self.emoji = discord.PartialEmoji(name='upvote', id=constants.Emoji.UPVOTE)
+        self.me = BOT_ID in users
+        self.count = len(users)
+        self._users = users
+        self.paged = False
+
+    def users(self):
+        async def iterator():
+            self.paged = True
+            for user_id in self._users:
+                yield SimpleNamespace(id=user_id)
+
+        return iterator()
+
+
+class FakeMessage(object):
+    def __init__(self, message_id, users):
+        self.id = message_id
+        self.reactions = [FakeReaction(users)] if users else []
+        self.reacted = False
+
+    async def add_reaction(self, emoji) -> None:
+        self.reacted = True
+
+
+class FakeChannel(object):
+    def __init__(self, messages):
+        self.messages = messages
+
+    def history(self, limit=None, after=None, oldest_first=True):
+        async def iterator():
+            for message in self.messages:
+                if after is None or message.id > after.id:
+                    yield message
+
+        return iterator()
+
+
+@pytest.mark.asyncio
+async def test_reconcile_guild(monkeypatch) -> None:
+    messages = [FakeMessage(10, [BOT_ID, 2, 3]), FakeMessage(11, [BOT_ID, 4, 6, 2]), FakeMessage(13, [6, 7])]
+    bot = ContestBot(load_db('sqlite:///'))
+    removed = []
+
+    async def remove_vote_reactions(channel_id, markers) -> None:
+        removed.extend(markers)
+
+    monkeypatch.setattr(ContestBot, 'user', SimpleNamespace(id=BOT_ID))
+    monkeypatch.setattr(bot, 'get_channel', lambda channel_id: FakeChannel(messages))
+    monkeypatch.setattr(bot, 'remove_vote_reactions', remove_vote_reactions)
+
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period])
+        session.commit()
+        guild.current_period = period
+        for _ in range(3): period.advance_state()
+        session.add_all([Submission(id=10, user=1, period=period, votes=[2, 3]),
+                         Submission(id=11, user=2, period=period, votes=[4]),
+                         Submission(id=12, user=3, period=period, votes=[5]),
+                         Submission(id=13, user=4, period=period)])
+
+    report = await bot.reconciler.reconcile_guild(1)
+    assert report.submissions == 4
+    assert (report.votes_added, report.votes_removed, report.deleted, report.reactions_removed) == (3, 2, 1, 2)
+    assert sorted(removed) == [ReactionMarker(message=11, user=2), ReactionMarker(message=13, user=6)]
+
+    # Counts which already match are trusted without paging through the users
+    assert not messages[0].reactions[0].paged and messages[1].reactions[0].paged
+    assert messages[2].reacted and not messages[0].reacted
+
+    with bot.get_session() as session:
+        votes = {submission.id: sorted(submission.votes) for submission in session.query(Submission).all()}
+    assert votes == {10: [2, 3], 11: [4, 6], 13: [7]}
+
+
+@pytest.mark.asyncio
+async def test_reconcile_keeps_live_votes(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    live = []
+
+    class LiveChannel(FakeChannel):
+        def history(self, limit=None, after=None, oldest_first=True):
+            async def iterator():
+                # A vote arrives and is flushed while history is still being read
+                votes = await bot.vote_buffer.load(10)
+                votes.apply(10, 4, added=True)
+                live.append(await bot.vote_buffer.flush())
+                for message in self.messages:
+                    yield message
+
+            return iterator()
+
+    monkeypatch.setattr(ContestBot, 'user', SimpleNamespace(id=BOT_ID))
+    monkeypatch.setattr(bot, 'get_channel', lambda channel_id: LiveChannel([FakeMessage(10, [BOT_ID, 2, 3])]))
+
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period])
+        session.commit()
+        guild.current_period = period
+        for _ in range(3): period.advance_state()
+        session.add(Submission(id=10, user=1, period=period, votes=[2]))
+
+    report = await bot.reconciler.reconcile_guild(1)
+    assert report.votes_added == 1 and live == [0]  # Held until the reconciliation was written, then written on top of it
+    with bot.get_session() as session:
+        submission = session.query(Submission).get(10)
+        assert sorted(submission.votes) == [2, 3, 4] and submission.count == 3
+
+
+def voting_period(bot: ContestBot, submissions) -> None:
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period])
+        session.commit()
+        guild.current_period = period
+        for _ in range(3): period.advance_state()
+        session.add_all(Submission(period=period, **submission) for submission in submissions)
+
+
+@pytest.mark.asyncio
+async def test_reconcile_stale_period(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    monkeypatch.setattr(ContestBot, 'user', SimpleNamespace(id=BOT_ID))
+    monkeypatch.setattr(bot, 'get_channel', lambda channel_id: FakeChannel([]))
+    voting_period(bot, [dict(id=10, user=1, votes=[2])])
+    assert (await bot.guild_config(1)).period_id == 1
+
+    # The cached period is the one held while reconciling, so a newer period is left alone until the cache catches up
+    with bot.get_session() as session:
+        session.add(Period(id=2, guild_id=1, state=PeriodStates.VOTING))
+        session.commit()
+        session.query(Guild).get(1).current_period_id = 2
+        session.add(Submission(id=20, user=1, period_id=2, votes=[2]))
+
+    assert await bot.reconciler.reconcile_guild(1) is None
+    with bot.get_session() as session:
+        assert session.query(Submission).get(20).votes == [2]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_counts_deleted(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+
+    class DeletingChannel(FakeChannel):
+        def history(self, limit=None, after=None, oldest_first=True):
+            async def iterator():
+                # Submission 12's message is deleted, and it's row removed, while history is still being read
+                await bot.run_session(lambda session: session.query(Submission).filter_by(id=12).delete())
+                for message in self.messages:
+                    yield message
+
+            return iterator()
+
+    monkeypatch.setattr(ContestBot, 'user', SimpleNamespace(id=BOT_ID))
+    monkeypatch.setattr(bot, 'get_channel', lambda channel_id: DeletingChannel([FakeMessage(10, [BOT_ID, 2])]))
+    voting_period(bot, [dict(id=10, user=1, votes=[2]), dict(id=11, user=2), dict(id=12, user=3, votes=[4])])
+
+    report = await bot.reconciler.reconcile_guild(1)
+    assert (report.deleted, report.votes_removed) == (1, 0)
+    with bot.get_session() as session:
+        assert [submission.id for submission in session.query(Submission)] == [10]
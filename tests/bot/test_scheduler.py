@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from tests import fakes
+from bot.bot import ContestBot
+from bot.cogs.contest_commands import ContestCommandsCog
+from bot.models import Guild, Period, PeriodStates, Schedule
+from main import load_db
+
+
+def record_dispatches(monkeypatch, bot: ContestBot) -> asyncio.Queue:
+    """Routes the bot's dispatched events into a queue, so tests wait on them rather than sleeping."""
+    dispatched = asyncio.Queue()
+    monkeypatch.setattr(bot, 'dispatch', lambda event, *args: dispatched.put_nowait((event, *args)))
+    return dispatched
+
+
+async def next_dispatch(dispatched: asyncio.Queue) -> tuple:
+    return await asyncio.wait_for(dispatched.get(), 5)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_dispatches_in_order(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    dispatched = record_dispatches(monkeypatch, bot)
+
+    now = datetime.utcnow()
+    with bot.get_session() as session:
+        guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=guild)
+        session.add_all([guild, period])
+        session.commit()
+        # Overdue schedules, such as those missed while offline, are dispatched on start. Completed ones are never loaded.
+        session.add_all([Schedule(id=1, period=period, state=PeriodStates.READY, due=now - timedelta(minutes=5)),
+                         Schedule(id=2, period=period, state=PeriodStates.SUBMISSIONS, due=now - timedelta(minutes=10)),
+                         Schedule(id=3, period=period, state=PeriodStates.PAUSED, due=now, completed=True)])
+
+    await bot.scheduler.start()
+    await bot.scheduler.start()
+    assert [await next_dispatch(dispatched), await next_dispatch(dispatched)] == [('schedule_due', 2), ('schedule_due', 1)]
+    assert len(bot.scheduler) == 0
+
+    # Schedules added later wake the scheduler up, unless cancelled before they are due. Cancelled ones are not counted.
+    bot.scheduler.add(4, datetime.utcnow() + timedelta(seconds=0.05))
+    bot.scheduler.add(5, datetime.utcnow() + timedelta(seconds=0.02))
+    bot.scheduler.add(6, datetime.utcnow() + timedelta(seconds=0.03))
+    assert len(bot.scheduler) == 3
+    bot.scheduler.cancel(6)
+    assert len(bot.scheduler) == 2
+
+    # Schedule 6 fell due between the two, so it would have been dispatched before 4 if it were not cancelled
+    assert [await next_dispatch(dispatched), await next_dispatch(dispatched)] == [('schedule_due', 5), ('schedule_due', 4)]
+    assert dispatched.empty()
+    assert bot.scheduler.next_due is None and len(bot.scheduler) == 0
+
+    bot.scheduler.stop()
+    bot.database_executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_scheduled_advance(monkeypatch) -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    fake = fakes.FakeDiscord()
+    fake.attach(bot)
+    channel = fake.channel(100, 1)
+    guild = SimpleNamespace(id=1, default_role=None)
+    monkeypatch.setattr(bot, 'get_guild', lambda guild_id: guild if guild_id == guild.id else None)
+    dispatched = record_dispatches(monkeypatch, bot)
+    cog = ContestCommandsCog(bot)
+    ctx = SimpleNamespace(guild=guild, channel=channel, author=SimpleNamespace(id=7), send=channel.send)
+
+    with bot.get_session() as session:
+        _guild = Guild(id=1, submission_channel=100)
+        period = Period(id=1, guild=_guild)
+        session.add_all([_guild, period])
+        session.commit()
+        _guild.current_period = period
+    await bot.scheduler.start()
+
+    def period_state() -> PeriodStates:
+        with bot.get_session() as session:
+            return session.query(Period).get(1).state
+
+    def schedules() -> list:
+        with bot.get_session() as session:
+            return [(schedule.id, schedule.state, schedule.user_id, schedule.completed)
+                    for schedule in session.query(Schedule).order_by(Schedule.id)]
+
+    # Advancing with a duration schedules the next advancement for the state it left the period in
+    await cog.advance.callback(cog, ctx, 3600)
+    await cog.advance.callback(cog, ctx, 0)
+    assert period_state() == PeriodStates.PAUSED
+    assert channel.sent[-1]['embed'].description.startswith('The period will advance again in')
+
+    # Advancing by hand supersedes the schedule waiting on the state it left, so it is completed and no longer waited on
+    assert schedules() == [(1, PeriodStates.SUBMISSIONS, 7, True), (2, PeriodStates.PAUSED, 7, False)]
+
+    # Only the schedule which has fallen due is dispatched, and carrying it out advances the period and pings back it's user
+    assert await next_dispatch(dispatched) == ('schedule_due', 2)
+    assert len(bot.scheduler) == 0
+    await cog.on_schedule_due(2)
+    assert period_state() == PeriodStates.VOTING
+    assert channel.sent[-1]['content'] == '<@7>'
+
+    # The first schedule is stale once it falls due, as the period has already been advanced past it
+    sent = len(channel.sent)
+    await cog.on_schedule_due(1)
+    await cog.on_schedule_due(2)
+    assert period_state() == PeriodStates.VOTING
+    assert len(channel.sent) == sent
+    assert all(completed for *_, completed in schedules())
+
+    # Closing the period supersedes it's schedules too
+    await cog.advance.callback(cog, ctx)
+    await cog.advance.callback(cog, ctx)
+    await cog.advance.callback(cog, ctx, 3600)
+    assert len(bot.scheduler) == 1 and schedules()[-1] == (3, PeriodStates.SUBMISSIONS, 7, False)
+    await cog.close.callback(cog, ctx)
+    assert len(bot.scheduler) == 0 and schedules()[-1][-1]
+
+    bot.scheduler.stop()
+    bot.database_executor.shutdown()
@@ -0,0 +1,49 @@
+from sqlalchemy.orm import Session, sessionmaker
+
+from bot import stats
+from bot.models import Guild, Period, PeriodStats, Submission, UserStats
+
+
+def run_period(session: Session, guild: Guild, period_id: int, votes) -> Period:
+    period = Period(id=period_id, guild=guild)
+    session.add(period)
+    session.commit()
+    for _ in range(3): period.advance_state()
+    session.add_all([Submission(id=period_id * 100 + user, user=user, period=period, votes=voters) for user, voters in votes.items()])
+    session.commit()
+    period.advance_state()
+    session.commit()
+    return period
+
+
+def test_stats_recorded_on_finish(SessionClass: sessionmaker) -> None:
+    Tracked = sessionmaker(bind=SessionClass.kw['bind'])
+    stats.track(Tracked)
+    session: Session = Tracked()
+    guild = Guild(id=1)
+    session.add(guild)
+
+    run_period(session, guild, 1, {1: [2, 3], 2: [1]})
+    run_period(session, guild, 2, {1: [4], 3: [1, 4, 5]})
+    assert stats.user_summary(session, 1, 2).streak == 0
+    run_period(session, guild, 3, {1: [], 2: [1, 3]})
+
+    first = stats.user_summary(session, 1, 1)
+    assert (first.contests, first.wins, first.votes, first.best_position) == (3, 1, 3, 1)
+    assert first.average_votes == 1.0
+    assert (first.streak, first.best_streak) == (3, 3)
+
+    second = stats.user_summary(session, 1, 2)
+    assert (second.contests, second.wins, second.streak, second.best_streak) == (2, 1, 1, 1)
+    assert stats.user_summary(session, 1, 3).streak == 0
+    assert stats.user_summary(session, 1, 4) is None
+
+    assert [(summary.user, summary.wins) for summary in stats.top_winners(session, 1)] == [(1, 1), (2, 1), (3, 1)]
+    assert [(row.period, row.submissions, row.voters, row.votes, row.top_count) for row in stats.turnout(session, 1, limit=2)] \
+           == [(3, 2, 2, 2, 2), (2, 2, 3, 4, 3)]
+
+    # Statistics are only ever recorded once for each period
+    assert stats.record_period(session, session.query(Period).get(1)) is None
+    assert session.query(PeriodStats).count() == 3
+    assert session.query(UserStats).count() == 3
+    session.close()
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from bot.bot import ContestBot
+from bot.constants import ReactionMarker
+from bot.models import Guild, Period, PeriodStates, Submission, Vote
+from bot.votes import PeriodVotes, VoteBuffer
+from main import load_db
+
+
+def test_period_votes() -> None:
+    votes = PeriodVotes(1, {10: 100, 11: 101, 12: 102}, [(10, 5), (11, 6)])
+
+    # Self votes are refused, and double votes or removing a missing vote ask for a re-scan
+    assert votes.apply(10, 100, added=True) == (True, [ReactionMarker(message=10, user=100)])
+    assert votes.apply(10, 5, added=True) == (False, [])
+    assert votes.apply(12, 5, added=False) == (False, [])
+    assert len(votes.changes) == 0
+
+    # A new vote moves the user's vote from any other submission
+    assert votes.apply(12, 5, added=True) == (True, [ReactionMarker(message=10, user=5)])
+    assert (votes.count(10), votes.count(12)) == (0, 1) and votes.choices[5] == {12}
+    assert {key: added for key, (_, added, _) in votes.changes.items()} == {(10, 5): False, (12, 5): True}
+
+    # Changes undoing ones which were never written cancel out
+    assert votes.apply(12, 5, added=False) == (True, [])
+    assert votes.apply(10, 5, added=True) == (True, [])
+    assert len(votes.changes) == 0
+
+    assert votes.clear(11) == 1 and list(votes.changes) == [(11, 6)]
+    taken = votes.take()
+    votes.apply(11, 6, added=True)
+    votes.restore(taken)  # The failed removal and the newer vote cancel out
+    assert len(votes.changes) == 0 and votes.count(11) == 1
+
+    votes.apply(12, 7, added=True)
+    votes.forget(12)
+    assert len(votes.changes) == 0 and 12 not in votes.voters and votes.choices[7] == set()
+
+
+def populate(bot: ContestBot) -> None:
+    with bot.get_session() as session:
+        guild = Guild(id=1)
+        period = Period(id=1, guild=guild, state=PeriodStates.VOTING)
+        session.add_all([guild, period, Period(id=2, guild=guild, state=PeriodStates.FINISHED, active=False)])
+        session.add_all([Submission(id=10, user=100, period=period), Submission(id=11, user=101, period=period),
+                         Submission(id=20, user=100, period_id=2)])
+        session.flush()
+        session.query(Submission).get(10).votes = [5, 6]
+
+
+@pytest.mark.asyncio
+async def test_vote_buffer() -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    populate(bot)
+    buffer = VoteBuffer(bot, interval=60, max_changes=100)
+    assert await buffer.load(20) is None and await buffer.load(30) is None
+    votes = await buffer.load(10)
+    assert buffer.cached(11) is votes and votes.voters == {10: {5, 6}, 11: set()}
+
+    # Nothing is written until flushed, then every change is written in one transaction
+    with bot.get_session() as session:
+        board = bot.leaderboards.get(session, 1)
+    for user in range(7, 12):
+        votes.apply(11, user, added=True)
+    votes.apply(11, 5, added=True)
+    votes.apply(10, 6, added=False)
+    buffer.changed()
+    assert buffer.pending == 8
+
+    commits = []
+    event.listen(bot.engine, 'commit', lambda conn: commits.append(conn))
+    assert await buffer.flush() == 8
+    assert buffer.pending == 0 and len(commits) == 1
+    with bot.get_session() as session:
+        assert {vote.user_id for vote in session.query(Vote).filter_by(submission_id=11)} == {5, 7, 8, 9, 10, 11}
+        assert [(submission.id, submission.count) for submission in session.query(Submission).filter_by(period_id=1)] == [(10, 0), (11, 6)]
+    assert [(entry.submission, entry.count) for entry in board.ranks] == [(11, 6), (10, 0)]
+    assert bot.metrics.histogram('contest_vote_flush_size').count > 0
+
+    # Once voting is closed, everything pending is written and the period is never loaded again
+    votes.apply(10, 12, added=True)
+    await buffer.close_period(1)
+    assert buffer.cached(10) is None and await buffer.load(10) is None
+    with bot.get_session() as session:
+        assert session.query(Submission).get(10).count == 1
+
+    bot.database_executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_vote_buffer_scheduling() -> None:
+    bot = ContestBot(load_db('sqlite:///'))
+    populate(bot)
+    flushes = bot.metrics.histogram('contest_vote_flush_size')
+
+    async def flushed(count: int) -> None:
+        for _ in range(200):
+            if flushes.count >= count: return
+            await asyncio.sleep(0.01)
+        raise AssertionError('Buffered votes were not flushed.')
+
+    # Flushed once enough changes are pending, and otherwise once the interval passes
+    buffer = VoteBuffer(bot, interval=60, max_changes=3)
+    votes = await buffer.load(10)
+    start = flushes.count
+    for user in (7, 8, 9):
+        votes.apply(11, user, added=True)
+        buffer.changed()
+    await flushed(start + 1)
+
+    buffer.interval = 0.01
+    votes.apply(11, 12, added=True)
+    buffer.changed()
+    await flushed(start + 2)
+    assert buffer.pending == 0
+    with bot.get_session() as session:
+        assert session.query(Submission).get(11).count == 4
+
+    bot.database_executor.shutdown()
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+from bot.bot import ContestBot
+from bot.models import Guild
+from main import load_db
+
+
+@pytest.mark.asyncio
+async def test_database_writer(tmp_path) -> None:
+    bot = ContestBot(load_db(f'sqlite:///{tmp_path / "database.db"}'))
+    threads = set()
+    writes = bot.metrics.histogram('contest_db_write_seconds', operation='add_guild')
+    start = writes.count
+
+    def add_guild(session, guild_id: int) -> int:
+        threads.add(threading.current_thread().name)
+        session.add(Guild(id=guild_id))
+        return guild_id
+
+    # Operations are applied one at a time in the order they were queued, all on the writer's own thread
+    assert await asyncio.gather(*(bot.run_session(add_guild, guild_id) for guild_id in range(1, 21))) == list(range(1, 21))
+    assert len(threads) == 1 and threads.pop().startswith('database-writer')
+    assert writes.count == start + 20
+
+    # A failed operation is rolled back and raised to it's caller, without affecting the next
+    def fail(session) -> None:
+        session.query(Guild).get(1).prefix = '!'
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        await bot.run_session(fail)
+    await bot.run_session(add_guild, 21)
+    with bot.read_session() as session:
+        assert session.query(Guild).get(1).prefix != '!' and session.query(Guild).count() == 21
+
+    await bot.writer.close()
+    assert len(bot.writer) == 0
+    bot.database_executor.shutdown()
+    bot.engine.dispose()
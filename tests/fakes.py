@@ -0,0 +1,280 @@
+import bisect
+import io
+import logging
+import random
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING, Tuple
+
+import discord
+
+from bot import constants
+from bot.models import Guild, Period, PeriodStates, Submission, Vote
+from bot.replay import BOT_USER_ID
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm import Session
+    from bot.bot import ContestBot
+
+logger = logging.getLogger(__file__)
+logger.setLevel(constants.LOGGING_LEVEL)
+
+# A guild generated by `populate`. Submissions maps each Submission ID to the User IDs that voted for it.
+SyntheticGuild = namedtuple('SyntheticGuild', ['id', 'channel', 'period', 'submissions', 'voters'])
+
+
+def upvote() -> discord.PartialEmoji:
+    """The upvote emoji, as it appears in reaction events."""
+    return discord.PartialEmoji(name='upvote', id=constants.Emoji.UPVOTE)
+
+
+def reaction_event(guild_id: int, channel_id: int, message_id: int, user_id: int, added: bool = True,
+                   emoji: Optional[discord.PartialEmoji] = None) -> discord.RawReactionActionEvent:
+    """Builds the raw event Discord sends when a reaction is added or removed."""
+    data = {'guild_id': guild_id, 'channel_id': channel_id, 'message_id': message_id, 'user_id': user_id}
+    return discord.RawReactionActionEvent(data, emoji or upvote(), 'REACTION_ADD' if added else 'REACTION_REMOVE')
+
+
+def bulk_delete_event(guild_id: int, channel_id: int, message_ids: Iterable[int]) -> discord.RawBulkMessageDeleteEvent:
+    """Builds the raw event Discord sends when messages are purged."""
+    return discord.RawBulkMessageDeleteEvent({'guild_id': guild_id, 'channel_id': channel_id, 'ids': list(message_ids)})
+
+
+class FakeReaction(object):
+    """A reaction on a `FakeMessage`, exposing the parts of `discord.Reaction` the bot reads."""
+
+    def __init__(self, emoji: discord.PartialEmoji, users: Iterable[int] = ()) -> None:
+        self.emoji = emoji
+        self.user_ids: List[int] = list(dict.fromkeys(users))
+
+    @property
+    def count(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def me(self) -> bool:
+        return BOT_USER_ID in self.user_ids
+
+    def users(self):
+        async def iterator():
+            for user_id in list(self.user_ids):
+                yield SimpleNamespace(id=user_id, bot=user_id == BOT_USER_ID)
+
+        return iterator()
+
+
+class FakeAttachment(object):
+    """A attachment on a `FakeMessage`. It's contents are empty unless given, so it is never hashed."""
+
+    def __init__(self, width: Optional[int] = None, spoiler: bool = False, data: bytes = b'', attachment_id: int = 0,
+                 size: Optional[int] = None) -> None:
+        self.id = attachment_id
+        self.width = width
+        self.spoiler = spoiler
+        self.data = data
+        self.size = size if size is not None else len(data)
+        self.reads = 0
+
+    def is_spoiler(self) -> bool:
+        return self.spoiler
+
+    async def read(self) -> bytes:
+        self.reads += 1
+        return self.data
+
+
+class FakeMessage(object):
+    """A message held in memory by a `FakeChannel`. Doubles as it's own partial message."""
+
+    def __init__(self, channel: 'FakeChannel', message_id: int, author_id: int = 0, attachments: Iterable = ()) -> None:
+        self.channel = channel
+        self.id = message_id
+        self.author = SimpleNamespace(id=author_id, bot=False, display_name=str(author_id))
+        self.guild = SimpleNamespace(id=channel.guild_id)
+        self.created_at = discord.utils.snowflake_time(message_id)
+        self.attachments = list(attachments)
+        self.reactions: List[FakeReaction] = []
+        self.deleted = False
+
+    def reaction(self, emoji: discord.PartialEmoji) -> FakeReaction:
+        for reaction in self.reactions:
+            if reaction.emoji == emoji: return reaction
+        reaction = FakeReaction(emoji)
+        self.reactions.append(reaction)
+        return reaction
+
+    async def add_reaction(self, emoji) -> None:
+        self.channel.discord.calls['add_reaction'] += 1
+        reaction = self.reaction(emoji)
+        if BOT_USER_ID not in reaction.user_ids: reaction.user_ids.append(BOT_USER_ID)
+
+    async def remove_reaction(self, emoji, member) -> None:
+        self.channel.discord.calls['remove_reaction'] += 1
+        reaction = self.reaction(emoji)
+        if member.id in reaction.user_ids: reaction.user_ids.remove(member.id)
+
+    async def delete(self, delay: Optional[float] = None) -> None:
+        self.channel.discord.calls['delete'] += 1
+        self.deleted = True
+        self.channel.remove(self.id)
+
+
+class FakeChannel(object):
+    """A text channel held in memory, serving it's history in pages of 100 like Discord does."""
+
+    def __init__(self, discord_: 'FakeDiscord', channel_id: int, guild_id: int) -> None:
+        self.discord = discord_
+        self.id = channel_id
+        self.guild_id = guild_id
+        self.guild = SimpleNamespace(id=guild_id)
+        self.messages: Dict[int, FakeMessage] = {}
+        self._order: List[int] = []  # Message IDs, oldest first
+        self.sent: List[dict] = []
+
+    def add(self, message_id: int, author_id: int = 0, voters: Optional[Iterable[int]] = None, attachments: Iterable = ()) -> FakeMessage:
+        """Adds a message to the channel. If voters are given, it is given a upvote reaction from the bot and each voter."""
+        message = FakeMessage(self, message_id, author_id, attachments)
+        if voters is not None: message.reactions.append(FakeReaction(upvote(), [BOT_USER_ID, *voters]))
+        self.messages[message_id] = message
+        bisect.insort(self._order, message_id)
+        return message
+
+    def remove(self, message_id: int) -> None:
+        if self.messages.pop(message_id, None) is not None:
+            del self._order[bisect.bisect_left(self._order, message_id)]
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return self.messages.get(message_id) or FakeMessage(self, message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        self.discord.calls['fetch_message'] += 1
+        if message_id not in self.messages: raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+        return self.messages[message_id]
+
+    def history(self, limit: Optional[int] = None, after=None, oldest_first: bool = True):
+        async def iterator():
+            start = bisect.bisect_right(self._order, after.id) if after is not None else 0
+            ids = self._order[start:] if oldest_first else self._order[start:][::-1]
+            for index, message_id in enumerate(ids[:limit] if limit is not None else ids):
+                if index % 100 == 0: self.discord.calls['history'] += 1
+                message = self.messages.get(message_id)
+                if message is not None: yield message
+
+        return iterator()
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> None:
+        self.discord.calls['send'] += 1
+        self.sent.append(dict(content=content, **kwargs))
+
+    async def set_permissions(self, target, overwrite=None, **kwargs) -> None:
+        self.discord.calls['set_permissions'] += 1
+
+
+class FakeDiscord(object):
+    """
+    Stands in for the Discord API, serving channels, messages and reactions from memory.
+
+    Attaching it to a bot replaces the lookups the bot makes through it's client, so event handlers can be driven entirely
+    in-process by raw events. Every API call the bot would have made is counted in `calls`.
+    """
+
+    def __init__(self) -> None:
+        self.user = SimpleNamespace(id=BOT_USER_ID, name='Contest Assistant', discriminator='0000', bot=True)
+        self.channels: Dict[int, FakeChannel] = {}
+        self.calls: Counter = Counter()
+
+    def channel(self, channel_id: int, guild_id: int) -> FakeChannel:
+        """Returns a channel, creating it if it does not exist yet."""
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(self, channel_id, guild_id)
+        return self.channels[channel_id]
+
+    def add_guild(self, guild: SyntheticGuild) -> FakeChannel:
+        """Fills a guild's submission channel with it's generated submissions, with a reaction from each of their voters."""
+        channel = self.channel(guild.channel, guild.id)
+        for submission_id, (user_id, voters) in guild.submissions.items():
+            channel.add(submission_id, author_id=user_id, voters=voters)
+        return channel
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+    @staticmethod
+    def get_emoji(emoji_id: int) -> discord.PartialEmoji:
+        return discord.PartialEmoji(name='emoji', id=emoji_id)
+
+    def attach(self, bot: 'ContestBot') -> None:
+        """Points the bot's user, channel and emoji lookups at this fake."""
+        bot._connection.user = self.user
+        bot.get_channel = self.get_channel
+        bot.get_emoji = self.get_emoji
+
+
+def image(seed: int, size: Tuple[int, int] = (320, 240), image_format: str = 'PNG', quality: int = 95) -> bytes:
+    """Draws a image of random blurred blocks, standing in for a photograph. Requires Pillow."""
+    from PIL import Image, ImageFilter
+
+    rng = random.Random(seed)
+    drawn = Image.new('RGB', (16, 12))
+    drawn.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(16 * 12)])
+    drawn = drawn.resize(size, Image.NEAREST).filter(ImageFilter.GaussianBlur(4))
+
+    output = io.BytesIO()
+    drawn.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+def populate(session: 'Session', votes: int, guilds: int = 1, votes_per_submission: int = 10,
+             seed: int = 0) -> List[SyntheticGuild]:
+    """
+    Generates guilds, each with a period in it's voting state, submissions and votes, using bulk inserts.
+
+    Every voter votes for exactly one submission in their guild, as the bot allows, so votes are spread randomly but never
+    duplicated or cast on the voter's own submission.
+
+    :param session: A SQLAlchemy session to insert with. It is committed before returning.
+    :param votes: The total number of votes to generate, split evenly between guilds.
+    :param guilds: The number of guilds to generate.
+    :param votes_per_submission: The average number of votes each submission receives.
+    :param seed: The seed used to spread votes between submissions.
+    """
+    rng = random.Random(seed)
+    generated = []
+    message_id = 10 ** 6  # Message IDs increase like snowflakes, so history is ordered.
+    user_id = BOT_USER_ID + 1
+
+    guild_rows, period_rows, submission_rows, vote_rows = [], [], [], []
+    for guild_id in range(1, guilds + 1):
+        guild_votes = votes // guilds + (1 if guild_id <= votes % guilds else 0)
+        submission_count = max(1, guild_votes // votes_per_submission)
+
+        submissions = {}
+        for _ in range(submission_count):
+            submissions[message_id] = (user_id, [])
+            message_id += 1
+            user_id += 1
+        voters = range(user_id, user_id + guild_votes)
+        user_id += guild_votes
+
+        submission_ids = list(submissions)
+        for voter in voters:
+            submissions[rng.choice(submission_ids)][1].append(voter)
+
+        channel_id = guild_id * 10
+        guild_rows.append({'id': guild_id, 'prefix': '$', 'submission_channel': channel_id, 'current_period_id': guild_id,
+                           'active': True})
+        period_rows.append({'id': guild_id, 'guild_id': guild_id, 'state': PeriodStates.VOTING, 'active': True, 'completed': False})
+        for submission_id, (author, submission_voters) in submissions.items():
+            submission_rows.append({'id': submission_id, 'user': author, 'period_id': guild_id, 'count': len(submission_voters)})
+            vote_rows.extend({'submission_id': submission_id, 'user_id': voter, 'period_id': guild_id} for voter in submission_voters)
+
+        generated.append(SyntheticGuild(id=guild_id, channel=channel_id, period=guild_id, submissions=submissions, voters=voters))
+
+    session.bulk_insert_mappings(Guild, guild_rows)
+    session.bulk_insert_mappings(Period, period_rows)
+    session.bulk_insert_mappings(Submission, submission_rows)
+    session.bulk_insert_mappings(Vote, vote_rows)
+    session.commit()
+
+    logger.debug(f'Generated {guilds} guilds, {len(submission_rows)} submissions and {len(vote_rows)} votes.')
+    return generated